@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2017 Jonathan Bouzekri
+#
+# This file is part of the gmalt application
+#
+# MIT License :
+# https://raw.githubusercontent.com/gmalt/api/master/LICENSE.txt
+
+""" Compare the ASGI application with the WSGI handler served by
+:class:`gmaltapi.server.GmaltServer` on a synthetic SRTM3 tile ::
+
+    python benchmarks/asgi_vs_gevent.py [--requests 5000] [--clients 8]
+
+The in-process part calls both applications directly to measure the cost
+of a request without a server. The HTTP part starts the gevent server and,
+if installed, uvicorn in a subprocess and sends GET /altitude requests over
+keep-alive connections.
+"""
+
+import argparse
+import asyncio
+import http.client
+import io
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from gmaltapi.asgi import ASGIHandler  # noqa
+from gmaltapi.handler import WSGIHandler  # noqa
+from gmaltapi.handlers.file import Handler as FileHandler  # noqa
+
+SERVERS = {
+    'gevent': [sys.executable, '-c', 'import sys; from gmaltapi.admin import '
+               'run_server; sys.exit(run_server())', '{conf}'],
+    'uvicorn': [sys.executable, '-m', 'uvicorn', '--factory',
+                '--host', '127.0.0.1', '--port', '{port}', '--log-level',
+                'warning', 'gmaltapi.asgi:create_app'],
+}
+
+
+def write_tile(folder, name='N00E010.hgt', size=1201):
+    """ Write a deterministic SRTM3 tile """
+    values = numpy.arange(size * size, dtype='>i2').reshape(size, size) % 4000
+    values.tofile(os.path.join(folder, name))
+
+
+def positions(count, seed=42):
+    rand = random.Random(seed)
+    return [(rand.uniform(0, 1), rand.uniform(10, 11)) for _ in range(count)]
+
+
+def report(name, durations, elapsed=None):
+    durations = sorted(durations)
+    elapsed = elapsed or sum(durations)
+    print('{:<28} {:>10.0f} req/s  p50 {:>7.1f}us  p99 {:>7.1f}us'.format(
+        name, len(durations) / elapsed,
+        durations[len(durations) // 2] * 1e6,
+        durations[int(len(durations) * 0.99)] * 1e6
+    ))
+
+
+def bench_in_process(folder, count):
+    """ Call the WSGI and the ASGI applications without a server """
+    wsgi_app = WSGIHandler(FileHandler(folder))
+    asgi_app = ASGIHandler(WSGIHandler(FileHandler(folder)))
+    queries = ['lat={}&lng={}'.format(lat, lng)
+               for lat, lng in positions(count)]
+
+    def start_response(status, headers):
+        pass
+
+    durations = []
+    for query in queries:
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/altitude',
+                   'QUERY_STRING': query, 'wsgi.input': io.BytesIO()}
+        start = time.perf_counter()
+        b''.join(wsgi_app(environ, start_response))
+        durations.append(time.perf_counter() - start)
+    report('WSGIHandler.__call__', durations)
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        pass
+
+    async def run():
+        durations = []
+        for query in queries:
+            scope = {'type': 'http', 'method': 'GET', 'path': '/altitude',
+                     'query_string': query.encode('ascii'), 'headers': [],
+                     'root_path': '', 'scheme': 'http',
+                     'server': ('127.0.0.1', 8088)}
+            start = time.perf_counter()
+            await asgi_app(scope, receive, send)
+            durations.append(time.perf_counter() - start)
+        return durations
+
+    report('ASGIHandler.__call__', asyncio.run(run()))
+    print('  ASGI inline {} / offloaded {}'.format(
+        asgi_app.inline, asgi_app.offloaded))
+    asgi_app.close()
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def wait_port(port, timeout=10):
+    end = time.time() + timeout
+    while time.time() < end:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.1).close()
+            return True
+        except socket.error:
+            time.sleep(0.1)
+    return False
+
+
+def bench_http(name, folder, count, clients):
+    """ Send GET /altitude requests over keep-alive connections to a
+    server started in a subprocess """
+    port = free_port()
+    conf = os.path.join(folder, 'gmalt.cfg')
+    with open(conf, 'w') as conf_file:
+        conf_file.write('[server]\nhost = 127.0.0.1\nport = {}\nhandler = file'
+                        '\n\n[handler]\nfolder = {}\n'.format(port, folder))
+    command = [arg.format(conf=conf, port=port) for arg in SERVERS[name]]
+    env = dict(os.environ, GMALT_CONFIG=conf, PYTHONPATH=ROOT)
+    server = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+    try:
+        if not wait_port(port):
+            print('{:<28} failed to start'.format(name))
+            return
+        queries = ['/altitude?lat={}&lng={}'.format(lat, lng)
+                   for lat, lng in positions(count)]
+        durations = []
+
+        def client(part):
+            conn = http.client.HTTPConnection('127.0.0.1', port)
+            for url in part:
+                start = time.perf_counter()
+                conn.request('GET', url)
+                conn.getresponse().read()
+                durations.append(time.perf_counter() - start)
+            conn.close()
+
+        threads = [threading.Thread(target=client, args=(queries[i::clients],))
+                   for i in range(clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        report('{} ({} clients)'.format(name, clients), durations, elapsed)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--clients', type=int, default=8)
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix='gmaltbench')
+    try:
+        write_tile(folder)
+        bench_in_process(folder, args.requests)
+        bench_http('gevent', folder, args.requests, args.clients)
+        try:
+            import uvicorn  # noqa
+        except ImportError:
+            print('uvicorn is not installed, skipping the ASGI server')
+        else:
+            bench_http('uvicorn', folder, args.requests, args.clients)
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    main()
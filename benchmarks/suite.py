@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2017 Jonathan Bouzekri
+#
+# This file is part of the gmalt application
+#
+# MIT License :
+# https://raw.githubusercontent.com/gmalt/api/master/LICENSE.txt
+
+""" Micro-benchmarks of the lookup and request paths on synthetic tiles ::
+
+    python benchmarks/suite.py [--save results.json]
+        [--baseline results.json] [--threshold 0.25] [-k wsgi]
+
+Deterministic SRTM1 and SRTM3 tiles are generated in a temporary folder
+(about 60 MB), so the suite runs offline. Each benchmark reports the
+number of operations per second and the percentiles of the duration of an
+operation. With `--baseline`, the command fails if the operations per
+second of a benchmark dropped by more than `--threshold` (a ratio).
+"""
+
+from __future__ import print_function
+
+import argparse
+import functools
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import gevent
+import numpy
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from gmaltapi.app import App  # noqa
+from gmaltapi.coalesce import CoalescingHandler  # noqa
+from gmaltapi.handler import WSGIHandler  # noqa
+from gmaltapi.handlers.file import Handler as FileHandler  # noqa
+
+clock = getattr(time, 'perf_counter', time.time)
+
+#: the cells of the synthetic tiles of each resolution
+CELLS = {'srtm1': [(45, 6), (45, 7)],
+         'srtm3': [(45, 6), (45, 7), (46, 6), (46, 7)]}
+
+#: number of values per line of each resolution
+SAMPLES = {'srtm1': 3601, 'srtm3': 1201}
+
+#: the registered benchmarks, see :func:`benchmark`
+BENCHMARKS = []
+
+
+def benchmark(name):
+    """ Register a benchmark. The decorated function gets the folder of the
+    tiles and returns a tuple (function running one operation, number of
+    items of an operation)
+    """
+    def decorator(func):
+        BENCHMARKS.append((name, func))
+        return func
+    return decorator
+
+
+def write_tiles(folder):
+    """ Write the synthetic tiles : a smooth relief with noise and a few
+    voids, the same for every run """
+    for resolution, cells in sorted(CELLS.items()):
+        os.mkdir(os.path.join(folder, resolution))
+        samples = SAMPLES[resolution]
+        axis = numpy.linspace(0, 6 * numpy.pi, samples)
+        for lat, lng in cells:
+            rand = numpy.random.RandomState(lat * 1000 + lng)
+            values = 1500 + 800 * numpy.outer(numpy.sin(axis + lat),
+                                              numpy.cos(axis + lng))
+            values += rand.normal(0, 20, values.shape)
+            values = values.astype('>i2')
+            values.flat[rand.randint(0, values.size, 100)] = -32768
+            values.tofile(os.path.join(folder, resolution,
+                                       'N{:02d}E{:03d}.hgt'.format(lat, lng)))
+
+
+def positions(resolution, count, seed=42):
+    """ Random positions in the synthetic tiles of a resolution """
+    rand = random.Random(seed)
+    cells = CELLS[resolution]
+    result = []
+    for _ in range(count):
+        lat, lng = rand.choice(cells)
+        result.append((lat + rand.random(), lng + rand.random()))
+    return result
+
+
+def cycle(items):
+    """ Endless iterator returning the next item at each call """
+    state = {'idx': -1}
+
+    def next_item():
+        state['idx'] = (state['idx'] + 1) % len(items)
+        return items[state['idx']]
+    return next_item
+
+
+def _get_altitude_cold(folder, resolution):
+    # a single tile is kept mapped and the positions alternate between the
+    # tiles, so each lookup maps a tile (the file stays in the page cache)
+    handler = FileHandler(os.path.join(folder, resolution), cache_max_tiles=1)
+    cells = CELLS[resolution]
+    next_position = cycle([(lat + 0.5, lng + 0.5) for lat, lng in cells])
+    return lambda: handler.get_altitude(*next_position()), 1
+
+
+def _get_altitude_warm(folder, resolution):
+    handler = FileHandler(os.path.join(folder, resolution))
+    next_position = cycle(positions(resolution, 10000))
+    for _ in range(len(CELLS[resolution])):
+        handler.get_altitude(*next_position())
+    return lambda: handler.get_altitude(*next_position()), 1
+
+
+def _get_altitudes(folder, resolution, interpolation, size=10000):
+    handler = FileHandler(os.path.join(folder, resolution))
+    lats, lngs = numpy.array(positions(resolution, size)).T
+    handler.get_altitudes(lats, lngs)
+    return lambda: handler.get_altitudes(lats, lngs, interpolation), size
+
+
+for _resolution in sorted(SAMPLES):
+    benchmark('get_altitude_cold[{}]'.format(_resolution))(
+        functools.partial(_get_altitude_cold, resolution=_resolution))
+    benchmark('get_altitude_warm[{}]'.format(_resolution))(
+        functools.partial(_get_altitude_warm, resolution=_resolution))
+    for _interpolation in ('nearest', 'bilinear'):
+        benchmark('get_altitudes[{},{}]'.format(_resolution, _interpolation))(
+            functools.partial(_get_altitudes, resolution=_resolution,
+                              interpolation=_interpolation))
+
+
+class RoundTripHandler(object):
+    """ A handler paying a fixed cost per call, like the round trip of a
+    database query """
+    ROUND_TRIP = 0.0001
+
+    def __init__(self, alt_handler):
+        self.alt_handler = alt_handler
+
+    def get_altitude(self, lat, lng, interpolation=None):
+        time.sleep(self.ROUND_TRIP)
+        return self.alt_handler.get_altitude(lat, lng, interpolation)
+
+    def get_altitudes(self, lats, lngs, interpolation=None):
+        time.sleep(self.ROUND_TRIP)
+        return self.alt_handler.get_altitudes(lats, lngs, interpolation)
+
+
+def _concurrent_get_altitude(folder, round_trip, coalesce, count=1000):
+    # one greenlet per lookup, as with concurrent single position requests
+    handler = FileHandler(os.path.join(folder, 'srtm3'))
+    handler.get_altitudes(*numpy.array(positions('srtm3', count)).T)
+    if round_trip:
+        handler = RoundTripHandler(handler)
+    if coalesce:
+        handler = CoalescingHandler(handler, 0)
+    points = positions('srtm3', count)
+
+    def run():
+        gevent.joinall([gevent.spawn(handler.get_altitude, lat, lng)
+                        for lat, lng in points], raise_error=True)
+    return run, count
+
+
+for _round_trip in (False, True):
+    for _coalesce in (False, True):
+        benchmark('concurrent_get_altitude[{},{}]'.format(
+            'round_trip' if _round_trip else 'file',
+            'coalesced' if _coalesce else 'direct'
+        ))(functools.partial(_concurrent_get_altitude, round_trip=_round_trip,
+                             coalesce=_coalesce))
+
+
+def _wsgi_call(folder, method, queries, body=b'',
+               content_type='application/json'):
+    wsgi_app = WSGIHandler(FileHandler(os.path.join(folder, 'srtm3')))
+    next_query = cycle(queries)
+
+    def start_response(status, headers):
+        pass
+
+    def call():
+        environ = {'REQUEST_METHOD': method, 'PATH_INFO': '/altitude',
+                   'QUERY_STRING': next_query(), 'CONTENT_TYPE': content_type,
+                   'CONTENT_LENGTH': str(len(body)),
+                   'wsgi.input': io.BytesIO(body)}
+        return b''.join(wsgi_app(environ, start_response))
+    call()
+    return call, 1
+
+
+@benchmark('wsgi_call[fast_path]')
+def wsgi_call_fast_path(folder):
+    return _wsgi_call(folder, 'GET', [
+        'lat={}&lng={}'.format(lat, lng)
+        for lat, lng in positions('srtm3', 10000)
+    ])
+
+
+@benchmark('wsgi_call[full_stack]')
+def wsgi_call_full_stack(folder):
+    return _wsgi_call(folder, 'GET', [
+        'lat={}&lng={}&interpolation=nearest'.format(lat, lng)
+        for lat, lng in positions('srtm3', 10000)
+    ])
+
+
+@benchmark('wsgi_call[post_100]')
+def wsgi_call_post_batch(folder):
+    body = json.dumps(positions('srtm3', 100)).encode('utf-8')
+    return _wsgi_call(folder, 'POST', [''], body)
+
+
+@benchmark('startup[file]')
+def startup(folder):
+    conf_file = os.path.join(folder, 'gmalt.cfg')
+    with open(conf_file, 'w') as conf:
+        conf.write('[server]\nhandler = file\n\n[handler]\nfolder = {}\n'
+                   .format(os.path.join(folder, 'srtm1')))
+    return lambda: App(conf_file), 1
+
+
+def measure(func, items, min_time, min_runs=5):
+    """ Run an operation until `min_time` seconds and `min_runs` runs are
+    reached
+
+    :return: dict with the `ops_per_sec` (items per second), the number of
+        `runs` and the `p50`, `p90` and `p99` durations of a run in seconds
+    :rtype: dict
+    """
+    durations = []
+    end = clock() + min_time
+    while len(durations) < min_runs or clock() < end:
+        start = clock()
+        func()
+        durations.append(clock() - start)
+    durations.sort()
+
+    def percentile(ratio):
+        return durations[min(len(durations) - 1, int(len(durations) * ratio))]
+    return {'ops_per_sec': items * len(durations) / sum(durations),
+            'runs': len(durations), 'p50': percentile(0.5),
+            'p90': percentile(0.9), 'p99': percentile(0.99)}
+
+
+def compare(results, baseline, threshold):
+    """ Find the benchmarks slower than the baseline
+
+    :param dict results: the results by benchmark name
+    :param dict baseline: the reference results by benchmark name
+    :param float threshold: the allowed ratio of decrease of the operations
+        per second
+    :return: list of tuples (name, ratio of the operations per second to
+        the baseline)
+    :rtype: list
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        ratio = result['ops_per_sec'] / reference['ops_per_sec']
+        if ratio < 1 - threshold:
+            regressions.append((name, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-k', dest='keyword', default='',
+                        help='only run the benchmarks containing KEYWORD')
+    parser.add_argument('--min-time', type=float, default=1.0,
+                        help='minimum duration of a benchmark in seconds')
+    parser.add_argument('--save', help='write the results to a JSON file')
+    parser.add_argument('--baseline',
+                        help='JSON file of results to compare with')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='maximum decrease ratio of the operations per '
+                             'second compared to the baseline')
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix='gmaltbench')
+    results = {}
+    try:
+        write_tiles(folder)
+        print('{:<44} {:>12} {:>10} {:>10} {:>10}'.format(
+            'benchmark', 'ops/s', 'p50 (us)', 'p90 (us)', 'p99 (us)'))
+        for name, setup in BENCHMARKS:
+            if args.keyword not in name:
+                continue
+            func, items = setup(folder)
+            result = results[name] = measure(func, items, args.min_time)
+            print('{:<44} {:>12.0f} {:>10.1f} {:>10.1f} {:>10.1f}'.format(
+                name, result['ops_per_sec'], result['p50'] * 1e6,
+                result['p90'] * 1e6, result['p99'] * 1e6))
+    finally:
+        shutil.rmtree(folder)
+
+    if args.save:
+        with open(args.save, 'w') as result_file:
+            json.dump(results, result_file, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(results, baseline, args.threshold)
+        for name, ratio in regressions:
+            print('REGRESSION {} : {:.0%} of the baseline'.format(name, ratio))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -13,37 +13,77 @@ from gevent import monkey
 monkey.patch_all()  # noqa
 
 import argparse
+import logging
 import os
 
 from .app import App
+from .pack import pack_folder
 
 
 def run_server(*args, **kwargs):
     """ Called by console_scripts `gmalt-server` to launch the
     gevent API web server
 
-    Usage : `gmalt-server conf/gmalt.cfg`
+    Usage : `gmalt-server conf/gmalt.cfg` or `gmalt-server -w 4
+    conf/gmalt.cfg` to override the number of worker processes
     """
     parser = argparse.ArgumentParser()
     parser.add_argument('config', help='configuration file')
-    parser.set_defaults(go=lambda config: App(config).start_server())
+    parser.add_argument('-w', '--workers', type=int,
+                        help='number of worker processes (default to the '
+                             'workers of the server section)')
+    parser.set_defaults(go=lambda config, workers: App(config).start_server(
+        workers=workers
+    ))
     args = parser.parse_args()
 
     if not os.path.isfile(args.config):
         parser.error('Configuration file "%s" doesn\'t exist' % args.config)
+    if args.workers is not None and args.workers < 1:
+        parser.error('The number of workers must be at least 1')
 
-    status_code = args.go(args.config)
+    status_code = args.go(args.config, args.workers)
 
     return status_code or 0
 
 
 def run_worker(*args, **kwargs):
-    """ Called by console_scripts `gmalt-api-worker` to launch the workers
+    """ Called by console_scripts `gmalt-worker` to launch the workers
 
-    It is a wrapper around the standard `celery` command. It accepts the same
-    arguments with an additionnal option `-gmalt-config`
+    It is a wrapper around the standard `celery worker` command. It accepts
+    the same arguments with an additionnal option `--gmalt-config`
 
-    Usage : `gmalt-file-server -P gevent -c 10 -gmalt-config conf/gmal.cfg`
+    Usage : `gmalt-worker -P gevent -c 10 --gmalt-config conf/gmalt.cfg`
     """
-    app = App('conf/gmalt.cfg.dev')
-    app.start_worker()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--gmalt-config', required=True,
+                        help='configuration file')
+    args, celery_args = parser.parse_known_args()
+
+    if not os.path.isfile(args.gmalt_config):
+        parser.error('Configuration file "%s" doesn\'t exist'
+                     % args.gmalt_config)
+
+    status_code = App(args.gmalt_config).start_worker(celery_args)
+
+    return status_code or 0
+
+
+def run_pack(*args, **kwargs):
+    """ Called by console_scripts `gmalt-pack` to build a packed archive
+    of HGT tiles for the `packed` handler
+
+    Usage : `gmalt-pack /data/srtm3 /data/srtm3.gpak`
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('folder', help='folder containing the HGT files')
+    parser.add_argument('archive', help='path of the archive to create')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.folder):
+        parser.error('Folder "%s" doesn\'t exist' % args.folder)
+
+    logging.basicConfig(level=logging.INFO)
+    pack_folder(args.folder, args.archive)
+
+    return 0
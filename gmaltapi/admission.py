@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2017 Jonathan Bouzekri
+#
+# This file is part of the gmalt application
+#
+# MIT License :
+# https://raw.githubusercontent.com/gmalt/api/master/LICENSE.txt
+
+""" Admission control of the requests : a bounded number of requests is
+served at once, the other ones wait in a bounded queue or are rejected """
+
+import collections
+import json
+
+import gevent.event
+
+from gmaltapi.metrics import Histogram, clock
+
+#: priority of the single position lookups
+SINGLE = 0
+
+#: priority of the other requests (batches, streams, profiles)
+BATCH = 1
+
+
+class AdmissionControl(object):
+    """ WSGI middleware serving at most `pool_size` requests at once.
+
+    A request arriving when all the slots are used waits for a slot in a
+    queue of at most `max_queued` requests, during at most `max_wait`
+    seconds. Otherwise it gets at once an error 503 with a `Retry-After`
+    header, the response is built once on startup.
+
+    The single position lookups (`GET /altitude`) get the free slots before
+    the waiting batches, streams and profiles, and these requests use at
+    most `batch_pool_size` slots so that the single position lookups are
+    not starved by large requests. `GET /metrics` and the `OPTIONS`
+    requests are always served.
+
+    A slot is released when the response is built or, for a streamed
+    response, when it is closed.
+
+    :param application: the WSGI application
+    :param int pool_size: maximum number of requests served at once
+    :param int max_queued: maximum number of requests waiting for a slot
+    :param float max_wait: maximum time in seconds a request waits for a
+        slot
+    :param int retry_after: value in seconds of the `Retry-After` header of
+        the rejected requests
+    :param int batch_pool_size: maximum number of slots used by the requests
+        which are not single position lookups (None for no limit)
+    """
+
+    spec = {
+        'max_queued': 'integer(min=0, default=None)',
+        'max_wait': 'float(min=0, default=1.0)',
+        'retry_after': 'integer(min=0, default=1)',
+        'batch_pool_size': 'integer(min=1, default=None)'
+    }
+
+    #: priority of the requests by (method, path), the other requests have
+    #: the `BATCH` priority
+    PRIORITIES = {('GET', '/altitude'): SINGLE, ('HEAD', '/altitude'): SINGLE}
+
+    #: paths of the requests which are always served
+    EXEMPT_PATHS = frozenset(['/metrics'])
+
+    def __init__(self, application, pool_size, max_queued=0, max_wait=1.0,
+                 retry_after=1, batch_pool_size=None):
+        self.application = application
+        self.pool_size = pool_size
+        self.max_queued = max_queued
+        self.max_wait = max_wait
+        self.batch_pool_size = batch_pool_size
+        self.active = [0, 0]
+        self.queues = (collections.deque(), collections.deque())
+        self.rejected = 0
+        self.waits = Histogram()
+
+        body = json.dumps({'message': 'The server is overloaded, retry '
+                                      'later.',
+                           'code': 503,
+                           'title': 'Service Unavailable'}).encode('utf-8')
+        self._rejection = ('503 Service Unavailable', [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', str(len(body))),
+            ('Retry-After', str(retry_after))
+        ], [body])
+
+    def __call__(self, environ, start_response):
+        method = environ.get('REQUEST_METHOD')
+        path = environ.get('PATH_INFO')
+        if method == 'OPTIONS' or path in self.EXEMPT_PATHS:
+            return self.application(environ, start_response)
+
+        priority = self.PRIORITIES.get((method, path), BATCH)
+        if not self._acquire(priority):
+            self.rejected += 1
+            status, headers, body = self._rejection
+            start_response(status, list(headers))
+            return body
+
+        try:
+            result = self.application(environ, start_response)
+        except BaseException:
+            self._release(priority)
+            raise
+        if isinstance(result, (list, tuple)):
+            self._release(priority)
+            return result
+        return _ReleasingIterable(result, lambda: self._release(priority))
+
+    def admission_metrics(self):
+        """ Collector of the number of requests served, waiting and rejected
+
+        :return: see :func:`gmaltapi.metrics.Metrics.add_collector`
+        :rtype: list of tuple
+        """
+        return [
+            ('gmalt_admission_active', 'gauge',
+             'Number of requests being served.', sum(self.active)),
+            ('gmalt_admission_queued', 'gauge',
+             'Number of requests waiting to be served.',
+             len(self.queues[SINGLE]) + len(self.queues[BATCH])),
+            ('gmalt_admission_rejected_total', 'counter',
+             'Number of requests rejected with an error 503.', self.rejected),
+            ('gmalt_admission_wait_seconds', 'histogram',
+             'Time spent by the requests waiting to be served.', self.waits)
+        ]
+
+    def _can_start(self, priority):
+        """ Check if a slot is available for a request of a priority """
+        if sum(self.active) >= self.pool_size:
+            return False
+        return priority == SINGLE or self.batch_pool_size is None \
+            or self.active[BATCH] < self.batch_pool_size
+
+    def _acquire(self, priority):
+        """ Take a slot, waiting for it if the queue is not full
+
+        :param int priority: `SINGLE` or `BATCH`
+        :return: False if the request is rejected
+        :rtype: bool
+        """
+        waiting = len(self.queues[SINGLE]) + \
+            (len(self.queues[BATCH]) if priority == BATCH else 0)
+        if not waiting and self._can_start(priority):
+            self.active[priority] += 1
+            return True
+        if self.max_wait <= 0 or len(self.queues[SINGLE]) + \
+                len(self.queues[BATCH]) >= self.max_queued:
+            return False
+
+        waiter = gevent.event.Event()
+        self.queues[priority].append(waiter)
+        start = clock()
+        try:
+            waiter.wait(self.max_wait)
+        except BaseException:
+            # killed while waiting (client gone, server stopping)
+            if waiter.is_set():
+                self._release(priority)
+            else:
+                self.queues[priority].remove(waiter)
+            raise
+        if not waiter.is_set():
+            self.queues[priority].remove(waiter)
+        self.waits.observe(clock() - start)
+        # the slot was taken for the waiter by `_release`
+        return waiter.is_set()
+
+    def _release(self, priority):
+        """ Free a slot and give the free slots to the waiting requests,
+        the single position lookups first
+
+        :param int priority: `SINGLE` or `BATCH`
+        """
+        self.active[priority] -= 1
+        for queued in (SINGLE, BATCH):
+            queue = self.queues[queued]
+            while queue and self._can_start(queued):
+                self.active[queued] += 1
+                queue.popleft().set()
+
+
+class _ReleasingIterable(object):
+    """ A response iterable calling a function once when it is closed
+
+    :param result: the response iterable of the application
+    :param release: the function to call
+    """
+    def __init__(self, result, release):
+        self.result = result
+        self._release = release
+
+    def __iter__(self):
+        return iter(self.result)
+
+    def close(self):
+        release, self._release = self._release, None
+        try:
+            close = getattr(self.result, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            if release is not None:
+                release()
@@ -9,10 +9,13 @@
 
 """ Provide the main App class to start the service """
 
+import time
+
 import pkg_resources
 
 from . import server
 from . import config
+from . import handler
 
 
 class App(object):
@@ -24,21 +27,65 @@ class App(object):
 
     spec = {
         'root': 'string(default="%s")' % pkg_resources.get_distribution('gmaltapi').location,  # noqa
-        'server': server.GmaltServer.spec,
+        'server': dict(server.GmaltServer.spec, **handler.WSGIHandler.spec),
         'handler': {}
     }
 
     def __init__(self, conf_file):
         self.conf = config.GmaltServerConfigObj(conf_file, self.spec)
 
-    def start_worker(self):
-        """ Start the celery worker using the sys.argv configuration """
-        # TODO : rework celery instanciation
-        return self.get('celery').worker_main()
+    def start_worker(self, argv=None):
+        """ Start the celery worker of the `celery` handler
+
+        :param list argv: the arguments of the `celery worker` command
+        :raises ValueError: if the configured handler is not `celery`
+        """
+        alt_handler = self.conf['server']['handler'].alt_handler
+        if not hasattr(alt_handler, 'celery'):
+            raise ValueError('the worker requires the celery handler')
+        return alt_handler.celery.worker_main(['worker'] + list(argv or []))
+
+    def preload(self):
+        """ Load the data of the elevation handler selected by its
+        configuration (see the `preload` method of the handlers) and print
+        the progress
+
+        :return: tuple (number of loaded tiles, their size in bytes) or None
+            if the handler does not preload anything
+        :rtype: tuple(int, int) or None
+        """
+        alt_handler = self.conf['server']['handler'].alt_handler
+        preload = getattr(alt_handler, 'preload', None)
+        if preload is None:
+            return None
+
+        start = time.time()
+
+        def progress(done, total):
+            # about every 10% to keep the logs short
+            if done == total or done * 10 // total != (done - 1) * 10 // total:
+                print('Preloading tiles : %d/%d (%.1fs)'
+                      % (done, total, time.time() - start))
+
+        tiles, size = preload(progress)
+        if not tiles:
+            return None
+        print('Preloaded %d tiles (%.1f MB) in %.1fs'
+              % (tiles, size / 1e6, time.time() - start))
+        return tiles, size
+
+    def start_server(self, workers=None):
+        """ Start the gevent wsgi server
 
-    def start_server(self):
-        """ Start the gevent wsgi server """
+        :param int workers: number of worker processes, default to the
+            `workers` of the server section
+        """
+        server_conf = dict(self.conf['server'])
+        if workers is not None:
+            server_conf['workers'] = workers
         try:
-            server.GmaltServer(**self.conf['server']).serve_forever()
+            # before the workers are forked so that they share the tiles
+            self.preload()
+            server.GmaltServer(**server_conf).serve_forever()
         except KeyboardInterrupt:
             pass  # silent exit on CTRL+C
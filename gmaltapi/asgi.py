@@ -0,0 +1,503 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2017 Jonathan Bouzekri
+#
+# This file is part of the gmalt application
+#
+# MIT License :
+# https://raw.githubusercontent.com/gmalt/api/master/LICENSE.txt
+
+""" ASGI application to serve gmalt API with an asyncio server like
+uvicorn or hypercorn (python 3.6+ only) ::
+
+    GMALT_CONFIG=conf/gmalt.cfg uvicorn --factory gmaltapi.asgi:create_app
+
+The requests are answered by the :class:`gmaltapi.handler.WSGIHandler` of
+the configuration, so the routes, the responses and the errors are the
+same. The requests only looking up positions already in memory run
+directly on the event loop, the other ones run in an executor so that a
+tile read or a database query never blocks the loop.
+"""
+
+import asyncio
+import concurrent.futures
+import io
+import os
+import sys
+import threading
+from urllib.parse import parse_qsl
+
+import webob.exc
+
+from gmaltapi.handler import StreamError, StreamLoader, WSGIHandler, \
+    check_body_size, format_stream_block, format_stream_error, \
+    load_interpolation
+from gmaltapi.metrics import RequestTimer
+
+
+class ColdLookup(BaseException):
+    """ Raised by a lookup running on the event loop which would block it.
+    It derives from :class:`BaseException` to go through the error handling
+    of the WSGI handler """
+    pass
+
+
+class InlineGuard(object):
+    """ Proxy of the elevation handler of the WSGI handler. While a request
+    runs on the event loop, the lookup of positions which are not warm (see
+    :func:`gmaltapi.handlers.BaseHandler.is_warm`) raises
+    :class:`ColdLookup` instead of blocking the loop.
+
+    The other attributes are read from the elevation handler.
+
+    :param alt_handler: the elevation handler
+    :param func get_altitudes: the batch lookup of the WSGI handler
+    """
+    def __init__(self, alt_handler, get_altitudes):
+        self.alt_handler = alt_handler
+        self._get_altitudes = get_altitudes
+        self._local = threading.local()
+
+    def __getattr__(self, name):
+        if name == 'alt_handler':
+            raise AttributeError(name)
+        return getattr(self.alt_handler, name)
+
+    @property
+    def inline(self):
+        """ True while a request runs on the event loop thread """
+        return getattr(self._local, 'inline', False)
+
+    @inline.setter
+    def inline(self, value):
+        self._local.inline = value
+
+    def is_warm(self, lats, lngs, interpolation=None):
+        """ Check if the positions can be looked up without blocking I/O,
+        False for the handlers which can't tell """
+        is_warm = getattr(self.alt_handler, 'is_warm', None)
+        return bool(is_warm is not None and
+                    is_warm(lats, lngs, interpolation=interpolation))
+
+    def get_altitude(self, lat, lng, **kwargs):
+        """ .. seealso:: :func:`gmaltapi.handlers.BaseHandler.get_altitude`
+
+        :raises ColdLookup: if the lookup would block the event loop
+        """
+        self._check([lat], [lng], kwargs)
+        return self.alt_handler.get_altitude(lat, lng, **kwargs)
+
+    def get_altitudes(self, lats, lngs, **kwargs):
+        """ .. seealso:: :func:`gmaltapi.handlers.BaseHandler.get_altitudes`
+
+        :raises ColdLookup: if the lookup would block the event loop
+        """
+        self._check(lats, lngs, kwargs)
+        return self._get_altitudes(lats, lngs, **kwargs)
+
+    def _check(self, lats, lngs, kwargs):
+        if self.inline and \
+                not self.is_warm(lats, lngs, kwargs.get('interpolation')):
+            raise ColdLookup()
+
+
+class ASGIHandler(object):
+    """ gmalt API ASGI application wrapping the WSGI handler.
+
+    A request first runs on the event loop. If it needs positions which are
+    not warm, it is run again in the executor. The elevation handlers are
+    not thread safe, so a single request looks up positions at a time : a
+    request finding the handler busy also goes to the executor.
+
+    `POST /altitude/stream` is served natively : the body is read by blocks
+    as it arrives and the values of a block are sent before the next one is
+    read.
+
+    .. note:: the elevation handler of the WSGI handler is replaced by an
+        :class:`InlineGuard`, which is transparent for the WSGI servers
+
+    :param wsgi_handler: the WSGI handler answering the requests
+    :type wsgi_handler: :class:`gmaltapi.handler.WSGIHandler`
+    :param executor: the executor of the lookups which would block, a
+        single thread by default
+    :type executor: :class:`concurrent.futures.Executor`
+    """
+    def __init__(self, wsgi_handler, executor=None):
+        self.wsgi_handler = wsgi_handler
+        self.alt_handler = wsgi_handler.alt_handler
+        self.guard = InlineGuard(self.alt_handler,
+                                 wsgi_handler._get_altitudes)
+        wsgi_handler.alt_handler = self.guard
+        wsgi_handler._get_altitudes = self.guard.get_altitudes
+        self._own_executor = executor is None
+        self.executor = executor or \
+            concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.inline = 0
+        self.offloaded = 0
+        self._lock = threading.Lock()
+        self.metrics = wsgi_handler.metrics
+        self.metrics.add_collector(self._executor_metrics)
+
+    async def __call__(self, scope, receive, send):
+        """ ASGI callable
+
+        :param dict scope: the ASGI connection scope
+        :param receive: awaitable returning the next event
+        :param send: awaitable sending an event
+        """
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise ValueError('unsupported scope {}'.format(scope['type']))
+
+        if scope['method'] == 'POST' and scope['path'] == '/altitude/stream':
+            return await self._stream_altitude(scope, receive, send)
+
+        try:
+            body = await self._read_body(
+                scope, receive, self.wsgi_handler.max_body_size
+            )
+        except webob.exc.HTTPRequestEntityTooLarge as e:
+            status_code, body = WSGIHandler._format_error(e)
+            path = scope['path']
+            self.metrics.request_finished(
+                path if path in WSGIHandler.ROUTES else 'other',
+                status_code, RequestTimer()
+            )
+            return await self._send(send, *self._render(status_code, body,
+                                                        scope))
+        if body is None:
+            return  # the client is gone
+
+        response = self._call_inline(self._build_environ(scope, body))
+        if response is None:
+            self.offloaded += 1
+            response = await asyncio.get_event_loop().run_in_executor(
+                self.executor, self._call_locked,
+                self._build_environ(scope, body)
+            )
+        else:
+            self.inline += 1
+        await self._send(send, *response)
+
+    def _executor_metrics(self):
+        """ Collector of the number of requests or blocks looked up on the
+        event loop and in the executor
+
+        :return: see :func:`gmaltapi.metrics.Metrics.add_collector`
+        :rtype: list of tuple
+        """
+        return [('gmalt_asgi_inline_total', 'counter',
+                 'Number of lookups run on the event loop.', self.inline),
+                ('gmalt_asgi_offloaded_total', 'counter',
+                 'Number of lookups run in the executor.', self.offloaded)]
+
+    def close(self):
+        """ Shut down the executor if it was created by the application """
+        if self._own_executor:
+            self.executor.shutdown(wait=False)
+
+    def _call_inline(self, environ):
+        """ Answer a request on the event loop
+
+        :return: tuple (status code, headers, body) or None if the request
+            would block the event loop
+        :rtype: tuple(int, list, bytes) or None
+        """
+        if not self._lock.acquire(False):
+            return None
+        self.guard.inline = True
+        try:
+            return self._call_wsgi(environ)
+        except ColdLookup:
+            return None
+        finally:
+            self.guard.inline = False
+            self._lock.release()
+
+    def _call_locked(self, environ):
+        with self._lock:
+            return self._call_wsgi(environ)
+
+    def _call_wsgi(self, environ):
+        """ Answer a request with the WSGI handler
+
+        :return: tuple (status code, headers, body)
+        :rtype: tuple(int, list, bytes)
+        """
+        response = []
+
+        def start_response(status, headers, exc_info=None):
+            response[:] = [int(status.split(' ', 1)[0]), headers]
+
+        chunks = self.wsgi_handler(environ, start_response)
+        try:
+            body = b''.join(chunks)
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+        return response[0], response[1], body
+
+    async def _lookup(self, lats, lngs, kwargs):
+        """ Look up a block of streamed positions, on the event loop if
+        they are warm and the handler is free, else in the executor """
+        if self._lock.acquire(False):
+            try:
+                if self.guard.is_warm(lats, lngs,
+                                      kwargs.get('interpolation')):
+                    self.inline += 1
+                    return self.guard._get_altitudes(lats, lngs, **kwargs)
+            finally:
+                self._lock.release()
+
+        def lookup():
+            with self._lock:
+                return self.guard._get_altitudes(lats, lngs, **kwargs)
+
+        self.offloaded += 1
+        return await asyncio.get_event_loop().run_in_executor(self.executor,
+                                                              lookup)
+
+    async def _stream_altitude(self, scope, receive, send):
+        """ POST /altitude/stream
+
+        .. seealso:: :func:`gmaltapi.handler.WSGIHandler.stream_altitude`
+        """
+        timer = RequestTimer()
+        content_type = self._header(scope, b'content-type') \
+            .split(';', 1)[0].strip().lower()
+        params = dict(parse_qsl(scope.get('query_string', b'')
+                                .decode('latin-1')))
+        blocks = None
+        try:
+            fmt = StreamLoader.get_format(content_type)
+            kwargs = load_interpolation(params.get('interpolation'))
+            blocks = self._read_blocks(receive, fmt)
+            try:
+                block = await blocks.__anext__()
+            except StopAsyncIteration:
+                block = None
+            except StreamError as e:
+                raise webob.exc.HTTPBadRequest(detail={'body': [
+                    'Line {}: {}'.format(e.line, e.message)
+                ]})
+        except Exception as e:
+            if blocks is not None:
+                await blocks.aclose()
+            status_code, body = WSGIHandler._format_error(e)
+            self.metrics.request_finished('/altitude/stream', status_code,
+                                          timer)
+            return await self._send(send, *self._render(status_code, body,
+                                                        scope))
+
+        self.metrics.request_finished('/altitude/stream', 200, timer)
+
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type',
+                                 content_type.encode('latin-1'))]})
+        if fmt == 'csv':
+            await send({'type': 'http.response.body',
+                        'body': b'lat,lng,alt\n', 'more_body': True})
+
+        message = None
+        try:
+            timer = RequestTimer()
+            while block is not None:
+                lats, lngs = block
+                timer.mark('parse')
+                alts = await self._lookup(lats, lngs, kwargs)
+                timer.mark('lookup')
+                data = format_stream_block(lats, lngs, alts, fmt)
+                timer.mark('serialize')
+                self.metrics.observe_stages(timer)
+                await send({'type': 'http.response.body', 'body': data,
+                            'more_body': True})
+                timer = RequestTimer()
+                try:
+                    block = await blocks.__anext__()
+                except StopAsyncIteration:
+                    block = None
+        except StreamError as e:
+            message = 'Line {}: {}'.format(e.line, e.message)
+        except Exception as e:
+            message = WSGIHandler._format_error(e)[1]['message']
+        finally:
+            await blocks.aclose()
+
+        await send({'type': 'http.response.body',
+                    'body': format_stream_error(message, fmt)
+                    if message else b''})
+
+    async def _read_blocks(self, receive, fmt):
+        """ Read and validate the streamed positions by blocks as the body
+        arrives
+
+        .. seealso:: :func:`gmaltapi.handler.StreamLoader.blocks`
+        """
+        loader = self.wsgi_handler.stream_loader
+        lines = []
+        line_no = 0
+        buffer = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            buffer += message.get('body', b'')
+            more_body = message.get('more_body', False)
+
+            start = 0
+            end = buffer.find(b'\n')
+            while end >= 0:
+                line_no += 1
+                block = loader.feed(lines, line_no, buffer[start:end + 1],
+                                    fmt)
+                if block is not None:
+                    yield block
+                start = end + 1
+                end = buffer.find(b'\n', start)
+            buffer = buffer[start:]
+
+            if buffer and (not more_body or
+                           len(buffer) > loader.MAX_LINE_LENGTH + 1):
+                # last line or a line too long
+                line_no += 1
+                block = loader.feed(lines, line_no, buffer, fmt)
+                buffer = b''
+                if block is not None:
+                    yield block
+        if lines:
+            yield loader.block(lines, fmt)
+
+    @classmethod
+    async def _read_body(cls, scope, receive, max_size):
+        """ Read the whole body of a request
+
+        :param dict scope: the ASGI connection scope
+        :param receive: awaitable returning the next event
+        :param int max_size: maximum size of the body in bytes
+        :return: the body or None if the client disconnected
+        :rtype: bytes or None
+        :raises: :class:`webob.exc.HTTPRequestEntityTooLarge` if the body is
+            larger than `max_size`, before it is read when it has a
+            `Content-Length` header
+        """
+        length = cls._header(scope, b'content-length')
+        check_body_size(int(length) if length.isdigit() else None, max_size)
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            check_body_size(size, max_size)
+            chunks.append(chunk)
+            if not message.get('more_body', False):
+                return b''.join(chunks)
+
+    @staticmethod
+    async def _send(send, status_code, headers, body):
+        await send({'type': 'http.response.start', 'status': status_code,
+                    'headers': [(name.lower().encode('latin-1'),
+                                 value.encode('latin-1'))
+                                for name, value in headers]})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _render(self, status_code, body, scope):
+        """ Render a JSON response like the WSGI handler
+
+        :return: tuple (status code, headers, body)
+        :rtype: tuple(int, list, bytes)
+        """
+        response = []
+
+        def start_response(status, headers, exc_info=None):
+            response[:] = [status_code, headers]
+
+        chunks = WSGIHandler._respond(status_code, body,
+                                      {'REQUEST_METHOD': scope['method']},
+                                      start_response)
+        return response[0], response[1], b''.join(chunks)
+
+    @staticmethod
+    def _header(scope, name):
+        for key, value in scope.get('headers', []):
+            if key.lower() == name:
+                return value.decode('latin-1')
+        return ''
+
+    @staticmethod
+    def _build_environ(scope, body):
+        """ Build the WSGI environ of a request
+
+        :param dict scope: the ASGI connection scope
+        :param bytes body: the request body
+        :rtype: dict
+        """
+        server = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '')
+            .encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False
+        }
+        if scope.get('client'):
+            environ['REMOTE_ADDR'] = scope['client'][0]
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name == 'CONTENT_TYPE':
+                environ['CONTENT_TYPE'] = value
+            elif name != 'CONTENT_LENGTH':
+                key = 'HTTP_' + name
+                environ[key] = environ[key] + ',' + value \
+                    if key in environ else value
+        return environ
+
+
+def create_app(conf_file=None):
+    """ Build the ASGI application from a configuration file
+
+    Usage::
+
+        GMALT_CONFIG=conf/gmalt.cfg uvicorn --factory \\
+            gmaltapi.asgi:create_app
+
+    :param str conf_file: path to the config file, default to the
+        `GMALT_CONFIG` environment variable
+    :rtype: :class:`ASGIHandler`
+    :raises ValueError: if there is no configuration file
+    """
+    from gmaltapi.app import App
+
+    conf_file = conf_file or os.environ.get('GMALT_CONFIG')
+    if not conf_file:
+        raise ValueError('set the GMALT_CONFIG environment variable to the '
+                         'path of the configuration file')
+    app = App(conf_file)
+    app.preload()
+    return ASGIHandler(app.conf['server']['handler'])
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2017 Jonathan Bouzekri
+#
+# This file is part of the gmalt application
+#
+# MIT License :
+# https://raw.githubusercontent.com/gmalt/api/master/LICENSE.txt
+
+""" Cache of the elevation values in front of an elevation handler """
+
+import collections
+import functools
+import math
+import time
+
+import gevent.event
+import numpy
+
+import gmaltapi.handlers
+from gmaltapi.tiles import sample_key, sample_keys
+
+
+class CachedHandler(object):
+    """ Wrap an elevation handler to cache the elevation values of the
+    requested positions.
+
+    The positions are quantized to `resolution` arcseconds like the tiles
+    pick their samples (see :func:`gmaltapi.tiles.sample_key`), so the
+    positions sharing an entry resolve to the same sample with the default
+    resolution of 1 arcsecond for SRTM1 and 1 or 3 arcseconds for SRTM3.
+    The positions are not cached when they are interpolated
+    (`interpolation` other than `nearest`) as the value changes within a
+    sample.
+
+    The least recently used entries are evicted when the cache is full and
+    an entry expires after `ttl` seconds. Concurrent requests of a missing
+    position wait for the first one instead of querying the handler again.
+
+    The other attributes are read from the wrapped handler.
+
+    :param alt_handler: the elevation handler
+    :param int size: maximum number of cached positions
+    :param float ttl: lifetime of an entry in seconds (None for no limit)
+    :param float resolution: size of the quantization step in arcseconds
+    """
+
+    spec = {
+        'response_cache_size': 'integer(min=0, default=0)',
+        'response_cache_ttl': 'float(min=0, default=None)',
+        'response_cache_resolution': 'float(min=0, default=1)'
+    }
+
+    def __init__(self, alt_handler, size, ttl=None, resolution=1.0):
+        self.alt_handler = alt_handler
+        self.size = size
+        self.ttl = ttl
+        self.scale = 3600.0 / resolution
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._pending = {}
+        self._get_altitudes = getattr(alt_handler, 'get_altitudes', None) \
+            or functools.partial(gmaltapi.handlers.get_altitudes, alt_handler)
+
+    def __getattr__(self, name):
+        if name == 'alt_handler':
+            raise AttributeError(name)
+        return getattr(self.alt_handler, name)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_altitude(self, lat, lng, interpolation=None):
+        """ Get the elevation value of a position from the cache or from
+        the handler
+
+        .. seealso:: :func:`gmaltapi.handlers.BaseHandler.get_altitude`
+        """
+        kwargs = {'interpolation': interpolation} if interpolation else {}
+        if not self._is_cacheable(interpolation) \
+                or math.isinf(lat + lng) or math.isnan(lat + lng):
+            self.bypasses += 1
+            return self.alt_handler.get_altitude(lat, lng, **kwargs)
+
+        key = self._key(lat, lng)
+        found, value = self._get(key)
+        if found:
+            return value
+
+        pending = self._pending.get(key)
+        if pending is not None:
+            # another greenlet is fetching it, count it as a hit
+            self.misses -= 1
+            self.hits += 1
+            return pending.get()
+
+        self._pending[key] = pending = gevent.event.AsyncResult()
+        try:
+            value = self.alt_handler.get_altitude(lat, lng, **kwargs)
+        except Exception as e:
+            pending.set_exception(e)
+            raise
+        else:
+            self._set(key, value)
+            pending.set(value)
+        finally:
+            del self._pending[key]
+            if not pending.ready():
+                # killed during the lookup (timeout, server stopping) : the
+                # waiting greenlets must not wait forever
+                pending.set_exception(
+                    RuntimeError('the lookup was interrupted')
+                )
+        return value
+
+    def get_altitudes(self, lats, lngs, interpolation=None):
+        """ Get the elevation values of many positions. The missing
+        positions are fetched with a single batch lookup
+
+        .. seealso:: :func:`gmaltapi.handlers.BaseHandler.get_altitudes`
+        """
+        kwargs = {'interpolation': interpolation} if interpolation else {}
+        if not self._is_cacheable(interpolation):
+            self.bypasses += numpy.size(lats)
+            return self._get_altitudes(lats, lngs, **kwargs)
+
+        lats = numpy.asarray(lats, dtype=numpy.float64)
+        lngs = numpy.asarray(lngs, dtype=numpy.float64)
+        alts = numpy.full(lats.shape, numpy.nan)
+        flat_alts = alts.reshape(-1)
+        valid = numpy.isfinite(lats) & numpy.isfinite(lngs)
+        keys = sample_keys(numpy.where(valid, lats, 0).ravel(),
+                           numpy.where(valid, lngs, 0).ravel(), self.scale)
+
+        missing = []
+        for idx, is_valid in enumerate(valid.ravel().tolist()):
+            if not is_valid:
+                continue
+            found, value = self._get(keys[idx])
+            if not found:
+                missing.append(idx)
+            elif value is not None:
+                flat_alts[idx] = value
+
+        if missing:
+            values = numpy.asarray(self._get_altitudes(
+                lats.ravel()[missing], lngs.ravel()[missing], **kwargs
+            ), dtype=numpy.float64)
+            flat_alts[missing] = values
+            for idx, value in zip(missing, values.tolist()):
+                self._set(keys[idx], None if value != value else value)
+        return alts
+
+    def is_warm(self, lats, lngs, interpolation=None):
+        """ Check if the positions are cached or can be looked up by the
+        handler without blocking I/O
+
+        .. seealso:: :func:`gmaltapi.handlers.BaseHandler.is_warm`
+        """
+        lats = numpy.asarray(lats, dtype=numpy.float64).ravel()
+        lngs = numpy.asarray(lngs, dtype=numpy.float64).ravel()
+        if self._is_cacheable(interpolation) and \
+                numpy.isfinite(lats).all() and numpy.isfinite(lngs).all() and \
+                all(self._key(lat, lng) in self._entries
+                    for lat, lng in zip(lats.tolist(), lngs.tolist())):
+            return True
+        is_warm = getattr(self.alt_handler, 'is_warm', None)
+        return bool(is_warm is not None and
+                    is_warm(lats, lngs, interpolation=interpolation))
+
+    def cache_stats(self):
+        """ Get the counters of the cache
+
+        :return: dict with the number of `hits`, `misses` and `bypasses`
+            (interpolated positions), the number of `evictions`, the
+            number of cached `entries` and the `hit_rate`
+        :rtype: dict
+        """
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'bypasses': self.bypasses, 'evictions': self.evictions,
+                'entries': len(self._entries),
+                'hit_rate': float(self.hits) / lookups if lookups else 0.0}
+
+    def clear(self):
+        """ Remove all the entries """
+        self._entries.clear()
+
+    def _is_cacheable(self, interpolation):
+        interpolation = interpolation or \
+            getattr(self.alt_handler, 'interpolation', None) or 'nearest'
+        return interpolation == 'nearest'
+
+    def _key(self, lat, lng):
+        """ Quantize a position
+
+        :return: see :func:`gmaltapi.tiles.sample_key`
+        :rtype: tuple(int, int, int, int)
+        """
+        return sample_key(lat, lng, self.scale)
+
+    def _get(self, key):
+        """ Get an entry and mark it as the most recently used
+
+        :return: tuple (True if found, the cached value)
+        :rtype: tuple(bool, float or None)
+        """
+        entry = self._entries.pop(key, None)
+        if entry is None or (entry[1] is not None and entry[1] < time.time()):
+            self.misses += 1
+            return False, None
+        self._entries[key] = entry
+        self.hits += 1
+        return True, entry[0]
+
+    def _set(self, key, value):
+        """ Add an entry and evict the least recently used ones if the
+        cache is full """
+        expires = time.time() + self.ttl if self.ttl is not None else None
+        self._entries.pop(key, None)
+        self._entries[key] = (value, expires)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2017 Jonathan Bouzekri
+#
+# This file is part of the gmalt application
+#
+# MIT License :
+# https://raw.githubusercontent.com/gmalt/api/master/LICENSE.txt
+
+""" Coalescing of the concurrent single position lookups in batch lookups """
+
+import functools
+
+import gevent
+import gevent.event
+import numpy
+
+import gmaltapi.handlers
+from gmaltapi.metrics import Histogram, clock
+
+#: upper bounds in seconds of the buckets of the histogram of the delays
+DELAY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                 0.001, 0.0025, 0.005, 0.01)
+
+
+class CoalescingHandler(object):
+    """ Wrap an elevation handler to group the single position lookups of
+    the concurrent greenlets in batch lookups.
+
+    The first lookup of a batch starts a timer of `window` microseconds.
+    The lookups arriving before its end join the batch, then the batch is
+    resolved with a single `get_altitudes` call (one per interpolation) and
+    each waiting greenlet gets its value. A batch is resolved at once when
+    it reaches `max_size` positions. A lookup of a position already in a
+    batch waits for its value instead of being added again.
+
+    The delay added to a lookup is bounded by `window` plus the duration of
+    the batch lookup, the delays between the lookups and the start of their
+    batch are measured (see :func:`coalesce_stats`).
+
+    With the `nearest` interpolation, the integer values are returned as
+    `int` like the single position lookups of the tile handlers.
+
+    The other attributes are read from the wrapped handler.
+
+    :param alt_handler: the elevation handler
+    :param int window: maximum time in microseconds a lookup waits for other
+        lookups, 0 to only group the lookups of the same loop iteration
+    :param int max_size: maximum number of positions in a batch
+    """
+
+    spec = {
+        'coalesce_window': 'integer(min=0, default=None)',
+        'coalesce_max_size': 'integer(min=1, default=1000)'
+    }
+
+    def __init__(self, alt_handler, window, max_size=1000):
+        self.alt_handler = alt_handler
+        self.window = window / 1e6
+        self.max_size = max_size
+        self.batches = 0
+        self.batched = 0
+        self.lookups = 0
+        self.deduplicated = 0
+        self.delays = Histogram(DELAY_BUCKETS)
+        self._queue = []
+        self._pending = {}
+        self._timer = None
+        self._get_altitudes = getattr(alt_handler, 'get_altitudes', None) \
+            or functools.partial(gmaltapi.handlers.get_altitudes, alt_handler)
+
+    def __getattr__(self, name):
+        if name == 'alt_handler':
+            raise AttributeError(name)
+        return getattr(self.alt_handler, name)
+
+    def get_altitude(self, lat, lng, interpolation=None):
+        """ Get the elevation value of a position with the next batch
+
+        .. seealso:: :func:`gmaltapi.handlers.BaseHandler.get_altitude`
+        """
+        key = (lat, lng, interpolation)
+        result = self._pending.get(key)
+        if result is not None:
+            self.deduplicated += 1
+            return result.get()
+
+        self._pending[key] = result = gevent.event.AsyncResult()
+        self._queue.append((key, clock()))
+        self.lookups += 1
+        if len(self._queue) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = gevent.spawn_later(self.window, self._flush)
+        return result.get()
+
+    def get_altitudes(self, lats, lngs, interpolation=None):
+        """ Get the elevation values of many positions, directly from the
+        handler
+
+        .. seealso:: :func:`gmaltapi.handlers.BaseHandler.get_altitudes`
+        """
+        kwargs = {'interpolation': interpolation} if interpolation else {}
+        return self._get_altitudes(lats, lngs, **kwargs)
+
+    def coalesce_stats(self):
+        """ Get the counters of the coalescing
+
+        :return: dict with the number of `batches`, of `lookups` added to a
+            batch, of `deduplicated` lookups, the mean `batch_size` and the
+            histogram of the `delays` in seconds between the lookups and
+            the start of their batch
+        :rtype: dict
+        """
+        return {'batches': self.batches, 'lookups': self.lookups,
+                'deduplicated': self.deduplicated,
+                'batch_size': float(self.batched) / self.batches
+                if self.batches else 0.0,
+                'delays': self.delays}
+
+    def _flush(self):
+        """ Resolve the positions of the current batch and wake up the
+        waiting greenlets """
+        timer, self._timer = self._timer, None
+        if timer is not None and timer is not gevent.getcurrent():
+            timer.kill(block=False)
+        queue, self._queue = self._queue, []
+        if not queue:
+            return
+
+        self.batches += 1
+        self.batched += len(queue)
+        now = clock()
+        groups = {}
+        for key, enqueued in queue:
+            self.delays.observe(now - enqueued)
+            groups.setdefault(key[2], []).append(key)
+
+        results = dict((key, self._pending[key]) for key, _ in queue)
+        try:
+            self._resolve(groups)
+        finally:
+            # killed during the batch lookup (timeout, server stopping) :
+            # the waiting greenlets must not wait forever
+            for key, result in results.items():
+                if not result.ready():
+                    if self._pending.get(key) is result:
+                        del self._pending[key]
+                    result.set_exception(
+                        RuntimeError('the batch lookup was interrupted')
+                    )
+
+    def _resolve(self, groups):
+        """ Look up the positions of a batch and set the values of the
+        waiting greenlets
+
+        :param dict groups: the (lat, lng, interpolation) keys of the
+            positions by interpolation
+        """
+        for interpolation, keys in groups.items():
+            kwargs = {'interpolation': interpolation} if interpolation else {}
+            nearest = (interpolation or getattr(self.alt_handler,
+                                                'interpolation', None)
+                       or 'nearest') == 'nearest'
+            try:
+                alts = numpy.asarray(self._get_altitudes(
+                    [key[0] for key in keys], [key[1] for key in keys],
+                    **kwargs
+                ), dtype=numpy.float64).tolist()
+            except Exception as e:
+                for key in keys:
+                    self._pending.pop(key).set_exception(e)
+                continue
+            for key, alt in zip(keys, alts):
+                if alt != alt:
+                    alt = None
+                elif nearest and alt.is_integer():
+                    alt = int(alt)
+                self._pending.pop(key).set(alt)
@@ -81,7 +81,9 @@ class GmaltServerConfigObj(GmaltConfigObj):
     """
     def __init__(self, conf_file, spec, create_handler=True):
         # First load current config to extract the configured handler
-        spec['server']['handler'] = self._build_handler_spec()
+        spec = dict(spec, handler={})
+        spec['server'] = dict(spec['server'],
+                              handler=self._build_handler_spec())
         self._fill_parent(conf_file, spec)
 
         handler_type = self['server']['handler']
@@ -89,10 +91,17 @@ class GmaltServerConfigObj(GmaltConfigObj):
         self.reset()
         self._fill_parent(conf_file, spec)
 
-        # Fill the configuration with the handler instance
+        # Fill the configuration with the handler instance, the WSGI handler
+        # settings of the server section are moved to the handler instance
         if create_handler:
+            # database handlers default to one connection per greenlet
+            if self['handler'].get('pool_size', False) is None:
+                self['handler']['pool_size'] = self['server']['pool_size']
+            wsgi_conf = dict((key, self['server'].pop(key))
+                             for key in handler.WSGIHandler.spec)
             handler_obj = handler.build_wsgi_handler(handler_type,
-                                                     self['handler'])
+                                                     self['handler'],
+                                                     **wsgi_conf)
             self['server']['handler'] = handler_obj
 
     @staticmethod
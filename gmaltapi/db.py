@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2017 Jonathan Bouzekri
+#
+# This file is part of the gmalt application
+#
+# MIT License :
+# https://raw.githubusercontent.com/gmalt/api/master/LICENSE.txt
+
+""" Pool of PostgreSQL connections for the database handlers.
+
+The connections wait for the database through gevent so that a query
+only blocks the greenlet running it and not the whole server """
+
+import contextlib
+
+import gevent.queue
+import gevent.socket
+import psycopg2
+import psycopg2.extensions
+
+
+def gevent_wait_callback(conn, timeout=None):
+    """ A psycopg2 wait callback yielding to the gevent hub while the
+    connection waits for the database
+
+    .. seealso:: :func:`psycopg2.extensions.set_wait_callback`
+    """
+    while True:
+        state = conn.poll()
+        if state == psycopg2.extensions.POLL_OK:
+            break
+        elif state == psycopg2.extensions.POLL_READ:
+            gevent.socket.wait_read(conn.fileno(), timeout=timeout)
+        elif state == psycopg2.extensions.POLL_WRITE:
+            gevent.socket.wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError(
+                'Bad result from poll: {!r}'.format(state)
+            )
+
+
+class PoolTimeout(Exception):
+    """ Raised when no connection is released in time """
+    pass
+
+
+class ConnectionPool(object):
+    """ A bounded pool of autocommit PostgreSQL connections. Connections
+    are opened on demand up to `size`, then a greenlet waits for another
+    one to release its connection.
+
+    :param int size: maximum number of connections
+    :param float timeout: maximum time in seconds to wait for a connection
+        (None to wait forever)
+    :param func setup: called with each new connection (to prepare the
+        statements for example)
+    :param db_info: the arguments of :func:`psycopg2.connect`
+    """
+    def __init__(self, size, timeout=None, setup=None, **db_info):
+        psycopg2.extensions.set_wait_callback(gevent_wait_callback)
+        self.size = size
+        self.timeout = timeout
+        self.setup = setup
+        self.db_info = db_info
+        self.opened = 0
+        self._idle = gevent.queue.LifoQueue()
+
+    @contextlib.contextmanager
+    def connection(self):
+        """ Borrow a connection from the pool. The connection is closed
+        instead of being released if it is broken
+
+        Usage::
+
+            with pool.connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+
+        :raises PoolTimeout: if no connection is available in time
+        """
+        conn = self.get()
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self.put(conn, discard=True)
+            raise
+        except BaseException:
+            self.put(conn)
+            raise
+        else:
+            self.put(conn)
+
+    def get(self):
+        """ Get an idle connection, open a new one if there is none and the
+        pool is not full, or wait for a connection to be released
+
+        :rtype: :class:`psycopg2.extensions.connection`
+        :raises PoolTimeout: if no connection is available in time
+        """
+        try:
+            conn = self._idle.get_nowait()
+        except gevent.queue.Empty:
+            conn = None
+            if self.opened >= self.size:
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except gevent.queue.Empty:
+                    raise PoolTimeout('no database connection available '
+                                      'after {} seconds'.format(self.timeout))
+        # None is a free slot : no connection was opened yet or one was
+        # discarded
+        if conn is not None:
+            return conn
+
+        self.opened += 1
+        try:
+            return self._connect()
+        except BaseException:
+            self._free()
+            raise
+
+    def put(self, conn, discard=False):
+        """ Release a connection
+
+        :param conn: the connection got from :func:`get`
+        :param bool discard: True to close the connection instead
+        """
+        if discard or conn.closed:
+            self._close(conn)
+            self._free()
+        else:
+            self._idle.put(conn)
+
+    def close(self):
+        """ Close the idle connections """
+        while not self._idle.empty():
+            conn = self._idle.get_nowait()
+            if conn is not None:
+                self._close(conn)
+                self.opened -= 1
+
+    def _free(self):
+        """ Free the slot of a discarded connection, a greenlet waiting
+        for a connection opens a new one """
+        self.opened -= 1
+        self._idle.put(None)
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _connect(self):
+        conn = psycopg2.connect(**self.db_info)
+        conn.autocommit = True
+        if self.setup is not None:
+            try:
+                self.setup(conn)
+            except BaseException:
+                conn.close()
+                raise
+        return conn
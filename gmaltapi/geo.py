@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2017 Jonathan Bouzekri
+#
+# This file is part of the gmalt application
+#
+# MIT License :
+# https://raw.githubusercontent.com/gmalt/api/master/LICENSE.txt
+
+""" Geodesic tools on numpy arrays of positions to sample a path """
+
+import numpy
+
+
+#: mean radius of the earth in meters
+EARTH_RADIUS = 6371008.8
+
+
+def decode_polyline(encoded, precision=5):
+    """ Decode a path encoded with the `Encoded Polyline Algorithm Format
+    <https://developers.google.com/maps/documentation/utilities/polylinealgorithm>`_
+
+    :param str encoded: the encoded polyline
+    :param int precision: number of decimals of the encoded coordinates
+    :return: tuple (latitudes, longitudes)
+    :rtype: tuple(:class:`numpy.ndarray`, :class:`numpy.ndarray`)
+    :raises ValueError: if the string is not a valid encoded polyline
+    """
+    values = []
+    value = shift = 0
+    for char in encoded:
+        chunk = ord(char) - 63
+        if not 0 <= chunk < 64:
+            raise ValueError('invalid character {!r} in polyline'.format(char))
+        value |= (chunk & 0x1f) << shift
+        shift += 5
+        if chunk < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value = shift = 0
+    if shift or len(values) % 2:
+        raise ValueError('truncated polyline')
+
+    coordinates = numpy.cumsum(numpy.array(values, dtype=numpy.int64)
+                               .reshape(-1, 2), axis=0) / 10.0 ** precision
+    return coordinates[:, 0], coordinates[:, 1]
+
+
+def _to_vectors(lats, lngs):
+    """ Convert positions to unit vectors of the 3D cartesian space """
+    lats, lngs = numpy.radians(lats), numpy.radians(lngs)
+    return numpy.stack([numpy.cos(lats) * numpy.cos(lngs),
+                        numpy.cos(lats) * numpy.sin(lngs),
+                        numpy.sin(lats)], axis=-1)
+
+
+def segment_lengths(lats, lngs):
+    """ Get the great-circle distance between consecutive positions
+
+    :param lats: the latitudes of the positions
+    :type lats: :class:`numpy.ndarray` of float
+    :param lngs: the longitudes of the positions
+    :type lngs: :class:`numpy.ndarray` of float
+    :return: the `n - 1` distances in meters
+    :rtype: :class:`numpy.ndarray` of float
+    """
+    lats, lngs = numpy.radians(lats), numpy.radians(lngs)
+    dlat, dlng = numpy.diff(lats), numpy.diff(lngs)
+    hav = numpy.sin(dlat / 2) ** 2 + \
+        numpy.cos(lats[:-1]) * numpy.cos(lats[1:]) * numpy.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS * numpy.arcsin(numpy.sqrt(numpy.clip(hav, 0, 1)))
+
+
+def densify(lats, lngs, distances):
+    """ Sample a path at distances along it, interpolating the positions on
+    the great circle of each segment
+
+    :param lats: the latitudes of the path positions
+    :type lats: :class:`numpy.ndarray` of float
+    :param lngs: the longitudes of the path positions
+    :type lngs: :class:`numpy.ndarray` of float
+    :param distances: the distances along the path in meters of the samples
+        (between 0 and the length of the path)
+    :type distances: :class:`numpy.ndarray` of float
+    :return: tuple (latitudes, longitudes) of the samples
+    :rtype: tuple(:class:`numpy.ndarray`, :class:`numpy.ndarray`)
+    """
+    lengths = segment_lengths(lats, lngs)
+    if not len(lengths):
+        return (numpy.full(len(distances), lats[0]),
+                numpy.full(len(distances), lngs[0]))
+    cumulated = numpy.concatenate([[0], numpy.cumsum(lengths)])
+
+    segments = numpy.clip(numpy.searchsorted(cumulated, distances,
+                                             side='right') - 1,
+                          0, len(lengths) - 1)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        fractions = (distances - cumulated[segments]) / lengths[segments]
+    fractions = numpy.nan_to_num(numpy.clip(fractions, 0, 1))
+
+    vectors = _to_vectors(lats, lngs)
+    starts, ends = vectors[segments], vectors[segments + 1]
+    angles = (lengths / EARTH_RADIUS)[segments]
+    sin_angles = numpy.sin(angles)
+    degenerated = sin_angles < 1e-12
+    sin_angles[degenerated] = 1
+    start_weights = numpy.where(degenerated, 1 - fractions,
+                                numpy.sin((1 - fractions) * angles) /
+                                sin_angles)
+    end_weights = numpy.where(degenerated, fractions,
+                              numpy.sin(fractions * angles) / sin_angles)
+    points = starts * start_weights[:, None] + ends * end_weights[:, None]
+
+    sample_lats = numpy.degrees(numpy.arctan2(
+        points[:, 2], numpy.hypot(points[:, 0], points[:, 1])
+    ))
+    sample_lngs = numpy.degrees(numpy.arctan2(points[:, 1], points[:, 0]))
+    return sample_lats, sample_lngs
+
+
+def sample_distances(length, samples=None, spacing=None):
+    """ Get the distances along a path of evenly spaced samples. The first
+    and last samples are always the ends of the path
+
+    :param float length: length of the path in meters
+    :param int samples: the number of samples
+    :param float spacing: the distance between samples in meters, used if
+        `samples` is None
+    :return: the distances in meters
+    :rtype: :class:`numpy.ndarray` of float
+    """
+    if samples is not None:
+        return numpy.linspace(0, length, samples)
+    distances = numpy.arange(0.0, length, spacing)
+    if not len(distances) or distances[-1] < length:
+        distances = numpy.append(distances, length)
+    return distances
+
+
+def ascent_descent(alts):
+    """ Get the cumulated ascent and descent of a profile. Void values are
+    skipped
+
+    :param alts: the elevations along the profile
+    :type alts: :class:`numpy.ndarray` of float
+    :return: tuple (ascent, descent) as positive values in meters
+    :rtype: tuple(float, float)
+    """
+    steps = numpy.diff(alts[~numpy.isnan(alts)])
+    return float(steps[steps > 0].sum()), float((-steps[steps < 0]).sum())
@@ -9,6 +9,8 @@
 
 """ Classes to handle gmalt API request with WSGI """
 
+import functools
+import hashlib
 import importlib
 import os
 import sys
@@ -16,13 +18,75 @@ import pkgutil
 import json
 import logging
 
-from marshmallow import Schema, fields, pre_load
+import numpy
+from marshmallow import Schema, fields, pre_load, validate
 from webob import Request, Response
 import webob.exc
 from routr import route, GET, POST, OPTIONS
 from routr.exc import NoMatchFound
 
+from gmaltapi.cache import CachedHandler
+from gmaltapi.coalesce import CoalescingHandler
+import gmaltapi.geo as geo
 import gmaltapi.handlers
+import gmaltapi.metrics as metrics
+from gmaltapi.tiles import sample_key
+
+try:
+    string_types = basestring  # noqa
+except NameError:
+    string_types = str
+
+
+def to_float_array(values, ndim):
+    """ Convert a decoded JSON array to a float array
+
+    :param list values: the decoded JSON array
+    :param int ndim: expected number of dimensions, for 2 dimensions
+        the inner arrays are expected to be pairs
+    :return: the float array or None if the values are not numbers
+        or the shape is invalid
+    :rtype: :class:`numpy.ndarray` or None
+    """
+    if not isinstance(values, list):
+        return None
+    if not values:
+        return numpy.empty((0,) * ndim)
+    try:
+        array = numpy.array(values)
+    except ValueError:  # ragged nested arrays
+        return None
+    if array.dtype.kind not in 'iuf' or array.ndim != ndim:
+        return None
+    if ndim == 2 and array.shape[1] != 2:
+        return None
+    return array.astype(numpy.float64)
+
+
+def to_json_list(values):
+    """ Convert a float array to a JSON serializable list with None instead
+    of NaN
+
+    :param values: the float array
+    :type values: :class:`numpy.ndarray`
+    :rtype: list
+    """
+    return [None if value != value else value for value in values.tolist()]
+
+
+def validate_ranges(lats, lngs, errors, lats_key='lats', lngs_key='lngs'):
+    """ Check in bulk that latitudes and longitudes are in their ranges
+
+    :param lats: the latitudes
+    :type lats: :class:`numpy.ndarray`
+    :param lngs: the longitudes
+    :type lngs: :class:`numpy.ndarray`
+    :param dict errors: the dict to fill with error messages
+    """
+    if not ((-90 <= lats) & (lats <= 90)).all():
+        errors[lats_key] = ['Latitudes must be between -90 and 90.']
+    if not ((-180 <= lngs) & (lngs <= 180)).all():
+        errors[lngs_key] = ['Longitudes must be between -180 and 180.']
 
 
 class AltSchema(Schema):
@@ -31,6 +95,9 @@ class AltSchema(Schema):
     """
     lat = fields.Number(required=True, allow_none=False)
     lng = fields.Number(required=True, allow_none=False)
+    interpolation = fields.String(
+        validate=validate.OneOf(gmaltapi.handlers.INTERPOLATIONS)
+    )
 
     @pre_load()
     def read_params(self, req):
@@ -39,7 +106,7 @@ class AltSchema(Schema):
 
         :param req: the request object
         :type req: :class:`webob.Request`
-        :return: dict with `lat` and `lng`
+        :return: dict with `lat`, `lng` and the optional `interpolation`
         :rtype: dict
         """
         params = {}
@@ -47,9 +114,467 @@ class AltSchema(Schema):
             params['lat'] = req.params.get('lat', None)
         if 'lng' in req.params:
             params['lng'] = req.params.get('lng', None)
+        if 'interpolation' in req.params:
+            params['interpolation'] = req.params.get('interpolation', None)
         return params
 
 
+def load_interpolation(value):
+    """ Validate the optional `interpolation` parameter of the batch and
+    profile endpoints
+
+    :param value: the parameter value
+    :return: dict to pass as keyword arguments to the handler
+    :rtype: dict
+    :raises: :class:`webob.exc.HTTPBadRequest` if it is not a valid choice
+    """
+    if value is None:
+        return {}
+    if value not in gmaltapi.handlers.INTERPOLATIONS:
+        raise webob.exc.HTTPBadRequest(
+            detail={'interpolation': ['Not a valid choice.']}
+        )
+    return {'interpolation': value}
+
+
+def check_body_size(size, max_size):
+    """ Check the size of a request body, before reading it when it is
+    announced by the `Content-Length` header
+
+    :param size: the size of the body in bytes, None if unknown
+    :type size: int or None
+    :param int max_size: maximum size of the body in bytes
+    :raises: :class:`webob.exc.HTTPRequestEntityTooLarge` if the body is
+        larger than `max_size`
+    """
+    if size is not None and size > max_size:
+        raise webob.exc.HTTPRequestEntityTooLarge(
+            'A request body is limited to {} bytes.'.format(max_size)
+        )
+
+
+def read_json_body(req, max_size):
+    """ Read and decode the JSON body of a request without buffering more
+    than `max_size` bytes
+
+    :param req: HTTP request object
+    :type req: :class:`webob.Request`
+    :param int max_size: maximum size of the body in bytes
+    :return: the decoded JSON body
+    :raises: :class:`webob.exc.HTTPRequestEntityTooLarge` if the body is
+        larger than `max_size`
+    :raises: :class:`webob.exc.HTTPBadRequest` if the body is not valid JSON
+    """
+    check_body_size(req.content_length, max_size)
+    # a chunked body has no length : read one more byte to detect it is
+    # too large
+    body = req.body_file.read(max_size + 1)
+    check_body_size(len(body), max_size)
+    try:
+        return json.loads(body.decode('utf-8'))
+    except ValueError:
+        raise webob.exc.HTTPBadRequest(detail={'body': ['Invalid JSON.']})
+
+
+class BatchLoader(object):
+    """ A helper class to read and validate in bulk the positions of the
+    batch elevation endpoint. The JSON body is either an array of
+    `[lat, lng]` pairs or an object with parallel `lats` and `lngs` arrays.
+
+    :param int max_points: maximum number of positions in a request
+    """
+    def __init__(self, max_points):
+        self.max_points = max_points
+
+    def load(self, data):
+        """ Validate the decoded JSON body
+
+        :param data: the decoded JSON body
+        :return: tuple (latitudes, longitudes)
+        :rtype: tuple(:class:`numpy.ndarray`, :class:`numpy.ndarray`)
+        :raises: :class:`webob.exc.HTTPBadRequest` if the positions are not
+            valid
+        :raises: :class:`webob.exc.HTTPRequestEntityTooLarge` if there are
+            more than `max_points` positions
+        """
+        if isinstance(data, list):
+            points = to_float_array(data, 2)
+            if points is None:
+                self._fail({'points': ['Must be an array of [lat, lng] '
+                                       'pairs.']})
+            points = points.reshape(-1, 2)
+            lats, lngs = points[:, 0], points[:, 1]
+        elif isinstance(data, dict):
+            errors = {}
+            lats = self._load_field(data, 'lats', errors)
+            lngs = self._load_field(data, 'lngs', errors)
+            if errors:
+                self._fail(errors)
+            if len(lats) != len(lngs):
+                self._fail({'lngs': ['Must have the same length as lats.']})
+        else:
+            self._fail({'points': ['Must be an array of [lat, lng] pairs or '
+                                   'an object with lats and lngs arrays.']})
+
+        if len(lats) > self.max_points:
+            raise webob.exc.HTTPRequestEntityTooLarge(
+                'A request is limited to {} positions.'.format(self.max_points)
+            )
+
+        errors = {}
+        validate_ranges(lats, lngs, errors)
+        if errors:
+            self._fail(errors)
+
+        return lats, lngs
+
+    def _load_field(self, data, name, errors):
+        if name not in data:
+            errors[name] = ['Missing data for required field.']
+            return None
+        values = to_float_array(data[name], 1)
+        if values is None:
+            errors[name] = ['Must be an array of numbers.']
+        return values
+
+    @staticmethod
+    def _fail(errors):
+        raise webob.exc.HTTPBadRequest(detail=errors)
+
+
+class ProfileLoader(object):
+    """ A helper class to read and validate the parameters of the elevation
+    profile endpoint :
+
+        - `path` : the positions of the polyline, either as a string of
+          `lat,lng` separated by `|`, as an encoded polyline string
+          prefixed by `enc:` or as an array of `[lat, lng]` pairs (JSON
+          body only)
+        - `samples` : the number of samples along the path
+        - `spacing` : the distance between samples in meters (exclusive
+          with `samples`)
+
+    :param int max_samples: maximum number of samples in a request
+    """
+    DEFAULT_SAMPLES = 100
+
+    def __init__(self, max_samples):
+        self.max_samples = max_samples
+
+    def load(self, params):
+        """ Validate the parameters
+
+        :param dict params: the query parameters or the decoded JSON body
+        :return: tuple (latitudes of the path, longitudes of the path,
+            distances along the path of the samples)
+        :rtype: tuple(:class:`numpy.ndarray`, :class:`numpy.ndarray`,
+            :class:`numpy.ndarray`)
+        :raises: :class:`webob.exc.HTTPBadRequest` if the parameters are not
+            valid
+        :raises: :class:`webob.exc.HTTPRequestEntityTooLarge` if there are
+            more than `max_samples` samples
+        """
+        if not isinstance(params, dict):
+            BatchLoader._fail({'body': ['Must be an object.']})
+
+        errors = {}
+        lats, lngs = self._load_path(params, errors)
+        samples = self._load_number(params, 'samples', int, errors)
+        if samples is not None and samples < 2:
+            errors['samples'] = ['Must be greater than or equal to 2.']
+        spacing = self._load_number(params, 'spacing', float, errors)
+        if spacing is not None and not spacing > 0:
+            errors['spacing'] = ['Must be greater than 0.']
+        if samples is not None and spacing is not None:
+            errors['spacing'] = ['Use either samples or spacing.']
+        if errors:
+            BatchLoader._fail(errors)
+
+        if samples is None and spacing is None:
+            samples = self.DEFAULT_SAMPLES
+
+        length = geo.segment_lengths(lats, lngs).sum()
+        nb_samples = samples
+        if spacing is not None:
+            # compared as a float : a tiny spacing gives a huge or infinite
+            # number of samples
+            with numpy.errstate(over='ignore'):
+                nb_samples = numpy.floor(length / spacing) + 2
+        if not nb_samples <= self.max_samples:
+            raise webob.exc.HTTPRequestEntityTooLarge(
+                'A profile is limited to {} samples.'.format(self.max_samples)
+            )
+
+        return lats, lngs, geo.sample_distances(length, samples, spacing)
+
+    @staticmethod
+    def _load_path(params, errors):
+        path = params.get('path')
+        lats = lngs = None
+        if path is None or path == '':
+            errors['path'] = ['Missing data for required field.']
+        elif isinstance(path, list):
+            points = to_float_array(path, 2)
+            if points is None:
+                errors['path'] = ['Must be an array of [lat, lng] pairs.']
+            else:
+                lats, lngs = points[:, 0], points[:, 1]
+        elif not isinstance(path, string_types):
+            errors['path'] = ['Not a valid path.']
+        elif path.startswith('enc:'):
+            try:
+                lats, lngs = geo.decode_polyline(path[4:])
+            except ValueError:
+                errors['path'] = ['Not a valid encoded polyline.']
+        else:
+            try:
+                points = numpy.array([[float(coord) for coord in
+                                       point.split(',')]
+                                      for point in path.split('|')])
+            except ValueError:
+                points = None
+            if points is None or points.ndim != 2 or points.shape[1] != 2:
+                errors['path'] = ['Must be lat,lng positions separated '
+                                  'by |.']
+            else:
+                lats, lngs = points[:, 0], points[:, 1]
+
+        if lats is None:
+            return None, None
+        if len(lats) < 2:
+            errors['path'] = ['Must contain at least 2 positions.']
+        validate_ranges(lats, lngs, errors, 'path', 'path')
+        return lats, lngs
+
+    @staticmethod
+    def _load_number(params, name, type_, errors):
+        value = params.get(name)
+        if value is None or value == '':
+            return None
+        try:
+            if isinstance(value, bool):
+                raise ValueError()
+            return type_(value)
+        except (TypeError, ValueError):
+            errors[name] = ['Not a valid number.']
+            return None
+
+
+class StreamError(ValueError):
+    """ Raised when a line of a streamed body is not a valid position
+
+    :param int line: the number of the line, starting at 1
+    :param str message: the error message
+    """
+    def __init__(self, line, message):
+        super(StreamError, self).__init__(line, message)
+        self.line = line
+        self.message = message
+
+
+class StreamLoader(object):
+    """ A helper class to read the positions of the streaming elevation
+    endpoint by blocks. The body has one position per line, either as
+    NDJSON (`[lat, lng]` or `{"lat": .., "lng": ..}`) or as CSV (`lat,lng`
+    with an optional header line). Empty lines are ignored.
+
+    Only one block of lines is held in memory at a time.
+
+    :param int block_size: number of positions in a block
+    """
+    #: supported content types and their format
+    FORMATS = {'application/x-ndjson': 'ndjson',
+               'application/jsonlines': 'ndjson',
+               'text/csv': 'csv'}
+
+    MAX_LINE_LENGTH = 1024
+
+    def __init__(self, block_size):
+        self.block_size = block_size
+
+    @classmethod
+    def get_format(cls, content_type):
+        """ Get the format of a body from its content type
+
+        :param str content_type: the content type without its parameters
+        :return: `ndjson` or `csv`
+        :rtype: str
+        :raises: :class:`webob.exc.HTTPUnsupportedMediaType` if the body is
+            neither NDJSON nor CSV
+        """
+        fmt = cls.FORMATS.get(content_type)
+        if fmt is None:
+            raise webob.exc.HTTPUnsupportedMediaType(
+                'The body must be NDJSON (application/x-ndjson) or CSV '
+                '(text/csv).'
+            )
+        return fmt
+
+    def blocks(self, body_file, fmt):
+        """ Read and validate the positions by blocks
+
+        :param body_file: the request body
+        :param str fmt: the format of the body (`ndjson` or `csv`)
+        :return: iterator of tuple (latitudes, longitudes) of each block
+        :rtype: iterator of tuple(:class:`numpy.ndarray`,
+            :class:`numpy.ndarray`)
+        :raises StreamError: if a line is not a valid position
+        """
+        lines = []
+        line_no = 0
+        while True:
+            raw = body_file.readline(self.MAX_LINE_LENGTH + 1)
+            if not raw:
+                break
+            line_no += 1
+            block = self.feed(lines, line_no, raw, fmt)
+            if block is not None:
+                yield block
+        if lines:
+            yield self.block(lines, fmt)
+
+    def feed(self, lines, line_no, raw, fmt):
+        """ Add a line of the body to the pending lines of a block
+
+        :param list lines: the pending (line number, text) of the block,
+            emptied when the block is full
+        :param int line_no: the number of the line, starting at 1
+        :param bytes raw: the line
+        :param str fmt: the format of the body (`ndjson` or `csv`)
+        :return: the block if it is full, else None
+        :rtype: tuple(:class:`numpy.ndarray`, :class:`numpy.ndarray`) or
+            None
+        :raises StreamError: if a line is not a valid position
+        """
+        if len(raw.rstrip(b'\r\n')) > self.MAX_LINE_LENGTH:
+            raise StreamError(line_no, 'Line too long.')
+        try:
+            text = raw.decode('utf-8').strip()
+        except UnicodeDecodeError:
+            raise StreamError(line_no, 'Not valid UTF-8.')
+        if not text or (fmt == 'csv' and line_no == 1 and
+                        self._is_csv_header(text)):
+            return None
+
+        lines.append((line_no, text))
+        if len(lines) < self.block_size:
+            return None
+        block = self.block(lines, fmt)
+        del lines[:]
+        return block
+
+    def block(self, lines, fmt):
+        """ Validate the positions of a block
+
+        :param list lines: the (line number, text) of the block
+        :param str fmt: the format of the body (`ndjson` or `csv`)
+        :return: tuple (latitudes, longitudes)
+        :rtype: tuple(:class:`numpy.ndarray`, :class:`numpy.ndarray`)
+        :raises StreamError: if a line is not a valid position
+        """
+        parse = self._parse_ndjson if fmt == 'ndjson' else self._parse_csv
+        return self._validate(lines, parse(lines))
+
+    @staticmethod
+    def _is_csv_header(text):
+        try:
+            [float(value) for value in text.split(',')]
+        except ValueError:
+            return text.replace(' ', '').lower().startswith('lat,')
+        return False
+
+    @staticmethod
+    def _parse_csv(lines):
+        points = []
+        for line_no, text in lines:
+            values = text.split(',')
+            try:
+                if len(values) != 2:
+                    raise ValueError()
+                points.append((float(values[0]), float(values[1])))
+            except ValueError:
+                raise StreamError(line_no, 'Must be a lat,lng position.')
+        return numpy.array(points, dtype=numpy.float64)
+
+    @staticmethod
+    def _parse_ndjson(lines):
+        # decode the whole block at once, line by line only to locate
+        # the invalid lines
+        try:
+            values = json.loads('[' + ','.join(text for _, text in lines) +
+                                ']')
+        except ValueError:
+            values = None
+        if values is not None and len(values) == len(lines):
+            points = to_float_array(values, 2)
+            if points is not None:
+                return points
+
+        points = []
+        for line_no, text in lines:
+            try:
+                value = json.loads(text)
+                if isinstance(value, dict):
+                    value = [value['lat'], value['lng']]
+                point = to_float_array([value], 2)
+                if point is None:
+                    raise ValueError()
+            except (ValueError, KeyError, TypeError):
+                raise StreamError(line_no, 'Must be a [lat, lng] array or a '
+                                           '{"lat": .., "lng": ..} object.')
+            points.append(point[0])
+        return numpy.array(points, dtype=numpy.float64)
+
+    @staticmethod
+    def _validate(lines, points):
+        lats, lngs = points[:, 0], points[:, 1]
+        invalid = ~((-90 <= lats) & (lats <= 90))
+        if invalid.any():
+            raise StreamError(lines[int(invalid.argmax())][0],
+                              'Latitude must be between -90 and 90.')
+        invalid = ~((-180 <= lngs) & (lngs <= 180))
+        if invalid.any():
+            raise StreamError(lines[int(invalid.argmax())][0],
+                              'Longitude must be between -180 and 180.')
+        return lats, lngs
+
+
+def format_stream_block(lats, lngs, alts, fmt):
+    """ Format the elevation values of a block of streamed positions, one
+    line per position : `[lat, lng, alt]` for NDJSON and `lat,lng,alt` for
+    CSV. A missing value is `null` in NDJSON and empty in CSV.
+
+    :param lats: the latitudes
+    :type lats: :class:`numpy.ndarray`
+    :param lngs: the longitudes
+    :type lngs: :class:`numpy.ndarray`
+    :param alts: the elevation values with NaN when there is no value
+    :type alts: :class:`numpy.ndarray`
+    :param str fmt: the format (`ndjson` or `csv`)
+    :rtype: bytes
+    """
+    if fmt == 'ndjson':
+        template, missing = '[{!r}, {!r}, {}]\n', 'null'
+    else:
+        template, missing = '{!r},{!r},{}\n', ''
+    return ''.join(
+        template.format(lat, lng, missing if alt != alt else repr(alt))
+        for lat, lng, alt in zip(lats.tolist(), lngs.tolist(), alts.tolist())
+    ).encode('utf-8')
+
+
+def format_stream_error(message, fmt):
+    """ Format the error line ending a streamed response
+
+    :param str message: the error message
+    :param str fmt: the format (`ndjson` or `csv`)
+    :rtype: bytes
+    """
+    if fmt == 'ndjson':
+        return (json.dumps({'error': message}) + '\n').encode('utf-8')
+    return 'error,"{}"\n'.format(message.replace('"', '""')).encode('utf-8')
+
+
 class WSGIHandler(object):
     """ gmalt API core WSGI handler that :
         - reads the request
@@ -57,18 +582,80 @@ class WSGIHandler(object):
         - get elevation from handler based on request params
         - manage exception and error messages
         - create and return response
+        - measure the requests, exposed by `GET /metrics`
 
     :param handler: elevation handler
     :type handler: :class:`gmaltapi.handlers.files.Handler` or any class
         implementing the `get_altitude` method
+    :param int batch_max_points: maximum number of positions in a
+        `POST /altitude` JSON request, it also limits the size of the
+        request bodies (see :attr:`BODY_BYTES_PER_POSITION`)
+    :param bool fast_path: answer the simple `GET /altitude?lat=..&lng=..`
+        requests without building the request and response objects
+    :param str dataset_version: version of the elevation dataset, the
+        `GET /altitude` responses carry caching headers when it is set
+    :param int cache_max_age: lifetime in seconds of the `GET /altitude`
+        responses in the HTTP caches
+    :param int stream_block_size: number of positions looked up at once by
+        `POST /altitude/stream`
     """
-    def __init__(self, alt_handler):
+
+    spec = dict(CachedHandler.spec, **dict(CoalescingHandler.spec, **{
+        'batch_max_points': 'integer(min=1, default=10000)',
+        'fast_path': 'boolean(default=True)',
+        'dataset_version': 'string(default=None)',
+        'cache_max_age': 'integer(min=0, default=86400)',
+        'stream_block_size': 'integer(min=1, default=10000)'
+    }))
+
+    #: key of the WSGI environ holding the caching headers of the response
+    CACHE_HEADERS_KEY = 'gmalt.cache_headers'
+
+    #: key of the WSGI environ holding the timer of the request
+    TIMER_KEY = 'gmalt.timer'
+
+    #: size in bytes allowed per position in the request bodies, the
+    #: bodies are limited to `batch_max_points` positions of this size
+    #: plus :attr:`BODY_OVERHEAD` before they are read
+    BODY_BYTES_PER_POSITION = 128
+
+    #: size in bytes allowed in the request bodies besides the positions
+    BODY_OVERHEAD = 65536
+
+    #: the routes of the requests metrics, the other paths are `other`
+    ROUTES = frozenset(['/altitude', '/altitude/stream', '/profile',
+                        '/metrics'])
+
+    def __init__(self, alt_handler, batch_max_points=10000, fast_path=True,
+                 dataset_version=None, cache_max_age=86400,
+                 stream_block_size=10000):
         self.alt_handler = alt_handler
+        self.fast_path = fast_path
+        self.dataset_version = dataset_version
+        self.cache_control = 'public, max-age={}'.format(cache_max_age)
         self.schema = AltSchema()
+        self.max_body_size = self.BODY_BYTES_PER_POSITION * \
+            batch_max_points + self.BODY_OVERHEAD
+        self.batch_loader = BatchLoader(batch_max_points)
+        self.profile_loader = ProfileLoader(batch_max_points)
+        self.stream_loader = StreamLoader(stream_block_size)
+        self._get_altitudes = getattr(alt_handler, 'get_altitudes', None) \
+            or functools.partial(gmaltapi.handlers.get_altitudes, alt_handler)
+        self.metrics = metrics.Metrics()
+        self.metrics.add_collector(functools.partial(metrics.handler_metrics,
+                                                     alt_handler))
         self.router = route("",
                             route(GET,  "/altitude", self.get_altitude),
-                            route(POST, "/altitude", self.get_altitude),
-                            route(OPTIONS, "/altitude", self.options_altitude))
+                            route(POST, "/altitude", self.post_altitude),
+                            route(OPTIONS, "/altitude", self.options_altitude),
+                            route(POST, "/altitude/stream",
+                                  self.stream_altitude),
+                            route(OPTIONS, "/altitude/stream",
+                                  self.options_altitude),
+                            route(GET, "/profile", self.get_profile),
+                            route(POST, "/profile", self.get_profile),
+                            route(OPTIONS, "/profile", self.options_altitude),
+                            route(GET, "/metrics", self.get_metrics))
 
     def __call__(self, environ, start_response):
         """ WSGI callable
@@ -78,54 +665,398 @@ class WSGIHandler(object):
         :return: a response object compatible with WSGI middlewares
         :rtype: :class:`webob.Response`
         """
+        timer = environ[self.TIMER_KEY] = metrics.RequestTimer()
+        status = []
+
+        def measured_start_response(status_line, headers, exc_info=None):
+            status.append(status_line)
+            if exc_info is None:
+                return start_response(status_line, headers)
+            return start_response(status_line, headers, exc_info)
+
+        self.metrics.in_flight += 1
+        try:
+            return self._handle(environ, measured_start_response, timer)
+        finally:
+            self.metrics.in_flight -= 1
+            if status:  # else the request is aborted
+                path = environ.get('PATH_INFO')
+                self.metrics.request_finished(
+                    path if path in self.ROUTES else 'other',
+                    int(status[0][:3]), timer
+                )
+
+    def _handle(self, environ, start_response, timer):
+        """ Answer a request
+
+        :param dict environ: WSGI environment dict
+        :param func start_response: the WSGI response function
+        :param timer: the timer of the request
+        :type timer: :class:`gmaltapi.metrics.RequestTimer`
+        :return: a response object compatible with WSGI middlewares
+        :rtype: :class:`webob.Response`
+        """
+        if self.fast_path:
+            position = self._read_fast_path(environ)
+            if position is not None:
+                cache_headers = self._cache_headers(*position)
+                if self._is_not_modified(environ, cache_headers):
+                    return webob.exc.HTTPNotModified(
+                        headers=cache_headers
+                    )(environ, start_response)
+                try:
+                    alt = self._lookup(environ, self.alt_handler.get_altitude,
+                                       *position)
+                except Exception as e:
+                    status_code, body = self._format_error(e)
+                else:
+                    body = json.dumps({'alt': alt}).encode('utf-8')
+                    start_response('200 OK', [
+                        ('Content-Length', str(len(body))),
+                        ('Content-Type', 'application/json')
+                    ] + (cache_headers or []))
+                    return [body]
+                return self._respond(status_code, body, environ,
+                                     start_response)
+
         try:
             req = Request(environ)
             body = self.router(req).target(req)
+            if isinstance(body, Response):
+                return body(environ, start_response)
             status_code = 200
-        except webob.exc.HTTPBadRequest as e:
-            status_code = 400
-            body = e.detail
-        except NoMatchFound as e:
-            status_code = 404
-            explanation = e.response.explanation
-            body = {'message': explanation + ' Use GET /altitude instead.',
-                    'code': status_code, 'title': e.response.title}
-        except webob.exc.WSGIHTTPException as e:
-            status_code = e.status_code
-            body = {'message': str(e), 'code': status_code,
-                    'title': e.title}
+        except webob.exc.HTTPNotModified as e:
+            return e(environ, start_response)
         except Exception as e:
-            logging.exception(e)
-            status_code = 500
-            explanation = 'An error occured. check the log file on the server.'
-            body = {'message': explanation, 'code': status_code,
-                    'title': 'Internal Server Error'}
+            status_code, body = self._format_error(e)
+
+        headers = environ.get(self.CACHE_HEADERS_KEY) \
+            if status_code == 200 else None
+        return self._respond(status_code, body, environ, start_response,
+                             headers)
+
+    def _lookup(self, environ, lookup, *args, **kwargs):
+        """ Call a lookup of the elevation handler, measuring it as the
+        `lookup` stage of the request
+
+        :param dict environ: WSGI environment dict
+        :param func lookup: the lookup method
+        :return: the result of the lookup
+        """
+        timer = environ.get(self.TIMER_KEY)
+        if timer is None:
+            return lookup(*args, **kwargs)
+        timer.mark('parse')
+        result = lookup(*args, **kwargs)
+        timer.mark('lookup')
+        return result
 
+    @staticmethod
+    def _read_fast_path(environ):
+        """ Read the position of a `GET /altitude` request with only the
+        `lat` and `lng` parameters, written as plain numbers in their range.
+        Any other request goes through the full stack.
+
+        :param dict environ: WSGI environment dict
+        :return: tuple (lat, lng) or None if the request is not eligible
+        :rtype: tuple(float, float) or None
+        """
+        if environ.get('PATH_INFO') != '/altitude' \
+                or environ.get('REQUEST_METHOD') != 'GET':
+            return None
+
+        query = environ.get('QUERY_STRING', '')
+        if '%' in query or '+' in query:
+            return None
+        params = query.split('&')
+        if len(params) != 2:
+            return None
+        first, _, first_value = params[0].partition('=')
+        second, _, second_value = params[1].partition('=')
+        if (first, second) == ('lat', 'lng'):
+            lat, lng = first_value, second_value
+        elif (first, second) == ('lng', 'lat'):
+            lat, lng = second_value, first_value
+        else:
+            return None
+
+        try:
+            lat, lng = float(lat), float(lng)
+        except ValueError:
+            return None
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            return None
+        return lat, lng
+
+    def _cache_headers(self, lat, lng, interpolation=None):
+        """ Build the caching headers of a `GET /altitude` response.
+
+        The strong ETag is derived from the dataset version and the position.
+        With the `nearest` interpolation, the position is quantized to the
+        arcsecond in its cell like the tiles pick their samples, so all the
+        positions resolving to the same SRTM1 or SRTM3 sample share the
+        ETag. Else the exact position is used.
+
+        :param float lat: the requested latitude
+        :param float lng: the requested longitude
+        :param str interpolation: the requested interpolation
+        :return: list of (name, value) headers or None if there is no
+            dataset version
+        :rtype: list or None
+        """
+        if self.dataset_version is None:
+            return None
+        interpolation = interpolation or \
+            getattr(self.alt_handler, 'interpolation', None) or 'nearest'
+        if interpolation == 'nearest':
+            position = '{}:{}:{}:{}'.format(*sample_key(lat, lng))
+        else:
+            position = '{!r}:{!r}:{}'.format(float(lat), float(lng),
+                                             interpolation)
+        digest = hashlib.sha1('{}|{}'.format(self.dataset_version, position)
+                              .encode('utf-8')).hexdigest()
+        return [('ETag', '"{}"'.format(digest[:20])),
+                ('Cache-Control', self.cache_control)]
+
+    @staticmethod
+    def _is_not_modified(environ, cache_headers):
+        """ Check the `If-None-Match` header of a request against the ETag
+        of the response
+
+        :param dict environ: WSGI environment dict
+        :param list cache_headers: the caching headers of the response
+        :return: True if the client already has the response
+        :rtype: bool
+        """
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if not if_none_match or not cache_headers:
+            return False
+        if if_none_match.strip() == '*':
+            return True
+        etag = cache_headers[0][1]
+        for tag in if_none_match.split(','):
+            tag = tag.strip()
+            if tag.startswith('W/'):  # weak comparison
+                tag = tag[2:]
+            if tag == etag:
+                return True
+        return False
+
+    @staticmethod
+    def _format_error(error):
+        """ Build the status code and the body of an error response
+
+        :param Exception error: the error raised while handling the request
+        :return: tuple (status code, body)
+        :rtype: tuple(int, dict)
+        """
+        if isinstance(error, webob.exc.HTTPBadRequest):
+            return 400, error.detail
+        if isinstance(error, NoMatchFound):
+            explanation = error.response.explanation
+            return 404, {'message': explanation + ' Use GET /altitude '
+                                                  'instead.',
+                         'code': 404, 'title': error.response.title}
+        if isinstance(error, webob.exc.WSGIHTTPException):
+            return error.status_code, {'message': str(error),
+                                       'code': error.status_code,
+                                       'title': error.title}
+        logging.exception(error)
+        explanation = 'An error occured. check the log file on the server.'
+        return 500, {'message': explanation, 'code': 500,
+                     'title': 'Internal Server Error'}
+
+    @staticmethod
+    def _respond(status_code, body, environ, start_response, headers=None):
+        """ Send a JSON response
+
+        :param int status_code: the HTTP status code
+        :param dict body: the body to encode in JSON, no body if empty
+        :param dict environ: WSGI environment dict
+        :param func start_response: the WSGI response function
+        :param list headers: additional (name, value) headers
+        :return: a response object compatible with WSGI middlewares
+        :rtype: :class:`webob.Response`
+        """
         res = Response()
         res.status_code = status_code
         body_text = json.dumps(body) if body else u''
         res.body = body_text.encode('utf-8')
         res.content_type = 'application/json' if body else 'text/plain'
+        if headers:
+            res.headerlist.extend(headers)
 
         return res(environ, start_response)
 
     def get_altitude(self, req):
         """ GET /altitude
-        Returns the requested elevation value from HTTP params in request
+        Returns the requested elevation value from HTTP params in request.
+        When the dataset version is set, the caching headers of the response
+        are stored in the WSGI environ and a request whose `If-None-Match`
+        header matches the ETag is answered without a lookup.
 
         :param req: HTTP request object
         :type req: :class:`webob.Request`
         :return: dict with elevation value found
         :rtype: dict with the key `alt`
         :raises: :class:`webob.exc.HTTPBadRequest` if any error in the request
+        :raises: :class:`webob.exc.HTTPNotModified` if the client already has
+            the response
         """
         result = self.schema.load(req)
         if result.errors:
             raise webob.exc.HTTPBadRequest(detail=result.errors)
-        return {'alt': self.alt_handler.get_altitude(**result.data)}
+
+        cache_headers = None
+        if req.method in ('GET', 'HEAD'):
+            cache_headers = self._cache_headers(**result.data)
+            if self._is_not_modified(req.environ, cache_headers):
+                raise webob.exc.HTTPNotModified(headers=cache_headers)
+
+        alt = self._lookup(req.environ, self.alt_handler.get_altitude,
+                           **result.data)
+        if cache_headers:
+            req.environ[self.CACHE_HEADERS_KEY] = cache_headers
+        return {'alt': alt}
+
+    def post_altitude(self, req):
+        """ POST /altitude
+        With a JSON body, returns the elevation values of all the positions
+        in the body in the same order. The positions are validated in bulk
+        and resolved with a single batch lookup.
+        Else, behaves like `GET /altitude`.
+
+        :param req: HTTP request object
+        :type req: :class:`webob.Request`
+        :return: dict with elevation values found
+        :rtype: dict with the key `alt`
+        :raises: :class:`webob.exc.HTTPBadRequest` if any error in the request
+        :raises: :class:`webob.exc.HTTPRequestEntityTooLarge` if the body is
+            larger than :attr:`max_body_size`
+        """
+        check_body_size(req.content_length, self.max_body_size)
+        if req.content_type != 'application/json':
+            return self.get_altitude(req)
+
+        data = read_json_body(req, self.max_body_size)
+
+        lats, lngs = self.batch_loader.load(data)
+        interpolation = data.get('interpolation') \
+            if isinstance(data, dict) else None
+        kwargs = load_interpolation(interpolation or
+                                    req.GET.get('interpolation'))
+        return {'alt': to_json_list(self._lookup(
+            req.environ, self._get_altitudes, lats, lngs, **kwargs
+        ))}
+
+    def stream_altitude(self, req):
+        """ POST /altitude/stream
+        Streams the elevation values of a body of newline-delimited
+        positions (see :class:`StreamLoader`). The positions are read and
+        looked up by blocks and the values of a block are sent before the
+        next one is read, so the memory used does not depend on the size of
+        the body.
+
+        The response has one line per position in the body format :
+        `[lat, lng, alt]` for NDJSON and `lat,lng,alt` for CSV (after a
+        header line). An invalid line in the first block gets a 400
+        response, after that the stream ends with an error line.
+
+        :param req: HTTP request object
+        :type req: :class:`webob.Request`
+        :return: the streamed response
+        :rtype: :class:`webob.Response`
+        :raises: :class:`webob.exc.HTTPBadRequest` if any error in the
+            parameters or in the first block
+        :raises: :class:`webob.exc.HTTPUnsupportedMediaType` if the body is
+            neither NDJSON nor CSV
+        """
+        fmt = StreamLoader.get_format(req.content_type)
+        kwargs = load_interpolation(req.GET.get('interpolation'))
+
+        blocks = self.stream_loader.blocks(req.body_file, fmt)
+        try:
+            first = next(blocks, None)
+        except StreamError as e:
+            raise webob.exc.HTTPBadRequest(detail={'body': [
+                'Line {}: {}'.format(e.line, e.message)
+            ]})
+
+        return Response(content_type=req.content_type, charset=None,
+                        app_iter=self._stream_altitudes(first, blocks, fmt,
+                                                        kwargs))
+
+    def _stream_altitudes(self, block, blocks, fmt, kwargs):
+        """ Look up and format the blocks of streamed positions
+
+        :param tuple block: the first block, None if the body is empty
+        :param blocks: iterator of the next blocks
+        :param str fmt: the format of the body (`ndjson` or `csv`)
+        :param dict kwargs: keyword arguments of the handler
+        :return: iterator of the formatted values of each block
+        :rtype: iterator of bytes
+        """
+        if fmt == 'csv':
+            yield b'lat,lng,alt\n'
+        try:
+            timer = metrics.RequestTimer()
+            while block is not None:
+                lats, lngs = block
+                timer.mark('parse')
+                alts = self._get_altitudes(lats, lngs, **kwargs)
+                timer.mark('lookup')
+                data = format_stream_block(lats, lngs, alts, fmt)
+                timer.mark('serialize')
+                self.metrics.observe_stages(timer)
+                yield data
+                timer = metrics.RequestTimer()
+                block = next(blocks, None)
+        except StreamError as e:
+            message = 'Line {}: {}'.format(e.line, e.message)
+        except Exception as e:
+            logging.exception(e)
+            message = 'An error occured. check the log file on the server.'
+        else:
+            return
+        yield format_stream_error(message, fmt)
+
+    def get_profile(self, req):
+        """ GET /profile and POST /profile
+        Returns the elevation profile along a path. The path is sampled on
+        the great circles of its segments and all the samples are resolved
+        with a single batch lookup.
+
+        The parameters are read from the query string or from the JSON body
+        of a POST request (see :class:`ProfileLoader`)
+
+        :param req: HTTP request object
+        :type req: :class:`webob.Request`
+        :return: dict with the position (`lat`, `lng`), the distance along
+            the path in meters (`distance`) and the elevation (`alt`) of each
+            sample and the cumulated `ascent` and `descent` in meters
+        :rtype: dict
+        :raises: :class:`webob.exc.HTTPBadRequest` if any error in the request
+        :raises: :class:`webob.exc.HTTPRequestEntityTooLarge` if the body is
+            larger than :attr:`max_body_size`
+        """
+        check_body_size(req.content_length, self.max_body_size)
+        if req.method == 'POST' and req.content_type == 'application/json':
+            params = read_json_body(req, self.max_body_size)
+        else:
+            params = dict(req.params.items())
+
+        path_lats, path_lngs, distances = self.profile_loader.load(params)
+        kwargs = load_interpolation(params.get('interpolation'))
+        lats, lngs = geo.densify(path_lats, path_lngs, distances)
+        alts = self._lookup(req.environ, self._get_altitudes, lats, lngs,
+                            **kwargs)
+        ascent, descent = geo.ascent_descent(alts)
+        return {'lat': lats.tolist(), 'lng': lngs.tolist(),
+                'distance': distances.tolist(), 'alt': to_json_list(alts),
+                'ascent': ascent, 'descent': descent}
 
     def options_altitude(self, req):
-        """ OPTIONS /altitude
+        """ OPTIONS /altitude and OPTIONS /profile
         Authorize OPTIONS query for easy CORS
 
         :param req: HTTP request object
@@ -135,6 +1066,19 @@ class WSGIHandler(object):
         """
         return u''
 
+    def get_metrics(self, req):
+        """ GET /metrics
+        Returns the metrics of the server process in the Prometheus text
+        format (see :class:`gmaltapi.metrics.Metrics`)
+
+        :param req: HTTP request object
+        :type req: :class:`webob.Request`
+        :return: the metrics
+        :rtype: :class:`webob.Response`
+        """
+        return Response(body=self.metrics.render().encode('utf-8'),
+                        headerlist=[('Content-Type', metrics.CONTENT_TYPE)])
+
 
 class HandlerLoader(object):
     """ Load handlers from :mod:`gmaltapi.handlers` package
@@ -190,11 +1134,29 @@ def build_gmalt_handler(handler_type, handler_conf):
     return handler_class(**handler_conf)
 
 
-def build_wsgi_handler(handler_type, handler_conf):
+def build_wsgi_handler(handler_type, handler_conf, **wsgi_conf):
     """ Helper function to create a WSGI handler
 
     :param str handler_type: the type of the handler to create
     :param dict handler_conf: the handler configuration on instanciation
+    :param wsgi_conf: the WSGI handler configuration on instanciation,
+        including the `response_cache_*` settings of the cache and the
+        `coalesce_*` settings of the coalescing wrapping the gmalt handler
     :return: a WSGI handler wrapping the gmalt handler
     """
-    return WSGIHandler(build_gmalt_handler(handler_type, handler_conf))
+    alt_handler = build_gmalt_handler(handler_type, handler_conf)
+
+    coalesce_window = wsgi_conf.pop('coalesce_window', None)
+    coalesce_max_size = wsgi_conf.pop('coalesce_max_size', 1000)
+    if coalesce_window is not None:
+        alt_handler = CoalescingHandler(alt_handler, coalesce_window,
+                                        coalesce_max_size)
+
+    cache_size = wsgi_conf.pop('response_cache_size', 0)
+    cache_ttl = wsgi_conf.pop('response_cache_ttl', None)
+    cache_resolution = wsgi_conf.pop('response_cache_resolution', 1)
+    if cache_size:
+        alt_handler = CachedHandler(alt_handler, cache_size, ttl=cache_ttl,
+                                    resolution=cache_resolution)
+
+    return WSGIHandler(alt_handler, **wsgi_conf)
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2017 Jonathan Bouzekri
+#
+# This file is part of the gmalt application
+#
+# MIT License :
+# https://raw.githubusercontent.com/gmalt/api/master/LICENSE.txt
+
+""" Package of the elevation handlers. Each module provides a `Handler`
+class for the handler type matching the module name """
+
+import math
+
+import numpy
+
+from gmaltapi.tiles import cells_of, group_by_cell, interpolate
+
+
+#: the interpolation methods of the elevation between the samples
+INTERPOLATIONS = ('nearest', 'bilinear', 'bicubic')
+
+
+def get_altitudes(alt_handler, lats, lngs, **kwargs):
+    """ Default batch lookup for handlers only implementing the
+    `get_altitude` method : it is called for each position
+
+    :param alt_handler: any object implementing the `get_altitude` method
+    :param lats: the latitudes of the positions
+    :type lats: array-like of float
+    :param lngs: the longitudes of the positions
+    :type lngs: array-like of float
+    :param kwargs: optional arguments of `get_altitude` (`interpolation`)
+    :return: the elevation values in the order of the positions with NaN
+        when there is no value
+    :rtype: :class:`numpy.ndarray` of float
+    """
+    lats = numpy.asarray(lats, dtype=numpy.float64)
+    lngs = numpy.asarray(lngs, dtype=numpy.float64)
+    alts = numpy.full(lats.shape, numpy.nan)
+    for idx, (lat, lng) in enumerate(zip(lats.flat, lngs.flat)):
+        alt = alt_handler.get_altitude(float(lat), float(lng), **kwargs)
+        if alt is not None:
+            alts.flat[idx] = alt
+    return alts
+
+
+class BaseHandler(object):
+    """ Base class of the elevation handlers.
+
+    A handler must implement `get_altitude`. The default `get_altitudes`
+    batch lookup calls it for each position, handlers able to do better
+    override it.
+    """
+    def get_altitude(self, lat, lng, interpolation=None):
+        """ Get the elevation value of a position
+
+        :param float lat: the latitude of the elevation you are looking for
+        :param float lng: the longitude of the elevation you are looking for
+        :param str interpolation: one of :data:`INTERPOLATIONS`, handlers
+            that cannot interpolate ignore it
+        :return: the elevation value for this position or None if not found
+        :rtype: float or None
+        """
+        raise NotImplementedError()
+
+    def get_altitudes(self, lats, lngs, interpolation=None):
+        """ Get the elevation values of many positions
+
+        .. seealso:: :func:`gmaltapi.handlers.get_altitudes`
+        """
+        kwargs = {'interpolation': interpolation} if interpolation else {}
+        return get_altitudes(self, lats, lngs, **kwargs)
+
+    def is_warm(self, lats, lngs, interpolation=None):
+        """ Check if the positions can be looked up without blocking I/O
+        (reading a file, querying a database, ...). The default is False,
+        handlers keeping their data in memory override it
+
+        :param lats: the latitudes of the positions
+        :type lats: array-like of float
+        :param lngs: the longitudes of the positions
+        :type lngs: array-like of float
+        :param str interpolation: the interpolation of the lookup
+        :rtype: bool
+        """
+        return False
+
+
+class TileHandler(BaseHandler):
+    """ Base class of the handlers reading the elevation from 1x1 degree
+    HGT tiles. Subclasses provide the tiles with `_get_tile` and set the
+    default `interpolation` attribute
+    """
+    interpolation = 'nearest'
+
+    def get_altitude(self, lat, lng, interpolation=None):
+        """ Find the tile that matches the provided `lat` and
+        `lng` and returns the elevation value for this position
+
+        :param float lat: the latitude of the elevation you are looking for
+        :param float lng: the longitude of the elevation you are looking for
+        :param str interpolation: the interpolation of the elevation between
+            the samples, default to the handler one
+        :return: the elevation value for this position or None if not found
+        :rtype: float or None
+        """
+        if (interpolation or self.interpolation) != 'nearest':
+            alt = self.get_altitudes([lat], [lng], interpolation)[0]
+            return None if math.isnan(alt) else float(alt)
+
+        tile = self._get_tile((min(int(math.floor(lat)), 89),
+                               min(int(math.floor(lng)), 179)))
+        if tile is None:
+            return None
+
+        return tile.get_elevation(lat, lng)
+
+    def get_altitudes(self, lats, lngs, interpolation=None):
+        """ Get the elevation values of many positions. The positions are
+        grouped by tile and the values of each tile are gathered with
+        a single vectorized indexing, including the 4 (bilinear) or 16
+        (bicubic) neighbours when interpolating
+
+        :param lats: the latitudes of the positions
+        :type lats: array-like of float
+        :param lngs: the longitudes of the positions
+        :type lngs: array-like of float
+        :param str interpolation: the interpolation of the elevation between
+            the samples, default to the handler one
+        :return: the elevation values in the order of the positions with NaN
+            when there is no value
+        :rtype: :class:`numpy.ndarray` of float
+        """
+        interpolation = interpolation or self.interpolation
+        lats = numpy.asarray(lats, dtype=numpy.float64)
+        lngs = numpy.asarray(lngs, dtype=numpy.float64)
+        alts = numpy.full(lats.shape, numpy.nan)
+
+        flat_lats, flat_lngs = lats.ravel(), lngs.ravel()
+        flat_alts = alts.reshape(-1)
+        for cell, idx in group_by_cell(flat_lats, flat_lngs):
+            tile = self._get_tile(cell)
+            if tile is not None:
+                flat_alts[idx] = interpolate(tile, flat_lats[idx],
+                                             flat_lngs[idx], interpolation,
+                                             self._get_tile)
+
+        return alts
+
+    def is_warm(self, lats, lngs, interpolation=None):
+        """ Check if the tiles covering the positions are loaded
+
+        .. seealso:: :func:`BaseHandler.is_warm`
+        """
+        lats = numpy.asarray(lats, dtype=numpy.float64).ravel()
+        lngs = numpy.asarray(lngs, dtype=numpy.float64).ravel()
+        valid = numpy.isfinite(lats) & numpy.isfinite(lngs)
+        cell_lats, cell_lngs = cells_of(lats[valid], lngs[valid])
+        cells = set(zip(cell_lats.tolist(), cell_lngs.tolist()))
+        return all(self._is_tile_loaded(cell) for cell in cells)
+
+    def _is_tile_loaded(self, cell):
+        """ Check if getting the tile covering a cell does not require I/O.
+        True by default for the handlers loading their tiles on startup
+
+        :param cell: the (lat, lng) of the bottom left corner of the cell
+        :type cell: tuple(int, int)
+        :rtype: bool
+        """
+        return True
+
+    def _get_tile(self, cell):
+        """ Get the tile covering a cell
+
+        :param cell: the (lat, lng) of the bottom left corner of the cell
+        :type cell: tuple(int, int)
+        :return: the tile or None if there is no tile
+        :rtype: :class:`gmaltapi.tiles.Tile` or None
+        """
+        raise NotImplementedError()
@@ -7,4 +7,126 @@
 # MIT License :
 # https://raw.githubusercontent.com/gmalt/api/master/LICENSE.txt
 
-print('celery module loaded')
+""" Module providing the handler to load elevation data from HGT files
+through celery workers. The server only sends the positions to the
+workers, grouped by HGT file, and each worker reads the files with the
+`file` handler """
+
+from __future__ import absolute_import
+
+import numpy
+from celery import group
+
+from gmaltapi.handlers import BaseHandler
+from gmaltapi.handlers.file import Handler as FileHandler
+from gmaltapi.task import GmaltCelery
+from gmaltapi.tiles import group_by_cell
+
+
+class Handler(BaseHandler):
+    """ The `celery` handler type.
+    The positions are split in chunks of at most `chunk_size` positions,
+    keeping the positions of a HGT file in the same chunk when possible, and
+    each chunk is sent to the workers as a single task. The server waits for
+    all the chunks of a request at once.
+
+    The workers use the same configuration file : the options of the
+    `file` handler in the handler section configure their `file` handler.
+
+    :param str broker: uri to the broker
+    :param str backend: uri to the result backend
+    :param str name: name of the celery application
+    :param int chunk_size: maximum number of positions in a task
+    :param float timeout: maximum time in seconds to wait for the workers
+    :param worker_conf: configuration of the `file` handler of the workers
+    """
+    TYPE = 'celery'
+
+    spec = dict(FileHandler.spec, **{
+        'folder': 'string(default=None)',
+        'broker': 'string()',
+        'backend': 'string()',
+        'name': 'string(default="gmalt")',
+        'chunk_size': 'integer(min=1, default=1000)',
+        'timeout': 'float(min=0, default=10)'
+    })
+
+    def __init__(self, broker, backend, name='gmalt', chunk_size=1000,
+                 timeout=10, **worker_conf):
+        self.celery = GmaltCelery(name, broker, backend,
+                                  worker_conf=worker_conf)
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+
+    def get_altitude(self, lat, lng, interpolation=None):
+        """ Get the elevation value of a position from a worker
+
+        :param float lat: the latitude of the elevation you are looking for
+        :param float lng: the longitude of the elevation you are looking for
+        :param str interpolation: the interpolation of the elevation between
+            the samples, default to the workers one
+        :return: the elevation value for this position or None if not found
+        :rtype: float or None
+        """
+        result = self.celery.altitudes.apply_async(
+            ([float(lat)], [float(lng)], interpolation)
+        )
+        return result.get(timeout=self.timeout)[0]
+
+    def get_altitudes(self, lats, lngs, interpolation=None):
+        """ Get the elevation values of many positions from the workers
+
+        :param lats: the latitudes of the positions
+        :type lats: array-like of float
+        :param lngs: the longitudes of the positions
+        :type lngs: array-like of float
+        :param str interpolation: the interpolation of the elevation between
+            the samples, default to the workers one
+        :return: the elevation values in the order of the positions with NaN
+            when there is no value
+        :rtype: :class:`numpy.ndarray` of float
+        """
+        lats = numpy.asarray(lats, dtype=numpy.float64)
+        lngs = numpy.asarray(lngs, dtype=numpy.float64)
+        alts = numpy.full(lats.shape, numpy.nan)
+
+        flat_lats, flat_lngs = lats.ravel(), lngs.ravel()
+        chunks = list(self._chunks(flat_lats, flat_lngs))
+        if not chunks:
+            return alts
+
+        tasks = group(self.celery.altitudes.s(flat_lats[idx].tolist(),
+                                              flat_lngs[idx].tolist(),
+                                              interpolation)
+                      for idx in chunks)
+        results = tasks.apply_async().get(timeout=self.timeout)
+
+        flat_alts = alts.reshape(-1)
+        for idx, values in zip(chunks, results):
+            flat_alts[idx] = [numpy.nan if value is None else value
+                              for value in values]
+        return alts
+
+    def _chunks(self, lats, lngs):
+        """ Split positions in chunks of at most `chunk_size` positions.
+        The positions of a cell are only split if there are more than
+        `chunk_size` of them
+
+        :param lats: the latitudes of the positions
+        :type lats: :class:`numpy.ndarray` of float
+        :param lngs: the longitudes of the positions
+        :type lngs: :class:`numpy.ndarray` of float
+        :return: iterator of the indices of the positions of each chunk
+        :rtype: iterator of :class:`numpy.ndarray`
+        """
+        chunk, size = [], 0
+        for _, idx in group_by_cell(lats, lngs):
+            for start in range(0, len(idx), self.chunk_size):
+                part = idx[start:start + self.chunk_size]
+                if chunk and size + len(part) > self.chunk_size:
+                    yield numpy.concatenate(chunk)
+                    chunk, size = [], 0
+                chunk.append(part)
+                size += len(part)
+        if chunk:
+            yield numpy.concatenate(chunk)
@@ -7,58 +7,350 @@
 # MIT License :
 # https://raw.githubusercontent.com/gmalt/api/master/LICENSE.txt
 
-""" Module providing the handler to load elevation date directly
-from file on each request. Useful for small project or for quick testing
-purpose """
+""" Module providing the handler to load elevation data directly
+from memory-mapped HGT files. The folder is indexed once on startup and
+the most recently used files are kept mapped so that a warm lookup does
+not require any syscall """
 
-import glob
+import logging
 import math
 import os.path
 
-import gmalthgtparser
+import gevent.event
+import gevent.threadpool
 
+from gmaltapi.handlers import TileHandler, INTERPOLATIONS
+from gmaltapi.metrics import Histogram, clock
+from gmaltapi.tiles import DecompressFolder, Tile, TileCache, \
+    TileFrequency, TileIndex, read_ahead, read_compressed
 
-class Handler(object):
+
+class Handler(TileHandler):
     """ The `file` handler type.
     Providing a `lat` and `lng`, it looks in a specific folder
     for a HGT file and returns the elevation value stored in this
     file for this position
 
     :param str folder: the folder containing the HGT file
+    :param int cache_max_tiles: maximum number of HGT files kept mapped
+    :param int cache_max_bytes: maximum cumulated size in bytes of the HGT
+        files kept mapped
+    :param str interpolation: default interpolation of the elevation
+        between the samples (`nearest`, `bilinear` or `bicubic`)
+    :param str decompress_folder: folder (ideally on a tmpfs) where the
+        compressed HGT files are decompressed to be memory-mapped. If not
+        provided, they are decompressed in memory
+    :param int decompress_max_bytes: maximum cumulated size in bytes of the
+        files in `decompress_folder`
+    :param str preload_tiles: names of the HGT files to load on startup
+        separated by commas (ex: `N45E006, N45E007`), see :func:`preload`
+    :param str preload_bbox: bounding box `south, west, north, east` of the
+        tiles to load on startup
+    :param int preload_max_bytes: maximum cumulated size in bytes of the
+        tiles loaded on startup. Without `preload_tiles` and
+        `preload_bbox`, all the tiles are loaded up to this size
+    :param int preload_workers: number of threads reading the preloaded
+        files
+    :param bool preload_pin: if True, the preloaded tiles are never evicted
+        and do not count in the cache limits
+    :param str cache_admission: `frequency` to only cache a tile if it is
+        used at least as often as the tile it would evict, `lru` to always
+        cache it
+    :param int frequency_half_life: time in seconds after which the access
+        counters of the tiles are halved. They are also halved every
+        `SAMPLES_PER_TILE` times `cache_max_tiles` (or the number of files)
+        lookups
+    :param str hot_tiles_file: path to the file where the most accessed
+        tiles are saved to be loaded first on startup
+    :param int hot_tiles_interval: time in seconds between two saves of the
+        most accessed tiles
+    :param int hot_tiles_count: number of tiles saved, default to
+        `cache_max_tiles`
+    :param int read_threads: number of threads mapping (and reading in the
+        page cache) the HGT files which are not in the cache, 0 to map them
+        in the calling greenlet
     :raises Exception: if the folder does not exist or it does not
         contain any HGT file
+    :raises ValueError: if `preload_tiles` or `preload_bbox` is invalid
     """
     TYPE = 'file'
 
     spec = {
-        'folder': 'string()'
+        'folder': 'string()',
+        'cache_max_tiles': 'integer(min=1, default=128)',
+        'cache_max_bytes': 'integer(min=0, default=None)',
+        'interpolation': 'option({}, default=nearest)'.format(
+            ', '.join(INTERPOLATIONS)
+        ),
+        'decompress_folder': 'string(default=None)',
+        'decompress_max_bytes': 'integer(min=0, default=None)',
+        'preload_tiles': 'string(default=None)',
+        'preload_bbox': 'string(default=None)',
+        'preload_max_bytes': 'integer(min=0, default=None)',
+        'preload_workers': 'integer(min=1, default=1)',
+        'preload_pin': 'boolean(default=True)',
+        'cache_admission': 'option(lru, frequency, default=frequency)',
+        'frequency_half_life': 'integer(min=1, default=3600)',
+        'hot_tiles_file': 'string(default=None)',
+        'hot_tiles_interval': 'integer(min=1, default=300)',
+        'hot_tiles_count': 'integer(min=1, default=None)',
+        'read_threads': 'integer(min=0, default=0)'
     }
 
-    def __init__(self, folder):
-        self._validate_folder(folder)
+    #: the access counters are halved every `SAMPLES_PER_TILE` lookups per
+    #: tile kept in the cache
+    SAMPLES_PER_TILE = 10
+
+    def __init__(self, folder, cache_max_tiles=128, cache_max_bytes=None,
+                 interpolation='nearest', decompress_folder=None,
+                 decompress_max_bytes=None, preload_tiles=None,
+                 preload_bbox=None, preload_max_bytes=None,
+                 preload_workers=1, preload_pin=True,
+                 cache_admission='frequency', frequency_half_life=3600,
+                 hot_tiles_file=None, hot_tiles_interval=300,
+                 hot_tiles_count=None, read_threads=0):
+        self.index = self._validate_folder(folder)
         self.folder = folder
+        self.frequency = TileFrequency(
+            frequency_half_life, hot_tiles_file, hot_tiles_interval,
+            hot_tiles_count or cache_max_tiles,
+            self.SAMPLES_PER_TILE * (cache_max_tiles or len(self.index) or 1)
+        )
+        self.cache = TileCache(cache_max_tiles, cache_max_bytes,
+                               self.frequency,
+                               cache_admission == 'frequency')
+        self.interpolation = interpolation
+        self.decompress_folder = None
+        if decompress_folder:
+            self.decompress_folder = DecompressFolder(decompress_folder,
+                                                      decompress_max_bytes)
+        self.preload_cells = self._preload_cells(preload_tiles, preload_bbox,
+                                                 preload_max_bytes)
+        self.preload_workers = preload_workers
+        self.preload_pin = preload_pin
+        self.hot_cells = [cell for cell in self.frequency.load()
+                          if cell in self.index][:self.frequency.count]
+        self.read_pool = None
+        if read_threads:
+            self.read_pool = gevent.threadpool.ThreadPool(read_threads)
+        self.blocking_loads = Histogram()
+        self.thread_loads = Histogram()
+        self._loading = {}
+
+    def preload(self, progress=None):
+        """ Load the most accessed tiles saved by the previous run (see
+        `hot_tiles_file`) then the tiles selected by the `preload_*`
+        settings before serving so that the first requests do not wait for
+        the disk. The files are read in `preload_workers` threads to fill
+        the page cache, then they are mapped (and decompressed) in the cache
+        of the tiles. The tiles of the `preload_*` settings are pinned if
+        `preload_pin` is set
+
+        :param progress: function called after each tile with the number of
+            loaded tiles and the number of tiles to load
+        :return: tuple (number of loaded tiles, their size in bytes)
+        :rtype: tuple(int, int)
+        """
+        loads = [(self.index.get(cell), False) for cell in self.hot_cells
+                 if cell not in self.preload_cells]
+        loads.extend((self.index.get(cell), self.preload_pin)
+                     for cell in self.preload_cells)
+        if self.preload_workers > 1:
+            pool = gevent.threadpool.ThreadPool(self.preload_workers)
+            try:
+                results = list(pool.imap(self._read_ahead, loads))
+            finally:
+                pool.kill()
+        else:
+            results = loads
+        size = 0
+        for done, (info, pin) in enumerate(results, 1):
+            if self.preload_workers == 1:
+                self._read_ahead((info, pin))
+            self.cache.add((info.lat, info.lng), self._load_tile(info),
+                           pin=pin)
+            size += info.size
+            if progress is not None:
+                progress(done, len(loads))
+        return len(loads), size
+
+    @staticmethod
+    def _read_ahead(load):
+        read_ahead(load[0].path)
+        return load
 
-    def get_altitude(self, lat, lng):
-        """ Load the HGT file that matches the provided `lat` and
-        `lng` and returns the elevation value for this position
+    def _preload_cells(self, tiles=None, bbox=None, max_bytes=None):
+        """ Select the indexed cells to preload
 
-        :param float lat: the latitude of the elevation you are looking for
-        :param float lng: the longitude of the elevation you are looking for
-        :return: the elevation value for this position or None if not found
-        :rtype: float or None
+        :param str tiles: names of HGT files separated by commas
+        :param str bbox: `south, west, north, east` of the cells
+        :param int max_bytes: maximum cumulated size of the cells, all the
+            cells are selected up to this size without `tiles` and `bbox`
+        :return: the cells in the loading order
+        :rtype: list of tuple(int, int)
+        :raises ValueError: if `tiles` or `bbox` is invalid
         """
-        pos = (lat, lng)
+        cells = []
+        for name in (tiles or '').split(','):
+            name = name.strip()
+            if not name:
+                continue
+            cell = TileIndex.cell_from_filename(
+                name if name.lower().endswith('.hgt') else name + '.hgt'
+            )
+            if cell is None:
+                raise ValueError('preload_tiles : invalid HGT file name '
+                                 '{}'.format(name))
+            if cell not in self.index:
+                logging.warning('HGT file %s not found, it is not preloaded',
+                                name)
+            elif cell not in cells:
+                cells.append(cell)
 
-        hgt_filename = self._hgt_filename_from_coordinates(pos)
-        hgt_file = os.path.join(self.folder, hgt_filename)
-        if not os.path.isfile(hgt_file):
-            # TODO : log file not found lvl DEBUG
+        if bbox:
+            try:
+                south, west, north, east = [float(value)
+                                            for value in bbox.split(',')]
+            except ValueError:
+                raise ValueError('preload_bbox : expected "south, west, '
+                                 'north, east", got {}'.format(bbox))
+            for lat in range(int(math.floor(south)),
+                             max(int(math.ceil(north)),
+                                 int(math.floor(south)) + 1)):
+                for lng in range(int(math.floor(west)),
+                                 max(int(math.ceil(east)),
+                                     int(math.floor(west)) + 1)):
+                    if (lat, lng) in self.index and (lat, lng) not in cells:
+                        cells.append((lat, lng))
+
+        if not tiles and not bbox and max_bytes is not None:
+            cells = sorted((info.lat, info.lng) for info in self.index)
+
+        if max_bytes is not None:
+            size = 0
+            for idx, cell in enumerate(cells):
+                size += self.index.get(cell).size
+                if size > max_bytes:
+                    del cells[idx:]
+                    break
+        return cells
+
+    def _get_tile(self, cell):
+        """ Get the mapped HGT file covering a cell, mapping it if it is
+        not in the cache yet
+
+        :param cell: the (lat, lng) of the bottom left corner of the cell
+        :type cell: tuple(int, int)
+        :return: the mapped HGT file or None if there is no file
+        :rtype: :class:`gmaltapi.tiles.Tile` or None
+        """
+        info = self.index.get(cell)
+        if info is None:
             return None
 
-        with gmalthgtparser.HgtParser(hgt_file) as parser:
-            alt = parser.get_elevation(pos)
+        tile = self.cache.get(cell)
+        if tile is not None:
+            if info.compression is not None \
+                    and self.decompress_folder is not None:
+                # the other processes must see the file as used
+                self.decompress_folder.touch(tile.path)
+            return tile
+
+        if self.read_pool is None:
+            start = clock()
+            tile = self.cache.add(cell, self._load_tile(info))
+            self.blocking_loads.observe(clock() - start)
+            return tile
+
+        # the other greenlets run while the file is read by a thread, the
+        # ones needing the same file wait for it then get it from the cache
+        # as it may have been evicted and closed before they run again
+        loading = self._loading.get(cell)
+        if loading is not None:
+            loading.get()
+            return self._get_tile(cell)
+        self._loading[cell] = loading = gevent.event.AsyncResult()
+        start = clock()
+        try:
+            tile = self.cache.add(cell, self.read_pool.apply(self._read_tile,
+                                                             (info,)))
+            loading.set(tile)
+        except Exception as e:
+            loading.set_exception(e)
+            raise
+        finally:
+            del self._loading[cell]
+            self.thread_loads.observe(clock() - start)
+            if not loading.ready():
+                # killed while waiting for the thread (timeout, server
+                # stopping) : the waiting greenlets must not wait forever
+                loading.set_exception(
+                    RuntimeError('the load of the tile was interrupted')
+                )
+        return tile
 
-        return alt[2]
+    def _read_tile(self, info):
+        """ Map a HGT file and read it so that the lookups in the mapping do
+        not wait for the disk. Called in the threads of `read_pool`
+
+        :param info: the description of the HGT file
+        :type info: :class:`gmaltapi.tiles.TileInfo`
+        :rtype: :class:`gmaltapi.tiles.Tile`
+        """
+        tile = self._load_tile(info)
+        if info.compression is None or self.decompress_folder is not None:
+            read_ahead(tile.path)
+        return tile
+
+    def _is_tile_loaded(self, cell):
+        """ A cell is loaded if its file is mapped or if there is no file
+
+        :param cell: the (lat, lng) of the bottom left corner of the cell
+        :type cell: tuple(int, int)
+        :rtype: bool
+        """
+        return cell in self.cache or cell not in self.index
+
+    def _load_tile(self, info):
+        """ Map a HGT file, decompressing it first if it is compressed
+
+        :param info: the description of the HGT file
+        :type info: :class:`gmaltapi.tiles.TileInfo`
+        :rtype: :class:`gmaltapi.tiles.Tile`
+        """
+        if info.compression is None:
+            return Tile(info.path, info.lat, info.lng)
+        if self.decompress_folder is not None:
+            try:
+                return Tile(self.decompress_folder.get(info), info.lat,
+                            info.lng)
+            except (IOError, OSError):
+                # removed by another process between the get and the map
+                return Tile(self.decompress_folder.get(info), info.lat,
+                            info.lng)
+        return Tile(info.path, info.lat, info.lng, read_compressed(info))
+
+    def stats(self):
+        """ Get the counters of the cache of mapped HGT files
+
+        :return: see :func:`gmaltapi.tiles.TileCache.stats`
+        :rtype: dict
+        """
+        return self.cache.stats()
+
+    def load_stats(self):
+        """ Get the durations of the loads of the HGT files which were not
+        in the cache
+
+        :return: dict with the histograms of the durations in seconds of the
+            loads done in the calling greenlet (`blocking`, the server is
+            blocked meanwhile) and of the loads done by the read threads
+            (`thread`), and the number of `threads`
+        :rtype: dict
+        """
+        return {'blocking': self.blocking_loads, 'thread': self.thread_loads,
+                'threads': self.read_pool.maxsize
+                if self.read_pool is not None else 0}
 
     @staticmethod
     def _hgt_filename_from_coordinates(pos):
@@ -77,10 +369,13 @@ class Handler(object):
 
     @staticmethod
     def _validate_folder(folder):
-        """ Called on handler instanciation for a quick check if the
-        provided folder exists and contains file with the `.hgt` ext
+        """ Called on handler instanciation to check that the provided
+        folder exists and contains file with the `.hgt` ext and to index
+        these files
 
         :param str folder: the folder where the handler can find HGT files
+        :return: the index of the HGT files in the folder
+        :rtype: :class:`gmaltapi.tiles.TileIndex`
         :raises Exception: if the folder does not exist or if the folder
             does not contain any HGT file
         """
@@ -88,7 +383,8 @@ class Handler(object):
             raise Exception('folder {} does not exists '
                             'or is not a directory'.format(folder))
 
-        # TODO : keep a reference to all available HGT files if already loaded
-        if not glob.glob(os.path.join(folder, '*.hgt')):
+        index = TileIndex(folder)
+        if not len(index) and not index.ignored:
             raise Exception('folder {} does not contain '
                             'any HGT file'.format(folder))
+        return index
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2017 Jonathan Bouzekri
+#
+# This file is part of the gmalt application
+#
+# MIT License :
+# https://raw.githubusercontent.com/gmalt/api/master/LICENSE.txt
+
+""" Module providing the handler to load elevation data from a packed
+archive of HGT tiles built with `gmalt-pack`. The archive is mapped once
+on startup so a lookup never opens a file and the mapping is shared by all
+the server processes through the page cache """
+
+import os.path
+
+from gmaltapi.handlers import TileHandler, INTERPOLATIONS
+from gmaltapi.pack import PackedArchive
+
+
+class Handler(TileHandler):
+    """ The `packed` handler type.
+    Providing a `lat` and `lng`, it returns the elevation value stored
+    in the tile of the archive covering this position
+
+    :param str archive: path to the archive built with `gmalt-pack`
+    :param str interpolation: default interpolation of the elevation
+        between the samples (`nearest`, `bilinear` or `bicubic`)
+    :raises Exception: if the archive does not exist
+    :raises ValueError: if the file is not a valid archive
+    """
+    TYPE = 'packed'
+
+    spec = {
+        'archive': 'string()',
+        'interpolation': 'option({}, default=nearest)'.format(
+            ', '.join(INTERPOLATIONS)
+        )
+    }
+
+    def __init__(self, archive, interpolation='nearest'):
+        if not os.path.isfile(archive):
+            raise Exception('archive {} does not exists '
+                            'or is not a file'.format(archive))
+        self.archive = PackedArchive(archive)
+        self.interpolation = interpolation
+
+    def _get_tile(self, cell):
+        """ Get the tile of the archive covering a cell
+
+        :param cell: the (lat, lng) of the bottom left corner of the cell
+        :type cell: tuple(int, int)
+        :return: the tile or None if the archive does not contain this cell
+        :rtype: :class:`gmaltapi.tiles.Tile` or None
+        """
+        return self.archive.get(cell)
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2017 Jonathan Bouzekri
+#
+# This file is part of the gmalt application
+#
+# MIT License :
+# https://raw.githubusercontent.com/gmalt/api/master/LICENSE.txt
+
+""" Module providing the handler to load elevation data from a PostGIS
+raster table filled with `gmalt-hgtload
+<https://github.com/gmalt/cli/blob/master/doc/cli_hgtload.rst>`_ """
+
+from gmaltapi.handlers import postgres
+
+
+class Handler(postgres.Handler):
+    """ The `postgis` handler type.
+    Providing a `lat` and `lng`, it looks in a PostGIS table for the
+    raster tile containing this position and returns the value of the
+    raster at this position.
+
+    The table has one raster tile per line (`rid`, `rast`) with a spatial
+    index on the convex hull of the rasters. Many positions are resolved
+    with a single query : each position is matched to its raster tile
+    through the index then `ST_Value` reads the value, NULL for the void
+    values.
+
+    .. seealso:: :class:`gmaltapi.handlers.postgres.Handler` for the
+        connection parameters
+    """
+    TYPE = 'postgis'
+
+    QUERY = ('SELECT ('
+             '    SELECT ST_Value(r.rast, 1, p.geom)::smallint '
+             '    FROM   {table} r '
+             '    WHERE  ST_Intersects(r.rast, p.geom) '
+             '    LIMIT  1'
+             ') '
+             'FROM ('
+             '    SELECT ord, ST_SetSRID(ST_MakePoint(lng, lat), 4326) geom '
+             '    FROM   unnest($1::double precision[], '
+             '                  $2::double precision[]) '
+             '           WITH ORDINALITY AS u(lat, lng, ord)'
+             ') p '
+             'ORDER BY p.ord')
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2017 Jonathan Bouzekri
+#
+# This file is part of the gmalt application
+#
+# MIT License :
+# https://raw.githubusercontent.com/gmalt/api/master/LICENSE.txt
+
+""" Module providing the handler to load elevation data from a standard
+PostgreSQL table filled with `gmalt-hgtload
+<https://github.com/gmalt/cli/blob/master/doc/cli_hgtload.rst>`_ """
+
+import numpy
+
+from gmaltapi.db import ConnectionPool
+from gmaltapi.handlers import BaseHandler
+
+
+class Handler(BaseHandler):
+    """ The `postgres` handler type.
+    Providing a `lat` and `lng`, it looks in a PostgreSQL table for the
+    area containing this position and returns its elevation value.
+
+    The table has one line per elevation value (`lat_min`, `lng_min`,
+    `lat_max`, `lng_max`, `value`). Many positions are resolved with a
+    single query joining the table with the arrays of positions. The query
+    is prepared once per connection.
+
+    :param str database: name of the database
+    :param str user: user to connect with
+    :param str password: password of the user
+    :param str host: host of the database server
+    :param int port: port of the database server
+    :param str table: name of the elevation table, optionally schema
+        qualified (`schema.table`)
+    :param int pool_size: maximum number of connections, default to the
+        `pool_size` of the server or 10
+    :param float pool_timeout: maximum time in seconds to wait for a
+        connection
+    """
+    TYPE = 'postgres'
+
+    DEFAULT_POOL_SIZE = 10
+
+    STATEMENT = 'gmalt_altitudes'
+
+    QUERY = ('SELECT e."value" '
+             'FROM   unnest($1::double precision[], $2::double precision[]) '
+             '       WITH ORDINALITY AS p(lat, lng, ord) '
+             'LEFT JOIN LATERAL ('
+             '    SELECT "value" '
+             '    FROM   {table} '
+             '    WHERE  lat_min <= p.lat AND p.lat <= lat_max '
+             '           AND lng_min <= p.lng AND p.lng <= lng_max '
+             '    LIMIT  1'
+             ') e ON true '
+             'ORDER BY p.ord')
+
+    spec = {
+        'database': 'string()',
+        'user': 'string(default=None)',
+        'password': 'string(default=None)',
+        'host': 'string(default="localhost")',
+        'port': 'integer(default=5432)',
+        'table': 'string(default="elevation")',
+        'pool_size': 'integer(min=1, default=None)',
+        'pool_timeout': 'float(min=0, default=10)'
+    }
+
+    def __init__(self, database, user=None, password=None, host='localhost',
+                 port=5432, table='elevation', pool_size=None,
+                 pool_timeout=10):
+        self.table = table
+        self.pool = ConnectionPool(pool_size or self.DEFAULT_POOL_SIZE,
+                                   timeout=pool_timeout,
+                                   setup=self._prepare, dbname=database,
+                                   user=user, password=password, host=host,
+                                   port=port)
+
+    def get_altitude(self, lat, lng, interpolation=None):
+        """ Get the elevation value of the area containing the position
+
+        :param float lat: the latitude of the elevation you are looking for
+        :param float lng: the longitude of the elevation you are looking for
+        :param str interpolation: ignored, the table stores areas
+        :return: the elevation value for this position or None if not found
+        :rtype: int or None
+        """
+        return self._query([float(lat)], [float(lng)])[0]
+
+    def get_altitudes(self, lats, lngs, interpolation=None):
+        """ Get the elevation values of many positions with a single query
+
+        :param lats: the latitudes of the positions
+        :type lats: array-like of float
+        :param lngs: the longitudes of the positions
+        :type lngs: array-like of float
+        :param str interpolation: ignored, the table stores areas
+        :return: the elevation values in the order of the positions with NaN
+            when there is no value
+        :rtype: :class:`numpy.ndarray` of float
+        """
+        lats = numpy.asarray(lats, dtype=numpy.float64)
+        lngs = numpy.asarray(lngs, dtype=numpy.float64)
+        alts = numpy.full(lats.shape, numpy.nan)
+        if lats.size:
+            values = self._query(lats.ravel().tolist(), lngs.ravel().tolist())
+            alts.reshape(-1)[:] = [numpy.nan if value is None else value
+                                   for value in values]
+        return alts
+
+    def _query(self, lats, lngs):
+        """ Execute the prepared query
+
+        :param list lats: the latitudes of the positions
+        :param list lngs: the longitudes of the positions
+        :return: the elevation values in the order of the positions with
+            None when there is no value
+        :rtype: list
+        """
+        with self.pool.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute('EXECUTE {}(%s, %s)'.format(self.STATEMENT),
+                               (lats, lngs))
+                return [row[0] for row in cursor.fetchall()]
+
+    def _prepare(self, conn):
+        """ Prepare the query on a new connection
+
+        :param conn: the new connection
+        :type conn: :class:`psycopg2.extensions.connection`
+        """
+        query = self.QUERY.format(table=self._quote(self.table))
+        with conn.cursor() as cursor:
+            cursor.execute('PREPARE {}(double precision[], double precision[])'
+                           ' AS {}'.format(self.STATEMENT, query))
+
+    @staticmethod
+    def _quote(identifier):
+        """ Quote a SQL identifier, each part of a schema qualified name
+        (`schema.table`) is quoted
+
+        :param str identifier: a table name
+        :rtype: str
+        """
+        return '.'.join('"{}"'.format(part.replace('"', '""'))
+                        for part in identifier.split('.'))
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2017 Jonathan Bouzekri
+#
+# This file is part of the gmalt application
+#
+# MIT License :
+# https://raw.githubusercontent.com/gmalt/api/master/LICENSE.txt
+
+""" Metrics of the server exposed in the Prometheus text format by
+`GET /metrics`.
+
+The counters and the histograms are plain python numbers and lists without
+lock : the greenlets of a process never switch while updating them. The
+histograms have fixed buckets so an observation is a binary search and an
+increment.
+"""
+
+import bisect
+import time
+
+#: monotonic clock of the durations
+clock = getattr(time, 'perf_counter', time.time)
+
+#: upper bounds in seconds of the buckets of the latency histograms
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+#: content type of the Prometheus text format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram(object):
+    """ A histogram with fixed buckets
+
+    :param buckets: the sorted upper bounds of the buckets, a last `+Inf`
+        bucket is added
+    :type buckets: tuple of float
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def observe(self, value):
+        """ Add a value to the bucket of the smallest upper bound greater
+        than or equal to it
+
+        :param float value: the observed value
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def render(self, name, labels=''):
+        """ Format the histogram in the Prometheus text format
+
+        :param str name: the name of the metric
+        :param str labels: the formatted labels of the histogram, without
+            the braces (`stage="parse"` for example)
+        :return: the lines of the `_bucket`, `_sum` and `_count` samples
+        :rtype: list of str
+        """
+        prefix = labels + ',' if labels else ''
+        lines, cumulated = [], 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulated += count
+            lines.append('{}_bucket{{{}le="{}"}} {}'.format(
+                name, prefix, bound, cumulated))
+        labels = '{' + labels + '}' if labels else ''
+        lines.append('{}_sum{} {!r}'.format(name, labels, self.sum))
+        lines.append('{}_count{} {}'.format(name, labels, cumulated))
+        return lines
+
+
+class RequestTimer(object):
+    """ Split the duration of a request in stages. The duration since the
+    previous mark is added to the stage of the new mark. The durations are
+    only observed by the histograms once the request is finished (see
+    :func:`Metrics.request_finished`)
+    """
+    __slots__ = ('start', 'last', 'durations')
+
+    def __init__(self):
+        self.start = self.last = clock()
+        self.durations = {}
+
+    def mark(self, stage):
+        """ End a stage
+
+        :param str stage: one of :data:`Metrics.STAGES`
+        """
+        now = clock()
+        self.durations[stage] = self.durations.get(stage, 0.0) + \
+            now - self.last
+        self.last = now
+
+    def finish(self):
+        """ End the last stage : the serialization after a lookup or the
+        parsing when the request failed before any lookup
+
+        :return: the duration of the request in seconds
+        :rtype: float
+        """
+        self.mark('serialize' if 'lookup' in self.durations else 'parse')
+        return self.last - self.start
+
+
+class Metrics(object):
+    """ The metrics of a WSGI handler :
+
+    - `gmalt_requests_total` : number of requests by route and status code
+    - `gmalt_requests_in_flight` : number of requests being handled
+    - `gmalt_request_duration_seconds` : histogram of the duration of the
+      requests by route (until the first byte for the streamed responses)
+    - `gmalt_stage_duration_seconds` : histogram of the duration of the
+      stages of the requests (`parse` and validate, handler `lookup`,
+      `serialize`)
+
+    Collectors add the metrics of the other components (see
+    :func:`add_collector`).
+    """
+    STAGES = ('parse', 'lookup', 'serialize')
+
+    def __init__(self):
+        self.requests = {}
+        self.in_flight = 0
+        self.durations = {}
+        self.stages = dict((stage, Histogram()) for stage in self.STAGES)
+        self._collectors = []
+
+    def add_collector(self, collector):
+        """ Add a source of metrics
+
+        :param func collector: callable returning a list of tuples (name,
+            type, help, value) of the current values of some metrics, the
+            value of a `histogram` is a :class:`Histogram`
+        """
+        self._collectors.append(collector)
+
+    def request_finished(self, route, code, timer):
+        """ Record a finished request
+
+        :param str route: the route of the request
+        :param int code: the status code of the response
+        :param timer: the timer started with the request
+        :type timer: :class:`RequestTimer`
+        """
+        duration = timer.finish()
+        key = (route, code)
+        self.requests[key] = self.requests.get(key, 0) + 1
+        histogram = self.durations.get(route)
+        if histogram is None:
+            histogram = self.durations[route] = Histogram()
+        histogram.observe(duration)
+        self.observe_stages(timer)
+
+    def observe_stages(self, timer):
+        """ Record the durations of the stages of a timer
+
+        :param timer: the timer of a request or of a part of a request
+        :type timer: :class:`RequestTimer`
+        """
+        for stage, duration in timer.durations.items():
+            self.stages[stage].observe(duration)
+
+    def render(self):
+        """ Format the metrics in the Prometheus text format
+
+        :rtype: str
+        """
+        lines = ['# HELP gmalt_requests_total Number of requests.',
+                 '# TYPE gmalt_requests_total counter']
+        for (route, code), count in sorted(self.requests.items()):
+            lines.append('gmalt_requests_total{{route="{}",code="{}"}} {}'
+                         .format(route, code, count))
+
+        lines.extend(['# HELP gmalt_requests_in_flight Number of requests '
+                      'being handled.',
+                      '# TYPE gmalt_requests_in_flight gauge',
+                      'gmalt_requests_in_flight {}'.format(self.in_flight)])
+
+        lines.extend(['# HELP gmalt_request_duration_seconds Duration of '
+                      'the requests.',
+                      '# TYPE gmalt_request_duration_seconds histogram'])
+        for route, histogram in sorted(self.durations.items()):
+            lines.extend(histogram.render('gmalt_request_duration_seconds',
+                                          'route="{}"'.format(route)))
+
+        lines.extend(['# HELP gmalt_stage_duration_seconds Duration of the '
+                      'stages of the requests.',
+                      '# TYPE gmalt_stage_duration_seconds histogram'])
+        for stage in self.STAGES:
+            lines.extend(self.stages[stage].render(
+                'gmalt_stage_duration_seconds', 'stage="{}"'.format(stage)
+            ))
+
+        for collector in self._collectors:
+            for name, type_, help_, value in collector():
+                lines.extend(['# HELP {} {}'.format(name, help_),
+                              '# TYPE {} {}'.format(name, type_)])
+                if isinstance(value, Histogram):
+                    lines.extend(value.render(name))
+                else:
+                    lines.append('{} {!r}'.format(name, value))
+        return '\n'.join(lines) + '\n'
+
+
+def handler_metrics(alt_handler):
+    """ Collector of the metrics of the wrappers and the caches of an
+    elevation handler : the cache of the open tiles and the durations of
+    the tile loads of the `file` handler, the response cache and the
+    coalescing
+
+    :param alt_handler: the elevation handler
+    :return: see :func:`Metrics.add_collector`
+    :rtype: list of tuple
+    """
+    metrics = []
+    stats = getattr(alt_handler, 'stats', None)
+    if stats is not None:
+        stats = stats()
+        metrics.extend([
+            ('gmalt_tile_cache_hits_total', 'counter',
+             'Number of lookups of an open tile.', stats['hits']),
+            ('gmalt_tile_cache_misses_total', 'counter',
+             'Number of lookups opening a tile.', stats['misses']),
+            ('gmalt_tile_cache_evictions_total', 'counter',
+             'Number of tiles closed to make room.', stats['evictions']),
+            ('gmalt_tile_cache_tiles', 'gauge',
+             'Number of open tiles.', stats['tiles']),
+            ('gmalt_tile_cache_bytes', 'gauge',
+             'Cumulated size of the open tiles.', stats['bytes'])
+        ])
+        if 'rejections' in stats:
+            metrics.append(('gmalt_tile_cache_rejections_total', 'counter',
+                            'Number of tiles not cached as less used than '
+                            'the tile they would evict.', stats['rejections']))
+    load_stats = getattr(alt_handler, 'load_stats', None)
+    if load_stats is not None:
+        stats = load_stats()
+        metrics.extend([
+            ('gmalt_tile_load_blocking_seconds', 'histogram',
+             'Duration of the tile loads blocking the server.',
+             stats['blocking']),
+            ('gmalt_tile_load_thread_seconds', 'histogram',
+             'Duration of the tile loads in the read threads.',
+             stats['thread'])
+        ])
+        if stats['threads']:
+            metrics.append(('gmalt_tile_read_threads', 'gauge',
+                            'Number of threads reading the tiles.',
+                            stats['threads']))
+    cache_stats = getattr(alt_handler, 'cache_stats', None)
+    if cache_stats is not None:
+        stats = cache_stats()
+        metrics.extend([
+            ('gmalt_response_cache_hits_total', 'counter',
+             'Number of positions found in the response cache.',
+             stats['hits']),
+            ('gmalt_response_cache_misses_total', 'counter',
+             'Number of positions missing in the response cache.',
+             stats['misses']),
+            ('gmalt_response_cache_bypasses_total', 'counter',
+             'Number of interpolated positions not cached.',
+             stats['bypasses']),
+            ('gmalt_response_cache_evictions_total', 'counter',
+             'Number of positions evicted from the response cache.',
+             stats['evictions']),
+            ('gmalt_response_cache_entries', 'gauge',
+             'Number of positions in the response cache.', stats['entries'])
+        ])
+    coalesce_stats = getattr(alt_handler, 'coalesce_stats', None)
+    if coalesce_stats is not None:
+        stats = coalesce_stats()
+        metrics.extend([
+            ('gmalt_coalesce_batches_total', 'counter',
+             'Number of batches of coalesced lookups.', stats['batches']),
+            ('gmalt_coalesce_lookups_total', 'counter',
+             'Number of lookups added to a batch.', stats['lookups']),
+            ('gmalt_coalesce_deduplicated_total', 'counter',
+             'Number of lookups of a position already in a batch.',
+             stats['deduplicated']),
+            ('gmalt_coalesce_delay_seconds', 'histogram',
+             'Delay between a lookup and the start of its batch.',
+             stats['delays'])
+        ])
+    return metrics
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2017 Jonathan Bouzekri
+#
+# This file is part of the gmalt application
+#
+# MIT License :
+# https://raw.githubusercontent.com/gmalt/api/master/LICENSE.txt
+
+""" Packed archive of HGT tiles : a single file with all the tiles of a
+folder, memory-mapped once.
+
+The archive is made of :
+
+- a header : magic string, format version and number of tiles
+- the index of the tiles : for each tile, the (lat, lng) of its bottom
+  left corner, its number of values per line and the offset of its body
+- the tile bodies : the big endian 16 bits values of each HGT file, each
+  body starting on a page boundary
+
+All the integers of the header and the index are big endian.
+"""
+
+import logging
+import mmap
+import os
+import shutil
+import struct
+
+from gmaltapi.tiles import Tile, TileIndex, read_compressed
+
+
+#: magic string at the beginning of an archive
+MAGIC = b'GMALTPAK'
+
+#: version of the archive format
+VERSION = 1
+
+#: magic string, version, number of tiles
+HEADER = struct.Struct('>8sHI')
+
+#: lat, lng, number of values per line, offset of the body
+ENTRY = struct.Struct('>hhIQ')
+
+#: the tile bodies are aligned on this size
+ALIGNMENT = 4096
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def pack_folder(folder, path):
+    """ Build a packed archive from the HGT files (raw or compressed) of a
+    folder. The archive is written to a temporary file renamed once
+    complete
+
+    :param str folder: the folder containing the HGT files
+    :param str path: path of the archive to create
+    :return: the number of tiles in the archive
+    :rtype: int
+    :raises Exception: if the folder does not contain any HGT file
+    """
+    index = TileIndex(folder)
+    if not len(index):
+        raise Exception('folder {} does not contain '
+                        'any HGT file'.format(folder))
+
+    infos = sorted(index, key=lambda info: (info.lat, info.lng))
+    offset = _align(HEADER.size + ENTRY.size * len(infos))
+    offsets = []
+    for info in infos:
+        offsets.append(offset)
+        offset = _align(offset + info.size)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as archive:
+        archive.write(HEADER.pack(MAGIC, VERSION, len(infos)))
+        for info, body_offset in zip(infos, offsets):
+            archive.write(ENTRY.pack(info.lat, info.lng, info.samples,
+                                     body_offset))
+        for info, body_offset in zip(infos, offsets):
+            archive.seek(body_offset)
+            if info.compression is None:
+                with open(info.path, 'rb') as hgt_file:
+                    shutil.copyfileobj(hgt_file, archive)
+            else:
+                archive.write(read_compressed(info))
+        archive.truncate(offset)
+    os.rename(tmp_path, path)
+
+    logging.info('%d HGT files packed in %s', len(infos), path)
+    return len(infos)
+
+
+class PackedArchive(object):
+    """ A packed archive of HGT tiles memory-mapped once. A tile is a view
+    on the mapping created on its first use, no file is opened after
+    startup
+
+    :param str path: path to the archive
+    :raises ValueError: if the file is not a valid archive
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as archive:
+            self._mmap = mmap.mmap(archive.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+        self.path = path
+        self.size = len(self._mmap)
+        self._entries = self._read_index()
+        self._tiles = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, cell):
+        return cell in self._entries
+
+    def __iter__(self):
+        return iter(sorted(self._entries))
+
+    def get(self, cell):
+        """ Get the tile covering a cell
+
+        :param cell: the (lat, lng) of the bottom left corner of the cell
+        :type cell: tuple(int, int)
+        :return: the tile or None if the archive does not contain this cell
+        :rtype: :class:`gmaltapi.tiles.Tile` or None
+        """
+        tile = self._tiles.get(cell)
+        if tile is None:
+            entry = self._entries.get(cell)
+            if entry is None:
+                return None
+            samples, offset = entry
+            data = memoryview(self._mmap)[offset:offset + 2 * samples ** 2]
+            tile = self._tiles[cell] = Tile(self.path, cell[0], cell[1], data)
+        return tile
+
+    def close(self):
+        """ Release the tiles and unmap the archive """
+        for tile in self._tiles.values():
+            tile.close()
+        self._tiles = {}
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+
+    def _read_index(self):
+        """ Read the header and the index of the archive
+
+        :return: dict with the (lat, lng) of the tiles as key and tuple
+            (number of values per line, offset of the body) as value
+        :rtype: dict
+        :raises ValueError: if the file is not a valid archive
+        """
+        if self.size < HEADER.size:
+            raise ValueError('{} is not a HGT archive'.format(self.path))
+        magic, version, count = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError('{} is not a HGT archive'.format(self.path))
+        if version != VERSION:
+            raise ValueError('{} : unsupported archive version '
+                             '{}'.format(self.path, version))
+        if self.size < HEADER.size + ENTRY.size * count:
+            raise ValueError('{} : truncated archive'.format(self.path))
+
+        entries = {}
+        for idx in range(count):
+            lat, lng, samples, offset = ENTRY.unpack_from(
+                self._mmap, HEADER.size + ENTRY.size * idx
+            )
+            if offset + 2 * samples ** 2 > self.size:
+                raise ValueError('{} : truncated archive'.format(self.path))
+            entries[(lat, lng)] = (samples, offset)
+        return entries
@@ -9,8 +9,20 @@
 
 """ Provide a gevent server to serve gmalt API """
 
+import functools
+import logging
+import os
+import signal
+import socket
+import time
+
+import gevent
+import gevent.event
+import gevent.os
 from gevent.pywsgi import WSGIServer
 
+from gmaltapi.admission import AdmissionControl
+
 
 class GmaltServer(WSGIServer):
     """ A gevent webserver API to request elevation data
@@ -22,21 +34,62 @@ class GmaltServer(WSGIServer):
     :param str host: host or ip binded to
     :param int port: port binded to
     :param str cors: optional CORS domains to enable CORS headers
+    :param int workers: number of worker processes. With more than one
+        worker, the process binds the socket and forks the workers which
+        share the socket and the already loaded handler (the memory mapped
+        tiles for example). It restarts the workers which exit until it
+        receives SIGTERM or SIGINT
+    :param int max_queued: with `pool_size`, enable the admission control :
+        the connections are all accepted, at most `pool_size` requests are
+        served at once and at most `max_queued` requests wait for a slot,
+        the other ones get an error 503 at once (see
+        :class:`gmaltapi.admission.AdmissionControl` for `max_wait`,
+        `retry_after` and `batch_pool_size`)
+    :raises ValueError: if `max_queued` is set without `pool_size`
     """
 
-    spec = {
+    spec = dict(AdmissionControl.spec, **{
         'handler': 'string(default="file")',
         'host': 'string(default="localhost")',
         'port': 'integer(default=8088)',
         'cors': 'string(default=None)',
-        'pool_size': 'integer(default=None)'
-    }
+        'pool_size': 'integer(default=None)',
+        'workers': 'integer(min=1, default=1)'
+    })
+
+    #: minimum time in seconds between two starts of a failing worker
+    RESPAWN_DELAY = 1
 
-    def __init__(self, handler, host, port, cors=None, **kwargs):
-        pool_size = kwargs.pop('pool_size') or 'default'
+    def __init__(self, handler, host, port, cors=None, workers=1, **kwargs):
+        pool_size = kwargs.pop('pool_size', None)
+        admission_conf = dict((key, kwargs.pop(key))
+                              for key in AdmissionControl.spec
+                              if key in kwargs)
+        self.admission = None
+        application = handler
+        if admission_conf.get('max_queued') is not None:
+            if not pool_size:
+                raise ValueError('max_queued requires pool_size')
+            # the requests are bounded instead of the connections so that
+            # the requests beyond the queue are answered at once
+            self.admission = application = AdmissionControl(
+                handler, pool_size, **admission_conf
+            )
+            pool_size = None
         super(GmaltServer, self).__init__((host, port),
-                                          self._build_wsgi(handler, cors),
-                                          spawn=pool_size, **kwargs)
+                                          self._build_wsgi(application, cors),
+                                          spawn=pool_size or 'default',
+                                          **kwargs)
+        self.workers = workers
+        self.worker_pids = {}
+        self.connections = 0
+        self._stopping = gevent.event.Event()
+        self._signal_handlers = []
+        metrics = getattr(handler, 'metrics', None)
+        if metrics is not None:
+            metrics.add_collector(self._pool_metrics)
+            if self.admission is not None:
+                metrics.add_collector(self.admission.admission_metrics)
 
     def _build_wsgi(self, handler, cors):
         if cors:
@@ -44,7 +97,121 @@ class GmaltServer(WSGIServer):
             handler = CORS(handler, methods="GET, OPTIONS, POST", origin=cors)
         return handler
 
+    def handle(self, sock, address):
+        """ Disable the Nagle algorithm on the client connection so that a
+        keep-alive response is not delayed until the previous one is
+        acknowledged """
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (socket.error, AttributeError):
+            pass  # not a TCP socket
+        self.connections += 1
+        try:
+            return super(GmaltServer, self).handle(sock, address)
+        finally:
+            self.connections -= 1
+
+    def _pool_metrics(self):
+        """ Collector of the number of connection greenlets and of the size
+        of their pool (only when `pool_size` is set)
+
+        :return: see :func:`gmaltapi.metrics.Metrics.add_collector`
+        :rtype: list of tuple
+        """
+        metrics = [('gmalt_server_connections', 'gauge',
+                    'Number of connections being served.', self.connections)]
+        if self.pool is not None:
+            metrics.append(('gmalt_server_pool_size', 'gauge',
+                            'Maximum number of connections served at once.',
+                            self.pool.size))
+        return metrics
+
     def serve_forever(self, stop_timeout=None):
         """ Start the server """
-        print('Serving on %s:%d' % self.address)
+        if self.workers == 1:
+            print('Serving on %s:%d' % self.address)
+            super(GmaltServer, self).serve_forever(stop_timeout=stop_timeout)
+            return
+
+        self.init_socket()
+        print('Serving on %s:%d with %d workers'
+              % (self.address[0], self.address[1], self.workers))
+        self._signal_handlers = [
+            gevent.signal_handler(signum, self._stopping.set)
+            for signum in (signal.SIGTERM, signal.SIGINT)
+        ]
+        try:
+            for _ in range(self.workers):
+                self._spawn_worker(stop_timeout)
+            # the signal and child watchers do not keep the loop alive
+            while not self._stopping.wait(1):
+                pass
+        finally:
+            self._stopping.set()
+            for signal_handler in self._signal_handlers:
+                signal_handler.cancel()
+            self._stop_workers(stop_timeout)
+            self.close()
+
+    def _spawn_worker(self, stop_timeout):
+        """ Fork a worker process serving on the shared socket """
+        if self._stopping.is_set():
+            return
+        pid = gevent.os.fork_and_watch(
+            callback=functools.partial(self._on_worker_exit, stop_timeout)
+        )
+        if pid == 0:
+            status = 0
+            try:
+                self._run_worker(stop_timeout)
+            except BaseException:
+                logging.exception('worker %d crashed', os.getpid())
+                status = 1
+            finally:
+                os._exit(status)
+        self.worker_pids[pid] = time.time()
+
+    def _run_worker(self, stop_timeout):
+        """ Serve in a forked worker until SIGTERM """
+        for signal_handler in self._signal_handlers:
+            signal_handler.cancel()
+        # CTRL+C reaches the whole process group, the master stops the
+        # workers itself
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        gevent.signal_handler(signal.SIGTERM, lambda: gevent.spawn(
+            self.stop, timeout=stop_timeout
+        ))
         super(GmaltServer, self).serve_forever(stop_timeout=stop_timeout)
+
+    def _on_worker_exit(self, stop_timeout, watcher):
+        """ Restart a worker which exited, waiting `RESPAWN_DELAY` seconds
+        if it did not live that long to avoid a fork loop """
+        started = self.worker_pids.pop(watcher.pid, None)
+        if started is None or self._stopping.is_set():
+            return
+        logging.warning('worker %d exited with status %d, restarting it',
+                        watcher.pid, watcher.rstatus)
+        delay = self.RESPAWN_DELAY \
+            if time.time() - started < self.RESPAWN_DELAY else 0
+        gevent.spawn_later(delay, self._spawn_worker, stop_timeout)
+
+    def _stop_workers(self, stop_timeout):
+        """ Send SIGTERM to the workers and kill the ones still running
+        after the stop timeout """
+        timeout = self.stop_timeout if stop_timeout is None else stop_timeout
+        for pid in list(self.worker_pids):
+            self._kill(pid, signal.SIGTERM)
+        deadline = time.time() + timeout + 1
+        while self.worker_pids and time.time() < deadline:
+            gevent.sleep(0.05)
+        for pid in list(self.worker_pids):
+            self._kill(pid, signal.SIGKILL)
+            gevent.os.waitpid(pid, 0)
+            self.worker_pids.pop(pid, None)
+
+    @staticmethod
+    def _kill(pid, signum):
+        try:
+            os.kill(pid, signum)
+        except OSError:
+            pass  # already exited
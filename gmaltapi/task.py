@@ -9,18 +9,32 @@
 
 """ Celery task and service  """
 
-import time
 from celery import Celery, Task
 
+from gmaltapi.handler import to_json_list
 
-class GetAltitudeTask(Task):
-    """ The celery task to find the altitude of coordinates """
 
-    name = "get_altitude"
+class GetAltitudesTask(Task):
+    """ The celery task to find the altitudes of many positions. It runs in
+    the worker with the `file` handler of the celery application so each
+    worker process keeps its own cache of mapped HGT files between tasks
+    """
+
+    name = "get_altitudes"
 
-    def run(self, lat, lng):
-        time.sleep(10)
-        return lat + lng
+    def run(self, lats, lngs, interpolation=None):
+        """ Get the elevation values of positions
+
+        :param list lats: the latitudes of the positions
+        :param list lngs: the longitudes of the positions
+        :param str interpolation: the interpolation of the elevation between
+            the samples, default to the handler one
+        :return: the elevation values in the order of the positions with
+            None when there is no value
+        :rtype: list
+        """
+        alts = self.app.alt_handler.get_altitudes(lats, lngs, interpolation)
+        return to_json_list(alts)
 
 
 class GmaltCelery(Celery):
@@ -29,6 +43,8 @@ class GmaltCelery(Celery):
     :param str name: name of the celery application
     :param str broker: uri to the broker
     :param str backend: uri to the backend
+    :param dict worker_conf: configuration of the `file` handler used by
+        the workers
     """
 
     spec = {
@@ -37,10 +53,13 @@ class GmaltCelery(Celery):
         'backend': 'string()',
     }
 
-    def __init__(self, name, broker, backend, *args, **kwargs):
+    def __init__(self, name, broker, backend, worker_conf=None, *args,
+                 **kwargs):
         super(GmaltCelery, self).__init__(name, broker=broker, backend=backend,
                                           **kwargs)
-        self.register_task(GetAltitudeTask)
+        self.worker_conf = worker_conf or {}
+        self._alt_handler = None
+        self.register_task(GetAltitudesTask)
 
     def register_task(self, task_class):
         """ Helper to register and bind a task class to this celery instance
@@ -52,28 +71,24 @@ class GmaltCelery(Celery):
         self.tasks[task_class.name].bind(self)
 
     @property
-    def altitude(self):
-        """ Shortcut to the get elevation/altitude task
+    def altitudes(self):
+        """ Shortcut to the get elevations/altitudes task
 
-        :return: the get altitude task
-        :rtype: :class:`gmaltfileservice.task.GetAltitudeTask`
+        :return: the get altitudes task
+        :rtype: :class:`gmaltapi.task.GetAltitudesTask`
         """
-        return self.tasks[GetAltitudeTask.name]
+        return self.tasks[GetAltitudesTask.name]
 
+    @property
+    def alt_handler(self):
+        """ The `file` handler of the worker, created on the first task so
+        that each worker process has its own
 
-def get_altitude_handler(task, environ, start_response):
-    """ Handler to schedule a task to get an elevation value
-
-    :param task: the celery instance
-    :type task: :class:`gmaltfileservice.task.GmaltCelery`
-    :param environ: WSGI environment
-    :param start_response: WSGI start_response
-    :return: list of WSGI binary body response
-    """
-    print(task.altitude.delay(4, 4).get())
-    if environ['PATH_INFO'] == '/':
-        start_response('200 OK', [('Content-Type', 'text/html')])
-        return [b"<b>hello world</b>"]
-    else:
-        start_response('404 Not Found', [('Content-Type', 'text/html')])
-        return [b'<h1>Not Found</h1>']
+        :rtype: :class:`gmaltapi.handlers.file.Handler`
+        """
+        if self._alt_handler is None:
+            import gmaltapi.handlers.file
+            self._alt_handler = gmaltapi.handlers.file.Handler(
+                **self.worker_conf
+            )
+        return self._alt_handler
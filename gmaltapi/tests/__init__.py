@@ -9,6 +9,9 @@
 
 """ Common tools for unit and e2e tests """
 
+import array
+import sys
+
 try:
     from StringIO import StringIO
 except ImportError:
@@ -23,3 +26,30 @@ class ResetStingIO(StringIO):
         read_value = StringIO.read(self, *args, **kwargs)
         self.seek(0)
         return read_value
+
+
+def write_hgt(folder, name, samples, value=None):
+    """ Write a synthetic HGT file in a folder
+
+    :param folder: the folder to write the file to
+    :type folder: :class:`py.path.local`
+    :param str name: the name of the HGT file (ex: `N10E048.hgt`)
+    :param int samples: the number of values per line and per column
+    :param value: a function taking the line and the column as arguments
+        and returning the elevation value. Default to `line * samples + col`
+    :return: the path to the HGT file
+    :rtype: :class:`py.path.local`
+    """
+    if value is None:
+        def value(line, col):
+            return line * samples + col
+
+    values = array.array('h', [value(line, col)
+                               for line in range(samples)
+                               for col in range(samples)])
+    if sys.byteorder == 'little':
+        values.byteswap()  # HGT values are big-endian
+    hgt_file = folder.join(name)
+    hgt_file.write_binary(values.tostring() if sys.version_info[0] < 3
+                          else values.tobytes())
+    return hgt_file
@@ -23,9 +23,13 @@ import gmaltapi.app as app
 
 
 def pytest_addoption(parser):
-    """ Add a `--folder` option to pytest CLI """
+    """ Add the `--folder` and `--postgres` options to pytest CLI """
     parser.addoption("--folder", type=str, help="specify the folder where "
                                                 "the HGT file are stored")
+    parser.addoption("--postgres", type=str, help="connection string of a "
+                                                  "PostgreSQL database to "
+                                                  "test the database "
+                                                  "handlers")
 
 
 @pytest.fixture
@@ -40,6 +44,26 @@ def folder(request):
     return request.config.getoption("--folder")
 
 
+@pytest.fixture
+def postgres(request):
+    """ A pytest fixture to inject the connection parameters of the
+    `--postgres` option provided in the pytest CLI. The test is skipped if
+    the option is not provided
+
+    :return: the keyword arguments of the database handlers
+    :rtype: dict
+    """
+    dsn = request.config.getoption("--postgres")
+    if not dsn:
+        pytest.skip('no --postgres database provided')
+    import psycopg2.extensions
+    params = psycopg2.extensions.parse_dsn(dsn)
+    params['database'] = params.pop('dbname')
+    if 'port' in params:
+        params['port'] = int(params['port'])
+    return params
+
+
 class ApiWebServer(object):
     """ A context manager that runs a gmalt api server in a dedicated
     process based on provided configuration
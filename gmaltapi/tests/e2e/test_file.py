@@ -37,3 +37,39 @@ def test_get_altitude(file_server):
                            params={'lat': 10.9999, 'lng': 10.0001})
         assert alt.status_code == 200
         assert alt.json().get('alt') is None
+
+
+def test_post_altitude_batch(file_server):
+    with file_server:
+        alt = requests.post(file_server.get_url(),
+                            json=[[0.9999, 10.0001], [10.9999, 10.0001]])
+        assert alt.status_code == 200
+        assert alt.json().get('alt') == [57, None]
+        alt = requests.post(file_server.get_url(),
+                            json={'lats': [10.9999, 0.9999],
+                                  'lngs': [10.0001, 10.0001]})
+        assert alt.status_code == 200
+        assert alt.json().get('alt') == [None, 57]
+
+
+def test_get_profile(file_server):
+    with file_server:
+        profile = requests.get(file_server.get_base_url() + '/profile',
+                               params={'path': '0.5,10.2|0.5,11.6',
+                                       'samples': 3})
+        assert profile.status_code == 200
+        assert profile.json().get('alt') == [57, 57, None]
+        assert profile.json().get('ascent') == 0
+        assert profile.json().get('descent') == 0
+
+
+def test_stream_altitude(file_server):
+    with file_server:
+        alt = requests.post(file_server.get_url() + '/stream',
+                            data=b'[0.9999, 10.0001]\n[10.9999, 10.0001]\n',
+                            headers={'Content-Type': 'application/x-ndjson'},
+                            stream=True)
+        assert alt.status_code == 200
+        assert [line for line in alt.iter_lines()] == [
+            b'[0.9999, 10.0001, 57.0]', b'[10.9999, 10.0001, null]'
+        ]
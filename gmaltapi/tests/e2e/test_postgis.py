@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2017 Jonathan Bouzekri
+#
+# This file is part of the gmalt application
+#
+# MIT License :
+# https://raw.githubusercontent.com/gmalt/api/master/LICENSE.txt
+
+""" Module testing the server with a `postgis` handler """
+
+import pytest
+import requests
+
+from .conftest import ApiWebServer, ResetStingIO
+
+
+TABLE = 'gmalt_e2e_elevation_raster'
+
+
+@pytest.fixture
+def postgis_server(postgres):
+    import psycopg2
+
+    db_info = dict(postgres)
+    db_info['dbname'] = db_info.pop('database')
+    conn = psycopg2.connect(**db_info)
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname='postgis'")
+        if cursor.fetchone() is None:
+            conn.close()
+            pytest.skip('the PostGIS extension is not installed')
+        # a 2x2 raster covering lat 0 to 1 and lng 10 to 11
+        cursor.execute('DROP TABLE IF EXISTS {0}; '
+                       'CREATE TABLE {0} (rid serial PRIMARY KEY, '
+                       '                  rast raster); '
+                       'CREATE INDEX ON {0} USING gist '
+                       '(ST_ConvexHull(rast)); '
+                       'INSERT INTO {0} (rast) VALUES (ST_SetValues('
+                       '    ST_AddBand(ST_MakeEmptyRaster(2, 2, 10, 1, 0.5, '
+                       '                                  -0.5, 0, 0, 4326),'
+                       "               '16BSI'::text, 0, -32768),"
+                       '    1, 1, 1, ARRAY[[57, 58], [-32768, 60]]'
+                       '    ::double precision[][]));'.format(TABLE))
+
+    handler_conf = '\n'.join('    {} = {}'.format(key, value)
+                             for key, value in postgres.items())
+    conf = ResetStingIO("""
+    [server]
+    handler = postgis
+
+    [handler]
+    table = {}
+{}
+    """.format(TABLE, handler_conf))
+    yield ApiWebServer(conf)
+
+    with conn.cursor() as cursor:
+        cursor.execute('DROP TABLE {}'.format(TABLE))
+    conn.close()
+
+
+def test_get_altitude(postgis_server):
+    with postgis_server:
+        alt = requests.get(postgis_server.get_url(),
+                           params={'lat': 0.9, 'lng': 10.1})
+        assert alt.status_code == 200
+        assert alt.json().get('alt') == 57
+        alt = requests.get(postgis_server.get_url(),
+                           params={'lat': 10.9999, 'lng': 10.0001})
+        assert alt.status_code == 200
+        assert alt.json().get('alt') is None
+
+
+def test_post_altitude_batch(postgis_server):
+    with postgis_server:
+        alt = requests.post(postgis_server.get_url(),
+                            json=[[0.9, 10.7], [0.2, 10.2], [0.2, 10.7],
+                                  [10.9999, 10.0001]])
+        assert alt.status_code == 200
+        assert alt.json().get('alt') == [58, None, 60, None]
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2017 Jonathan Bouzekri
+#
+# This file is part of the gmalt application
+#
+# MIT License :
+# https://raw.githubusercontent.com/gmalt/api/master/LICENSE.txt
+
+""" Module testing the server with a `postgres` handler """
+
+import pytest
+import requests
+
+from .conftest import ApiWebServer, ResetStingIO
+
+
+TABLE = 'gmalt_e2e_elevation'
+
+
+@pytest.fixture
+def postgres_server(postgres):
+    import psycopg2
+
+    db_info = dict(postgres)
+    db_info['dbname'] = db_info.pop('database')
+    conn = psycopg2.connect(**db_info)
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute('DROP TABLE IF EXISTS {0}; '
+                       'CREATE TABLE {0} ('
+                       '    lat_min DOUBLE PRECISION,'
+                       '    lng_min DOUBLE PRECISION,'
+                       '    lat_max DOUBLE PRECISION,'
+                       '    lng_max DOUBLE PRECISION,'
+                       '    "value" SMALLINT,'
+                       '    PRIMARY KEY (lat_min, lng_min, lat_max, lng_max)'
+                       ');'.format(TABLE))
+        cursor.executemany('INSERT INTO {} VALUES (%s, %s, %s, %s, %s)'
+                           .format(TABLE),
+                           [(0.5, 10.0, 1.0, 10.5, 57),
+                            (0.5, 10.5, 1.0, 11.0, 58)])
+
+    handler_conf = '\n'.join('    {} = {}'.format(key, value)
+                             for key, value in postgres.items())
+    conf = ResetStingIO("""
+    [server]
+    handler = postgres
+
+    [handler]
+    table = {}
+{}
+    """.format(TABLE, handler_conf))
+    yield ApiWebServer(conf)
+
+    with conn.cursor() as cursor:
+        cursor.execute('DROP TABLE {}'.format(TABLE))
+    conn.close()
+
+
+def test_get_altitude(postgres_server):
+    with postgres_server:
+        alt = requests.get(postgres_server.get_url(),
+                           params={'lat': 0.9999, 'lng': 10.0001})
+        assert alt.status_code == 200
+        assert alt.json().get('alt') == 57
+        alt = requests.get(postgres_server.get_url(),
+                           params={'lat': 10.9999, 'lng': 10.0001})
+        assert alt.status_code == 200
+        assert alt.json().get('alt') is None
+
+
+def test_post_altitude_batch(postgres_server):
+    with postgres_server:
+        alt = requests.post(postgres_server.get_url(),
+                            json=[[0.9, 10.7], [10.9999, 10.0001],
+                                  [0.6, 10.2]])
+        assert alt.status_code == 200
+        assert alt.json().get('alt') == [58, None, 57]
@@ -9,10 +9,15 @@
 
 """ Module providing configuration for pytest to run unit tests """
 
+import sys
+
 import pytest
 
 from .. import ResetStingIO  # noqa
 
+# the ASGI application needs asyncio (python 3.6+, asyncio.run in the tests)
+collect_ignore = ['test_asgi.py'] if sys.version_info < (3, 7) else []
+
 
 @pytest.fixture()
 def empty_file_folder(tmpdir):
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2017 Jonathan Bouzekri
+#
+# This file is part of the gmalt application
+#
+# MIT License :
+# https://raw.githubusercontent.com/gmalt/api/master/LICENSE.txt
+
+""" Unit test of :mod:`gmaltapi.admission` """
+
+import json
+
+import gevent
+import gevent.event
+
+from gmaltapi.admission import AdmissionControl
+
+
+class BlockingApp(object):
+    """ A WSGI application answering once `done` is set, recording the
+    order of the served requests """
+    def __init__(self):
+        self.done = gevent.event.Event()
+        self.served = []
+
+    def __call__(self, environ, start_response):
+        self.served.append(environ['QUERY_STRING'])
+        self.done.wait()
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [b'ok']
+
+
+class MockResponse(object):
+    def __call__(self, status, headers):
+        self.status = status
+        self.headers = dict(headers)
+
+
+def call(app, method='GET', path='/altitude', query=''):
+    response = MockResponse()
+    body = b''.join(app({'REQUEST_METHOD': method, 'PATH_INFO': path,
+                         'QUERY_STRING': query}, response))
+    return response.status, response.headers, body
+
+
+def spawn_calls(app, *requests):
+    greenlets = [gevent.spawn(call, app, method, path, query)
+                 for method, path, query in requests]
+    gevent.sleep(0)
+    return greenlets
+
+
+def test__call__():
+    app = BlockingApp()
+    app.done.set()
+    admission = AdmissionControl(app, 1)
+
+    assert call(admission)[0] == '200 OK'
+    assert call(admission)[0] == '200 OK'
+    assert admission.active == [0, 0]
+
+
+def test__call__reject():
+    app = BlockingApp()
+    admission = AdmissionControl(app, 1, max_queued=1, retry_after=5)
+    greenlets = spawn_calls(admission, ('GET', '/altitude', 'first'),
+                            ('GET', '/altitude', 'second'))
+
+    status, headers, body = call(admission)
+    assert status == '503 Service Unavailable'
+    assert headers['Retry-After'] == '5'
+    assert int(headers['Content-Length']) == len(body)
+    assert json.loads(body.decode('utf-8'))['code'] == 503
+    assert admission.rejected == 1
+    values = dict((name, value) for name, _, _, value
+                  in admission.admission_metrics())
+    assert values['gmalt_admission_active'] == 1
+    assert values['gmalt_admission_queued'] == 1
+
+    app.done.set()
+    gevent.joinall(greenlets, raise_error=True)
+    assert [greenlet.value[0] for greenlet in greenlets] == ['200 OK'] * 2
+    assert app.served == ['first', 'second']
+    assert admission.waits.count == 1
+
+
+def test__call__max_wait():
+    app = BlockingApp()
+    admission = AdmissionControl(app, 1, max_queued=10, max_wait=0.01)
+    greenlets = spawn_calls(admission, ('GET', '/altitude', 'first'))
+
+    assert call(admission)[0] == '503 Service Unavailable'
+    assert len(admission.queues[0]) == 0
+    app.done.set()
+    gevent.joinall(greenlets, raise_error=True)
+    assert admission.active == [0, 0]
+
+
+def test__call__priority():
+    app = BlockingApp()
+    admission = AdmissionControl(app, 1, max_queued=10)
+    greenlets = spawn_calls(admission, ('POST', '/altitude', 'running'),
+                            ('POST', '/altitude', 'batch'),
+                            ('GET', '/profile', 'profile'),
+                            ('GET', '/altitude', 'single'))
+
+    app.done.set()
+    gevent.joinall(greenlets, raise_error=True)
+    # the single position lookup goes before the waiting batches
+    assert app.served == ['running', 'single', 'batch', 'profile']
+
+
+def test__call__batch_pool_size():
+    app = BlockingApp()
+    admission = AdmissionControl(app, 3, max_queued=10, batch_pool_size=1)
+    greenlets = spawn_calls(admission, ('POST', '/altitude', 'batch'),
+                            ('POST', '/altitude/stream', 'stream'),
+                            ('GET', '/altitude', 'single'))
+
+    # a slot is left for the single position lookups
+    assert app.served == ['batch', 'single']
+    assert admission.active == [1, 1]
+    app.done.set()
+    gevent.joinall(greenlets, raise_error=True)
+    assert app.served == ['batch', 'single', 'stream']
+
+
+def test__call__exempt():
+    app = BlockingApp()
+    admission = AdmissionControl(app, 1)
+    greenlets = spawn_calls(admission, ('GET', '/altitude', 'first'))
+
+    app.done.set()
+    assert call(admission, path='/metrics')[0] == '200 OK'
+    assert call(admission, method='OPTIONS')[0] == '200 OK'
+    gevent.joinall(greenlets, raise_error=True)
+
+
+def test__call__stream():
+    closed = []
+
+    class Stream(object):
+        def __iter__(self):
+            return iter([b'a', b'b'])
+
+        def close(self):
+            closed.append(True)
+
+    def stream_app(environ, start_response):
+        start_response('200 OK', [])
+        return Stream()
+
+    admission = AdmissionControl(stream_app, 1)
+    result = admission({'REQUEST_METHOD': 'POST',
+                        'PATH_INFO': '/altitude/stream'}, MockResponse())
+    assert b''.join(result) == b'ab'
+    assert admission.active == [0, 1]
+    result.close()
+    result.close()
+    assert closed == [True, True]
+    assert admission.active == [0, 0]
+
+
+def test__call__killed_waiter():
+    app = BlockingApp()
+    admission = AdmissionControl(app, 1, max_queued=10)
+    greenlets = spawn_calls(admission, ('GET', '/altitude', 'first'),
+                            ('GET', '/altitude', 'killed'))
+
+    greenlets[1].kill()
+    assert len(admission.queues[0]) == 0
+    app.done.set()
+    gevent.joinall(greenlets)
+    assert admission.active == [0, 0]
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2017 Jonathan Bouzekri
+#
+# This file is part of the gmalt application
+#
+# MIT License :
+# https://raw.githubusercontent.com/gmalt/api/master/LICENSE.txt
+
+""" Unit test of :mod:`gmaltapi.asgi` """
+
+import asyncio
+import io
+import json
+import threading
+
+import numpy
+import pytest
+
+from .conftest import MockResponse
+from gmaltapi.asgi import ASGIHandler, create_app
+from gmaltapi.handler import WSGIHandler
+
+
+class ThreadHandler(object):
+    """ Record the threads running the lookups. The elevation is the
+    latitude, NaN in the south """
+    interpolation = 'nearest'
+
+    def __init__(self, warm=True):
+        self.warm = warm
+        self.threads = []
+
+    def is_warm(self, lats, lngs, interpolation=None):
+        return self.warm
+
+    def get_altitude(self, lat, lng, interpolation=None):
+        self.threads.append(threading.current_thread())
+        return lat if lat >= 0 else None
+
+    def get_altitudes(self, lats, lngs, interpolation=None):
+        self.threads.append(threading.current_thread())
+        lats = numpy.asarray(lats, dtype=numpy.float64)
+        return numpy.where(lats < 0, numpy.nan, lats)
+
+
+def call_asgi(app, method, path, query=b'', body=b'', headers=(),
+              chunks=None):
+    scope = {'type': 'http', 'http_version': '1.1', 'method': method,
+             'scheme': 'http', 'path': path, 'root_path': '',
+             'query_string': query, 'server': ('localhost', 8088),
+             'client': ('127.0.0.1', 5000),
+             'headers': [(name.encode('latin-1'), value.encode('latin-1'))
+                         for name, value in headers]}
+    if chunks is None:
+        chunks = [body]
+    messages = [{'type': 'http.request', 'body': chunk,
+                 'more_body': idx < len(chunks) - 1}
+                for idx, chunk in enumerate(chunks)]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    assert sent[-1].get('more_body', False) is False
+    return (sent[0]['status'], sent[0]['headers'],
+            b''.join(message.get('body', b'') for message in sent[1:]))
+
+
+def call_wsgi(app, method, path, query=b'', body=b'', headers=()):
+    environ = {'REQUEST_METHOD': method, 'PATH_INFO': path,
+               'QUERY_STRING': query.decode('latin-1'),
+               'CONTENT_LENGTH': str(len(body)),
+               'wsgi.input': io.BytesIO(body)}
+    for name, value in headers:
+        if name == 'Content-Type':
+            environ['CONTENT_TYPE'] = value
+        else:
+            environ['HTTP_' + name.upper().replace('-', '_')] = value
+    response = MockResponse()
+    body = b''.join(app(environ, response))
+    return (int(response.status.split(' ')[0]),
+            [(name.lower().encode('latin-1'), value.encode('latin-1'))
+             for name, value in response.response_headers],
+            body)
+
+
+REQUESTS = [
+    ('GET', '/altitude', b'lat=1.5&lng=10.5', b'', ()),
+    ('GET', '/altitude', b'lat=-1.5&lng=10.5&interpolation=bilinear', b'',
+     ()),
+    ('GET', '/altitude', b'lat=a&lng=10.5', b'', ()),
+    ('GET', '/elevation', b'lat=1.5&lng=10.5', b'', ()),
+    ('PUT', '/altitude', b'', b'', ()),
+    ('OPTIONS', '/altitude/stream', b'', b'', ()),
+    ('POST', '/altitude', b'', b'[[1.5, 10.5], [-2.5, 20.5]]',
+     (('Content-Type', 'application/json'),)),
+    ('POST', '/altitude', b'', b'[[1.5, 10.5',
+     (('Content-Type', 'application/json'),)),
+    ('POST', '/altitude', b'', b'lat=1.5&lng=10.5',
+     (('Content-Type', 'application/x-www-form-urlencoded'),)),
+    ('GET', '/profile', b'path=0.5,10.2|0.5,11.6&samples=3', b'', ()),
+]
+
+
+class TestASGIHandler(object):
+    @pytest.mark.parametrize("warm", [True, False])
+    @pytest.mark.parametrize("method,path,query,body,headers", REQUESTS)
+    def test__call__same_as_wsgi(self, warm, method, path, query, body,
+                                 headers):
+        app = ASGIHandler(WSGIHandler(ThreadHandler(warm)))
+        wsgi_app = WSGIHandler(ThreadHandler(warm))
+
+        assert call_asgi(app, method, path, query, body, headers) == \
+            call_wsgi(wsgi_app, method, path, query, body, headers)
+
+    @pytest.mark.parametrize("headers,chunks", [
+        ([('Content-Length', '70000')], []),
+        ([], [b'[' + b' ' * 40000, b' ' * 40000 + b']']),
+    ])
+    def test__call__body_too_large(self, headers, chunks):
+        app = ASGIHandler(WSGIHandler(ThreadHandler(True),
+                                      batch_max_points=1))
+
+        status, _, body = call_asgi(
+            app, 'POST', '/altitude', chunks=chunks,
+            headers=headers + [('Content-Type', 'application/json')]
+        )
+
+        assert status == 413
+        assert json.loads(body.decode('utf-8'))['message'] == \
+            'A request body is limited to 65664 bytes.'
+        assert app.inline == app.offloaded == 0
+
+    def test__call__warm_inline(self):
+        alt_handler = ThreadHandler(warm=True)
+        app = ASGIHandler(WSGIHandler(alt_handler))
+
+        status, _, body = call_asgi(app, 'GET', '/altitude',
+                                    b'lat=1.5&lng=10.5')
+
+        assert (status, body) == (200, b'{"alt": 1.5}')
+        assert alt_handler.threads == [threading.current_thread()]
+        assert (app.inline, app.offloaded) == (1, 0)
+
+    def test__call__cold_offloaded(self):
+        alt_handler = ThreadHandler(warm=False)
+        app = ASGIHandler(WSGIHandler(alt_handler))
+
+        status, _, body = call_asgi(
+            app, 'POST', '/altitude', body=b'{"lats": [1.5], "lngs": [2]}',
+            headers=[('Content-Type', 'application/json')]
+        )
+
+        assert (status, body) == (200, b'{"alt": [1.5]}')
+        assert len(alt_handler.threads) == 1
+        assert alt_handler.threads[0] is not threading.current_thread()
+        assert (app.inline, app.offloaded) == (0, 1)
+        app.close()
+
+    def test__call__without_is_warm(self, mock_handler):
+        app = ASGIHandler(WSGIHandler(mock_handler))
+        status, _, body = call_asgi(app, 'GET', '/altitude',
+                                    b'lat=1.5&lng=10.5')
+        assert (status, body) == (200, b'{"alt": 57}')
+        assert app.offloaded == 1
+        # the WSGI handler still works without the event loop
+        wsgi_app = app.wsgi_handler
+        assert call_wsgi(wsgi_app, 'GET', '/altitude',
+                         b'lat=1.5&lng=10.5')[2] == b'{"alt": 57}'
+
+    def test__call__not_modified(self):
+        alt_handler = ThreadHandler(warm=False)
+        wsgi_app = WSGIHandler(alt_handler, dataset_version='v1')
+        etag = wsgi_app._cache_headers(1.5, 10.5)[0][1]
+        app = ASGIHandler(wsgi_app)
+
+        status, headers, body = call_asgi(
+            app, 'GET', '/altitude', b'lat=1.5&lng=10.5',
+            headers=[('If-None-Match', etag)]
+        )
+
+        assert (status, body) == (304, b'')
+        assert (b'etag', etag.encode('latin-1')) in headers
+        assert alt_handler.threads == []
+        assert app.inline == 1
+
+    @pytest.mark.parametrize("warm", [True, False])
+    @pytest.mark.parametrize("content_type,chunks", [
+        ('application/x-ndjson', [b'[1, 2]\n[-3', b', 4]\n\n[5, 6]', b'']),
+        ('text/csv', [b'lat,lng\n1,2\n-3,4\n', b'5,6\n']),
+        ('text/csv; charset=utf-8', [b'1,2\n-3,4\n5,6']),
+        ('application/x-ndjson', [b'']),
+        ('application/x-ndjson', [b'[1, 2]\n[3]\n']),
+        ('application/x-ndjson', [b'[1, 2]\n[3, 4]\n', b'[5, 6]\n[91, 1]']),
+        ('text/csv', [b'1,2\n3,4\n' + b'5' * 2000, b'\n']),
+        ('application/json', [b'[[1, 2]]']),
+    ])
+    def test__call__stream_altitude(self, warm, content_type, chunks):
+        app = ASGIHandler(WSGIHandler(ThreadHandler(warm),
+                                      stream_block_size=2))
+        wsgi_app = WSGIHandler(ThreadHandler(warm), stream_block_size=2)
+        headers = [('Content-Type', content_type)]
+
+        assert call_asgi(app, 'POST', '/altitude/stream', headers=headers,
+                         chunks=chunks) == \
+            call_wsgi(wsgi_app, 'POST', '/altitude/stream',
+                      body=b''.join(chunks), headers=headers)
+
+    def test__call__stream_altitude_blocks(self):
+        alt_handler = ThreadHandler(warm=True)
+        app = ASGIHandler(WSGIHandler(alt_handler, stream_block_size=2))
+
+        call_asgi(app, 'POST', '/altitude/stream', b'interpolation=bicubic',
+                  headers=[('Content-Type', 'text/csv')],
+                  chunks=[b'1,2\n3,4\n', b'5,6\n'])
+
+        assert (app.inline, app.offloaded) == (2, 0)
+        alt_handler.warm = False
+        call_asgi(app, 'POST', '/altitude/stream',
+                  headers=[('Content-Type', 'text/csv')],
+                  chunks=[b'1,2\n3,4\n', b'5,6\n'])
+        assert (app.inline, app.offloaded) == (2, 2)
+
+    def test__call__metrics(self):
+        app = ASGIHandler(WSGIHandler(ThreadHandler(warm=False)))
+        call_asgi(app, 'GET', '/altitude', b'lat=1.5&lng=10.5')
+        call_asgi(app, 'POST', '/altitude/stream',
+                  headers=[('Content-Type', 'text/csv')], body=b'1,2\n')
+        call_asgi(app, 'POST', '/altitude/stream',
+                  headers=[('Content-Type', 'text/csv')], body=b'1\n')
+
+        status, _, body = call_asgi(app, 'GET', '/metrics')
+
+        assert status == 200
+        lines = body.decode('utf-8').splitlines()
+        for line in [
+            # the request aborted on the event loop is not counted
+            'gmalt_requests_total{route="/altitude",code="200"} 1',
+            'gmalt_requests_total{route="/altitude/stream",code="200"} 1',
+            'gmalt_requests_total{route="/altitude/stream",code="400"} 1',
+            'gmalt_stage_duration_seconds_count{stage="lookup"} 2',
+            'gmalt_asgi_inline_total 0',
+            'gmalt_asgi_offloaded_total 2'
+        ]:
+            assert line in lines
+        app.close()
+
+    def test__call__lifespan(self):
+        app = ASGIHandler(WSGIHandler(ThreadHandler()))
+        messages = [{'type': 'lifespan.startup'},
+                    {'type': 'lifespan.shutdown'}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(app({'type': 'lifespan'}, receive, send))
+        assert sent == [{'type': 'lifespan.startup.complete'},
+                        {'type': 'lifespan.shutdown.complete'}]
+
+
+def test_create_app(filled_file_folder, tmpdir, monkeypatch):
+    conf_file = tmpdir.join('gmalt.cfg')
+    conf_file.write('[server]\nhandler = file\n\n[handler]\n'
+                    'folder = {}\n'.format(filled_file_folder))
+    monkeypatch.setenv('GMALT_CONFIG', str(conf_file))
+
+    app = create_app()
+    assert isinstance(app, ASGIHandler)
+    assert app.alt_handler.folder == str(filled_file_folder)
+
+    monkeypatch.delenv('GMALT_CONFIG')
+    with pytest.raises(ValueError):
+        create_app()
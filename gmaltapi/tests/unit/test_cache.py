@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2017 Jonathan Bouzekri
+#
+# This file is part of the gmalt application
+#
+# MIT License :
+# https://raw.githubusercontent.com/gmalt/api/master/LICENSE.txt
+
+""" Unit test of :mod:`gmaltapi.cache` """
+
+import gevent
+import numpy
+import pytest
+
+from gmaltapi.cache import CachedHandler
+import gmaltapi.cache
+
+
+class CountingHandler(object):
+    """ Elevation is the number of arcseconds of the latitude, None in the
+    south """
+    interpolation = 'nearest'
+
+    def __init__(self, delay=0):
+        self.calls = []
+        self.delay = delay
+
+    def get_altitude(self, lat, lng, interpolation=None):
+        self.calls.append((lat, lng))
+        gevent.sleep(self.delay)
+        return int(round(lat * 3600)) if lat >= 0 else None
+
+    def get_altitudes(self, lats, lngs, interpolation=None):
+        self.calls.append((list(lats), list(lngs)))
+        return numpy.where(lats < 0, numpy.nan, numpy.rint(lats * 3600))
+
+
+class TestCachedHandler(object):
+    def test_get_altitude_quantized(self):
+        alt_handler = CountingHandler()
+        cache = CachedHandler(alt_handler, 10)
+        assert cache.get_altitude(1.0, 2.0) == 3600
+        # less than half an arcsecond away
+        assert cache.get_altitude(1.0001, 2.0001) == 3600
+        assert cache.get_altitude(-1.0, 2.0) is None
+        assert cache.get_altitude(-1.0, 2.0) is None
+        assert alt_handler.calls == [(1.0, 2.0), (-1.0, 2.0)]
+        assert cache.cache_stats() == {'hits': 2, 'misses': 2,
+                                       'bypasses': 0, 'evictions': 0,
+                                       'entries': 2, 'hit_rate': 0.5}
+
+    def test_get_altitude_same_sample_as_tile(self, filled_file_folder):
+        from gmaltapi.handlers.file import Handler
+        # a SRTM1 tile whose values are the line number from the bottom
+        values = numpy.repeat(numpy.arange(3600, -1, -1), 3601)
+        values.astype('>i2').tofile(str(filled_file_folder.join(
+            'N45E006.hgt')))
+        file_handler = Handler(str(filled_file_folder))
+        # both round to 162000 arcseconds but not to the same line
+        lats = [45.0, 45.00013888888889]
+        expected = [file_handler.get_altitude(lat, 6.5) for lat in lats]
+        assert expected == [0, 1]
+
+        cache = CachedHandler(file_handler, 10)
+        assert [cache.get_altitude(lat, 6.5) for lat in lats] == expected
+        cache = CachedHandler(file_handler, 10)
+        assert cache.get_altitudes(lats, [6.5, 6.5]).tolist() == expected
+
+    def test_get_altitude_resolution(self):
+        alt_handler = CountingHandler()
+        cache = CachedHandler(alt_handler, 10, resolution=3)
+        cache.get_altitude(1.0, 2.0)
+        cache.get_altitude(1.0004, 2.0)  # 1.44 arcsecond away
+        assert len(alt_handler.calls) == 1
+
+    def test_get_altitude_interpolation_bypass(self):
+        alt_handler = CountingHandler()
+        cache = CachedHandler(alt_handler, 10)
+        cache.get_altitude(1.0, 2.0, 'bilinear')
+        cache.get_altitude(1.0, 2.0, 'bilinear')
+        cache.get_altitude(float('nan'), 2.0)
+        assert len(alt_handler.calls) == 3
+        assert cache.cache_stats()['bypasses'] == 3
+
+        alt_handler.interpolation = 'bicubic'
+        cache.get_altitude(1.0, 2.0)
+        cache.get_altitude(1.0, 2.0, 'nearest')
+        cache.get_altitude(1.0, 2.0, 'nearest')
+        assert len(alt_handler.calls) == 5
+
+    def test_evict_lru(self):
+        alt_handler = CountingHandler()
+        cache = CachedHandler(alt_handler, 2)
+        cache.get_altitude(1.0, 0)
+        cache.get_altitude(2.0, 0)
+        cache.get_altitude(1.0, 0)  # 2.0 is now the least recently used
+        cache.get_altitude(3.0, 0)
+        assert len(cache) == 2
+        assert cache.evictions == 1
+        cache.get_altitude(1.0, 0)
+        cache.get_altitude(2.0, 0)
+        assert [call[0] for call in alt_handler.calls] == [1.0, 2.0, 3.0,
+                                                           2.0]
+
+    def test_ttl(self, monkeypatch):
+        now = [1000.0]
+        monkeypatch.setattr(gmaltapi.cache.time, 'time', lambda: now[0])
+        alt_handler = CountingHandler()
+        cache = CachedHandler(alt_handler, 10, ttl=60)
+        cache.get_altitude(1.0, 0)
+        now[0] += 59
+        cache.get_altitude(1.0, 0)
+        now[0] += 2
+        cache.get_altitude(1.0, 0)
+        assert len(alt_handler.calls) == 2
+
+    def test_get_altitude_concurrent(self):
+        alt_handler = CountingHandler(delay=0.01)
+        cache = CachedHandler(alt_handler, 10)
+        greenlets = [gevent.spawn(cache.get_altitude, 1.0, 2.0)
+                     for _ in range(5)]
+        gevent.joinall(greenlets)
+        assert [greenlet.value for greenlet in greenlets] == [3600] * 5
+        assert len(alt_handler.calls) == 1
+        assert cache.cache_stats()['hits'] == 4
+
+    def test_get_altitude_error(self):
+        class FailingHandler(object):
+            def get_altitude(self, lat, lng):
+                raise ValueError()
+
+        cache = CachedHandler(FailingHandler(), 10)
+        with pytest.raises(ValueError):
+            cache.get_altitude(1.0, 2.0)
+        assert len(cache) == 0
+        assert cache._pending == {}
+
+    def test_get_altitude_killed(self):
+        cache = CachedHandler(CountingHandler(delay=0.01), 10)
+        fetching, waiting = [gevent.spawn(cache.get_altitude, 1.0, 2.0)
+                             for _ in range(2)]
+        gevent.sleep(0)
+        fetching.kill()
+        waiting.join(1)
+        assert isinstance(waiting.exception, RuntimeError)
+        assert cache._pending == {}
+        assert cache.get_altitude(1.0, 2.0) == 3600
+
+    def test_get_altitudes(self):
+        alt_handler = CountingHandler()
+        cache = CachedHandler(alt_handler, 10)
+        cache.get_altitude(1.0, 0)
+        alts = cache.get_altitudes([1.0, -1.0, 2.0, numpy.nan, 2.0001],
+                                   [0, 0, 0, 0, 0])
+        numpy.testing.assert_array_equal(alts, [3600, numpy.nan, 7200,
+                                                numpy.nan, 7200])
+        # a single batch for the missing positions
+        assert alt_handler.calls[1] == ([-1.0, 2.0, 2.0001], [0, 0, 0])
+        assert cache.get_altitude(-1.0, 0) is None
+        assert len(alt_handler.calls) == 2
+
+    def test_get_altitudes_without_batch(self, mock_handler):
+        cache = CachedHandler(mock_handler, 10)
+        alts = cache.get_altitudes([1.5, 1.5], [10.5, 10.5])
+        numpy.testing.assert_array_equal(alts, [57, 57])
+
+    def test_is_warm(self):
+        class WarmHandler(CountingHandler):
+            def is_warm(self, lats, lngs, interpolation=None):
+                return lats[0] > 10
+
+        cache = CachedHandler(WarmHandler(), 10)
+        assert not cache.is_warm([1.0], [2.0])
+        assert cache.is_warm([11.0], [2.0])
+        cache.get_altitude(1.0, 2.0)
+        assert cache.is_warm([1.0001], [2.0])
+        assert not cache.is_warm([1.0], [2.0], 'bilinear')
+        assert not CachedHandler(CountingHandler(), 10).is_warm([1.0], [2.0])
+
+    def test_getattr(self):
+        alt_handler = CountingHandler()
+        alt_handler.folder = '/data'
+        assert CachedHandler(alt_handler, 10).folder == '/data'
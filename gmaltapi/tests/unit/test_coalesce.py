@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2017 Jonathan Bouzekri
+#
+# This file is part of the gmalt application
+#
+# MIT License :
+# https://raw.githubusercontent.com/gmalt/api/master/LICENSE.txt
+
+""" Unit test of :mod:`gmaltapi.coalesce` """
+
+import time
+
+import gevent
+import numpy
+import pytest
+
+from gmaltapi.coalesce import CoalescingHandler
+
+
+class BatchHandler(object):
+    """ Elevation is the latitude, NaN in the south. Records the batches """
+    interpolation = 'nearest'
+
+    def __init__(self, error=None):
+        self.batches = []
+        self.error = error
+
+    def get_altitudes(self, lats, lngs, interpolation=None):
+        self.batches.append((list(lats), list(lngs), interpolation))
+        if self.error is not None:
+            raise self.error
+        lats = numpy.asarray(lats, dtype=numpy.float64)
+        return numpy.where(lats < 0, numpy.nan, lats)
+
+
+def lookup_all(handler, positions):
+    greenlets = [gevent.spawn(handler.get_altitude, *position)
+                 for position in positions]
+    gevent.joinall(greenlets, raise_error=True)
+    return [greenlet.value for greenlet in greenlets]
+
+
+class TestCoalescingHandler(object):
+    def test_get_altitude_batch(self):
+        alt_handler = BatchHandler()
+        handler = CoalescingHandler(alt_handler, 0)
+
+        alts = lookup_all(handler, [(1, 10), (2.5, 20), (-3, 30)])
+
+        assert alts == [1, 2.5, None]
+        assert isinstance(alts[0], int)
+        assert alt_handler.batches == [([1, 2.5, -3], [10, 20, 30], None)]
+        stats = handler.coalesce_stats()
+        assert (stats['batches'], stats['lookups'], stats['batch_size']) == \
+            (1, 3, 3.0)
+        assert stats['delays'].count == 3
+
+    def test_get_altitude_deduplicated(self):
+        alt_handler = BatchHandler()
+        handler = CoalescingHandler(alt_handler, 0)
+
+        assert lookup_all(handler, [(1, 10), (1, 10), (2, 10)]) == [1, 1, 2]
+        assert alt_handler.batches == [([1, 2], [10, 10], None)]
+        assert handler.deduplicated == 1
+
+    def test_get_altitude_max_size(self):
+        alt_handler = BatchHandler()
+        handler = CoalescingHandler(alt_handler, 100000, max_size=3)
+
+        start = time.time()
+        assert lookup_all(handler, [(i, 10) for i in range(6)]) == \
+            list(range(6))
+        # full batches do not wait for the end of the window
+        assert time.time() - start < 0.1
+        assert [len(batch[0]) for batch in alt_handler.batches] == [3, 3]
+
+    def test_get_altitude_window(self):
+        alt_handler = BatchHandler()
+        handler = CoalescingHandler(alt_handler, 20000)
+
+        late = gevent.spawn_later(0.01, handler.get_altitude, 2, 10)
+        start = time.time()
+        assert handler.get_altitude(1, 10) == 1
+        assert 0.015 < time.time() - start < 0.1
+        late.join()
+        assert late.value == 2
+        assert alt_handler.batches == [([1, 2], [10, 10], None)]
+
+    def test_get_altitude_interpolation(self):
+        alt_handler = BatchHandler()
+        handler = CoalescingHandler(alt_handler, 0)
+
+        alts = lookup_all(handler, [(1, 10), (2, 10, 'bilinear'),
+                                    (3, 10, 'bilinear')])
+
+        assert alts == [1, 2.0, 3.0]
+        assert isinstance(alts[1], float)
+        assert sorted(alt_handler.batches, key=str) == [
+            ([1], [10], None), ([2, 3], [10, 10], 'bilinear')
+        ]
+        assert handler.batches == 1
+
+    def test_get_altitude_exception(self):
+        handler = CoalescingHandler(BatchHandler(ValueError('boom')), 0)
+        greenlets = [gevent.spawn(handler.get_altitude, lat, 10)
+                     for lat in (1, 2)]
+        gevent.joinall(greenlets)
+        assert all(isinstance(greenlet.exception, ValueError)
+                   for greenlet in greenlets)
+        # the failed positions are not pending anymore
+        handler.alt_handler.error = None
+        assert handler.get_altitude(1, 10) == 1
+
+    def test_get_altitude_killed(self):
+        class SlowHandler(BatchHandler):
+            def get_altitudes(self, lats, lngs, interpolation=None):
+                gevent.sleep(0.01)
+                return BatchHandler.get_altitudes(self, lats, lngs)
+
+        handler = CoalescingHandler(SlowHandler(), 0, max_size=2)
+        waiting = gevent.spawn(handler.get_altitude, 1, 10)
+        gevent.sleep(0)
+        # the second lookup fills the batch and resolves it
+        flushing = gevent.spawn(handler.get_altitude, 2, 10)
+        gevent.sleep(0)
+        flushing.kill()
+
+        waiting.join()
+        assert isinstance(waiting.exception, RuntimeError)
+        assert handler._pending == {}
+        assert handler.get_altitude(1, 10) == 1
+
+    def test_get_altitudes(self):
+        alt_handler = BatchHandler()
+        handler = CoalescingHandler(alt_handler, 0)
+        assert handler.get_altitudes([1, 2], [3, 4]).tolist() == [1, 2]
+        assert handler.batches == 0
+        assert handler.interpolation == 'nearest'
+
+    @pytest.mark.parametrize("interpolation", [None, 'bilinear'])
+    def test_get_altitude_same_as_handler(self, filled_file_folder,
+                                          interpolation):
+        from gmaltapi.handlers.file import Handler
+        folder = filled_file_folder
+        numpy.arange(1201 * 1201, dtype='>i2').tofile(
+            str(folder.join('N00E010.hgt')))
+        file_handler = Handler(str(folder))
+        handler = CoalescingHandler(Handler(str(folder)), 0)
+        positions = [(0.25, 10.25), (0.5001, 10.75), (0.9, 10.1), (2, 2)]
+
+        assert lookup_all(handler, [position + (interpolation,)
+                                    for position in positions]) == \
+            [file_handler.get_altitude(lat, lng, interpolation)
+             for lat, lng in positions]
@@ -11,10 +11,13 @@
 
 import pytest
 
+from .. import write_hgt
 from .conftest import ResetStingIO
 
 import gmaltapi.config as config
 import gmaltapi.app as app
+import gmaltapi.cache
+import gmaltapi.coalesce
 import gmaltapi.handler
 import gmaltapi.handlers.file
 
@@ -24,9 +27,11 @@ class TestGmaltServerConfigObj(object):
         handler_spec = config \
             .GmaltServerConfigObj \
             ._build_handler_spec()
-        opt1 = "option(celery, file, default=file)"
-        opt2 = "option(file, celery, default=file)"
-        assert handler_spec in [opt1, opt2]
+        assert handler_spec.startswith('option(')
+        assert handler_spec.endswith(', default=file)')
+        types = handler_spec[len('option('):-len(', default=file)')]
+        assert sorted(types.split(', ')) == ['celery', 'file', 'packed',
+                                             'postgis', 'postgres']
 
     def test__init__wrong_type(self):
         conf_file = ResetStingIO("""
@@ -58,7 +63,7 @@ class TestGmaltServerConfigObj(object):
 
         with pytest.raises(ValueError) as exc:
             config.GmaltServerConfigObj(conf_file, app.App.spec)
-        assert str(exc.value) == "'None' in ['handler'] : missing required\n"
+        assert str(exc.value) == "'folder' in ['handler'] : missing required\n"
 
 
 def test_make_config_file_loader_default(filled_file_folder):
@@ -87,6 +92,7 @@ def test_make_config_file_loader(filled_file_folder):
     port = 80
     pool_size = 100
     handler = file
+    batch_max_points = 50
 
     [handler]
     folder = {}
@@ -96,10 +102,139 @@ def test_make_config_file_loader(filled_file_folder):
     assert conf['server']['host'] == '0.0.0.0'
     assert conf['server']['port'] == 80
     assert conf['server']['pool_size'] == 100
+    assert 'batch_max_points' not in conf['server']
     assert isinstance(conf['server']['handler'],
                       gmaltapi.handler.WSGIHandler)
+    assert conf['server']['handler'].batch_loader.max_points == 50
     assert isinstance(conf['server']['handler'].alt_handler,
                       gmaltapi.handlers.file.Handler)
     assert conf['server']['handler'].alt_handler.folder == \
         str(filled_file_folder)
     assert conf['handler']['folder'] == str(filled_file_folder)
+
+
+def test_make_config_response_cache(filled_file_folder):
+    conf_file = ResetStingIO("""
+    [server]
+    handler = file
+    response_cache_size = 1000
+    response_cache_ttl = 3600
+    response_cache_resolution = 3
+
+    [handler]
+    folder = {}
+    """.format(filled_file_folder))
+
+    conf = config.GmaltServerConfigObj(conf_file, app.App.spec)
+    assert 'response_cache_size' not in conf['server']
+    alt_handler = conf['server']['handler'].alt_handler
+    assert isinstance(alt_handler, gmaltapi.cache.CachedHandler)
+    assert alt_handler.size == 1000
+    assert alt_handler.ttl == 3600
+    assert alt_handler.scale == 1200
+    assert isinstance(alt_handler.alt_handler,
+                      gmaltapi.handlers.file.Handler)
+    assert alt_handler.folder == str(filled_file_folder)
+
+
+def test_make_config_coalesce(filled_file_folder):
+    conf_file = ResetStingIO("""
+    [server]
+    handler = file
+    coalesce_window = 200
+    coalesce_max_size = 50
+    response_cache_size = 1000
+
+    [handler]
+    folder = {}
+    """.format(filled_file_folder))
+
+    conf = config.GmaltServerConfigObj(conf_file, app.App.spec)
+    assert 'coalesce_window' not in conf['server']
+    alt_handler = conf['server']['handler'].alt_handler
+    assert isinstance(alt_handler, gmaltapi.cache.CachedHandler)
+    coalescer = alt_handler.alt_handler
+    assert isinstance(coalescer, gmaltapi.coalesce.CoalescingHandler)
+    assert (coalescer.window, coalescer.max_size) == (0.0002, 50)
+    assert isinstance(coalescer.alt_handler, gmaltapi.handlers.file.Handler)
+
+
+def test_make_config_no_coalesce(filled_file_folder):
+    conf_file = ResetStingIO("""
+    [server]
+    handler = file
+
+    [handler]
+    folder = {}
+    """.format(filled_file_folder))
+
+    conf = config.GmaltServerConfigObj(conf_file, app.App.spec)
+    assert isinstance(conf['server']['handler'].alt_handler,
+                      gmaltapi.handlers.file.Handler)
+
+
+def test_make_config_postgres_pool_size():
+    conf_file = ResetStingIO("""
+    [server]
+    handler = postgres
+    pool_size = 20
+
+    [handler]
+    database = gmalt
+    """)
+
+    conf = config.GmaltServerConfigObj(conf_file, app.App.spec)
+    assert conf['server']['handler'].alt_handler.pool.size == 20
+    assert conf['server']['pool_size'] == 20
+
+
+def test_make_config_celery():
+    conf_file = ResetStingIO("""
+    [server]
+    handler = celery
+
+    [handler]
+    broker = memory://
+    backend = cache+memory://
+    chunk_size = 500
+    cache_max_tiles = 16
+    """)
+
+    conf = config.GmaltServerConfigObj(conf_file, app.App.spec)
+    celery_handler = conf['server']['handler'].alt_handler
+    assert celery_handler.chunk_size == 500
+    assert celery_handler.celery.worker_conf['cache_max_tiles'] == 16
+    assert celery_handler.celery.worker_conf['folder'] is None
+
+
+def test_app_preload(filled_file_folder, capsys):
+    write_hgt(filled_file_folder, 'N10E048.hgt', 11)
+    conf_file = ResetStingIO("""
+    [server]
+    handler = file
+    response_cache_size = 10
+
+    [handler]
+    folder = {}
+    preload_bbox = 10, 48, 11, 49
+    preload_workers = 2
+    """.format(filled_file_folder))
+
+    gmalt_app = app.App(conf_file)
+    alt_handler = gmalt_app.conf['server']['handler'].alt_handler
+    assert alt_handler.alt_handler.preload_cells == [(10, 48)]
+    assert gmalt_app.preload() == (1, 242)
+    assert alt_handler.is_warm([10.5], [48.5])
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].startswith('Preloading tiles : 1/1 (')
+    assert lines[1].startswith('Preloaded 1 tiles (0.0 MB) in ')
+
+
+def test_app_preload_nothing(filled_file_folder, capsys):
+    conf_file = ResetStingIO("""
+    [handler]
+    folder = {}
+    """.format(filled_file_folder))
+
+    assert app.App(conf_file).preload() is None
+    assert capsys.readouterr().out == ''
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2017 Jonathan Bouzekri
+#
+# This file is part of the gmalt application
+#
+# MIT License :
+# https://raw.githubusercontent.com/gmalt/api/master/LICENSE.txt
+
+""" Unit test of :mod:`gmaltapi.db` """
+
+import os
+import time
+
+import gevent
+import pytest
+
+psycopg2 = pytest.importorskip('psycopg2')
+pytest.importorskip('psycopg2.extensions')
+
+import gmaltapi.db as db
+
+
+class MockCursor(object):
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def execute(self, query, params=None):
+        self.conn.queries.append((query, params))
+
+    def fetchall(self):
+        return self.conn.rows
+
+
+class MockConnection(object):
+    def __init__(self, **db_info):
+        self.db_info = db_info
+        self.closed = 0
+        self.autocommit = False
+        self.queries = []
+        self.rows = []
+
+    def cursor(self):
+        return MockCursor(self)
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture()
+def mock_connect(monkeypatch):
+    connections = []
+
+    def connect(**db_info):
+        connections.append(MockConnection(**db_info))
+        return connections[-1]
+
+    monkeypatch.setattr(psycopg2, 'connect', connect)
+    return connections
+
+
+class MockPollConnection(object):
+    def __init__(self, states, fds=()):
+        self.states = list(states)
+        self.fds = list(fds)
+
+    def poll(self):
+        return self.states.pop(0)
+
+    def fileno(self):
+        return self.fds.pop(0)
+
+
+class TestGeventWaitCallback(object):
+    def test_ready(self):
+        conn = MockPollConnection([psycopg2.extensions.POLL_OK])
+        db.gevent_wait_callback(conn)
+        assert conn.states == []
+
+    def test_wait(self):
+        read_fd, write_fd = os.pipe()
+        os.write(write_fd, b'x')
+        conn = MockPollConnection([psycopg2.extensions.POLL_READ,
+                                   psycopg2.extensions.POLL_WRITE,
+                                   psycopg2.extensions.POLL_OK],
+                                  [read_fd, write_fd])
+        try:
+            db.gevent_wait_callback(conn, timeout=1)
+        finally:
+            os.close(read_fd)
+            os.close(write_fd)
+        assert conn.states == []
+
+    def test_bad_state(self):
+        with pytest.raises(psycopg2.OperationalError):
+            db.gevent_wait_callback(MockPollConnection([42]))
+
+
+class TestConnectionPool(object):
+    def test_get_opens_on_demand(self, mock_connect):
+        pool = db.ConnectionPool(2, dbname='gmalt', host='localhost')
+        conn = pool.get()
+        assert conn.db_info == {'dbname': 'gmalt', 'host': 'localhost'}
+        assert conn.autocommit is True
+        assert pool.opened == 1
+        pool.put(conn)
+        assert pool.get() is conn
+        assert len(mock_connect) == 1
+
+    def test_get_timeout(self, mock_connect):
+        pool = db.ConnectionPool(1, timeout=0.01)
+        pool.get()
+        with pytest.raises(db.PoolTimeout) as e:
+            pool.get()
+        assert str(e.value) == 'no database connection available ' \
+                               'after 0.01 seconds'
+        assert len(mock_connect) == 1
+
+    def test_setup(self, mock_connect):
+        pool = db.ConnectionPool(1, setup=lambda conn: conn.queries.append(1))
+        assert pool.get().queries == [1]
+
+    def test_setup_error(self, mock_connect):
+        def setup(conn):
+            raise psycopg2.ProgrammingError()
+
+        pool = db.ConnectionPool(1, setup=setup)
+        with pytest.raises(psycopg2.ProgrammingError):
+            pool.get()
+        assert mock_connect[0].closed == 1
+        assert pool.opened == 0
+
+    def test_connection(self, mock_connect):
+        pool = db.ConnectionPool(1)
+        with pool.connection() as conn:
+            pass
+        with pytest.raises(ValueError):
+            with pool.connection() as same_conn:
+                raise ValueError()
+        assert same_conn is conn
+        assert conn.closed == 0
+        assert pool.opened == 1
+
+    def test_connection_broken(self, mock_connect):
+        pool = db.ConnectionPool(1)
+        with pytest.raises(psycopg2.OperationalError):
+            with pool.connection():
+                raise psycopg2.OperationalError()
+        assert mock_connect[0].closed == 1
+        assert pool.opened == 0
+        with pool.connection() as conn:
+            assert conn is mock_connect[1]
+
+    def test_connection_broken_wakes_waiter(self, mock_connect):
+        pool = db.ConnectionPool(1, timeout=1)
+        conn = pool.get()
+        waiter = gevent.spawn(pool.get)
+        gevent.sleep(0)
+        start = time.time()
+        pool.put(conn, discard=True)
+        # the waiter opens a new connection without waiting for the timeout
+        assert waiter.get() is mock_connect[1]
+        assert time.time() - start < 0.5
+        assert pool.opened == 1
+
+    def test_close(self, mock_connect):
+        pool = db.ConnectionPool(2)
+        conns = [pool.get(), pool.get()]
+        for conn in conns:
+            pool.put(conn)
+        pool.close()
+        assert [conn.closed for conn in conns] == [1, 1]
+        assert pool.opened == 0
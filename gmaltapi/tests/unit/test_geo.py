@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2017 Jonathan Bouzekri
+#
+# This file is part of the gmalt application
+#
+# MIT License :
+# https://raw.githubusercontent.com/gmalt/api/master/LICENSE.txt
+
+""" Unit test of :mod:`gmaltapi.geo` """
+
+import numpy
+import pytest
+
+import gmaltapi.geo as geo
+
+
+def test_decode_polyline():
+    lats, lngs = geo.decode_polyline('_p~iF~ps|U_ulLnnqC_mqNvxq`@')
+    numpy.testing.assert_allclose(lats, [38.5, 40.7, 43.252])
+    numpy.testing.assert_allclose(lngs, [-120.2, -120.95, -126.453])
+
+
+@pytest.mark.parametrize("encoded", ['_p~iF~ps|U_ulL', '_p~iF~ps|U_', ' '])
+def test_decode_polyline_invalid(encoded):
+    with pytest.raises(ValueError):
+        geo.decode_polyline(encoded)
+
+
+def test_segment_lengths():
+    lengths = geo.segment_lengths(numpy.array([0., 0., 1.]),
+                                  numpy.array([0., 1., 1.]))
+    numpy.testing.assert_allclose(lengths, [111195.08, 111195.08])
+
+
+def test_densify():
+    lats, lngs = geo.densify(numpy.array([0., 0., 10.]),
+                             numpy.array([0., 1., 1.]),
+                             numpy.array([0., 55597.54, 111195.08,
+                                          111195.08 * 6]))
+    numpy.testing.assert_allclose(lats, [0, 0, 0, 5], atol=1e-6)
+    numpy.testing.assert_allclose(lngs, [0, 0.5, 1, 1], atol=1e-6)
+
+
+def test_densify_great_circle():
+    # the middle of the segment is north of the parallel
+    lats, lngs = geo.densify(numpy.array([45., 45.]),
+                             numpy.array([-45., 45.]),
+                             numpy.array([geo.segment_lengths(
+                                 numpy.array([45., 45.]),
+                                 numpy.array([-45., 45.]))[0] / 2]))
+    numpy.testing.assert_allclose(lats, [54.735610], atol=1e-6)
+    numpy.testing.assert_allclose(lngs, [0], atol=1e-6)
+
+
+def test_densify_duplicated_positions():
+    lats, lngs = geo.densify(numpy.array([1., 1., 1.]),
+                             numpy.array([2., 2., 3.]),
+                             numpy.array([0., 1.]))
+    numpy.testing.assert_allclose(lats, [1, 1], atol=1e-6)
+    numpy.testing.assert_allclose(lngs, [2, 2.000009], atol=1e-6)
+
+
+def test_sample_distances():
+    numpy.testing.assert_allclose(geo.sample_distances(100, samples=3),
+                                  [0, 50, 100])
+    numpy.testing.assert_allclose(geo.sample_distances(100, spacing=30),
+                                  [0, 30, 60, 90, 100])
+    numpy.testing.assert_allclose(geo.sample_distances(90, spacing=30),
+                                  [0, 30, 60, 90])
+    numpy.testing.assert_allclose(geo.sample_distances(0, spacing=30), [0])
+
+
+def test_ascent_descent():
+    assert geo.ascent_descent(numpy.array([1., 3, numpy.nan, 2, 5, 1])) == \
+        (5.0, 5.0)
+    assert geo.ascent_descent(numpy.array([numpy.nan])) == (0.0, 0.0)
@@ -9,14 +9,39 @@
 
 """ Unit test of :mod:`gmaltapi.handler` """
 
+import io
+import json
+
+import gevent
+import gevent.pywsgi
+import gevent.socket
+import numpy
 import pytest
 import webob
 import webob.exc
 
+from .conftest import MockResponse
 import gmaltapi.handler as handler
 import gmaltapi.handlers.file
 
 
+def json_env(body, content_type='application/json', path='/altitude'):
+    body = body.encode('utf-8')
+    return {'REQUEST_METHOD': 'POST', 'PATH_INFO': path,
+            'QUERY_STRING': '', 'CONTENT_TYPE': content_type,
+            'CONTENT_LENGTH': str(len(body)), 'wsgi.input': io.BytesIO(body)}
+
+
+def stream_env(body, content_type='application/x-ndjson'):
+    return json_env(body, content_type, '/altitude/stream')
+
+
+class LatHandler(object):
+    """ Elevation is the latitude, NaN in the south """
+    def get_altitudes(self, lats, lngs):
+        return numpy.where(lats < 0, numpy.nan, lats)
+
+
 class TestAltShema(object):
     def test_read_params_empty(self):
         alt_schema = handler.AltSchema()
@@ -30,6 +55,212 @@ class TestAltShema(object):
         params = alt_schema.read_params(req)
         assert params['lat'] == '1.001'
         assert params['lng'] == '10.001'
+        assert 'interpolation' not in params
+
+    def test_read_params_interpolation(self):
+        req = webob.Request({'QUERY_STRING': 'lat=1&lng=1&'
+                                             'interpolation=bilinear'})
+        alt_schema = handler.AltSchema()
+        params = alt_schema.read_params(req)
+        assert params['interpolation'] == 'bilinear'
+
+
+class InterpolationHandler(object):
+    def __init__(self):
+        self.kwargs = None
+
+    def get_altitude(self, lat, lng, **kwargs):
+        self.kwargs = kwargs
+        return 57
+
+    def get_altitudes(self, lats, lngs, **kwargs):
+        self.kwargs = kwargs
+        return numpy.full(len(lats), 57.0)
+
+
+def test_load_interpolation():
+    assert handler.load_interpolation(None) == {}
+    assert handler.load_interpolation('bicubic') == \
+        {'interpolation': 'bicubic'}
+    with pytest.raises(webob.exc.HTTPBadRequest) as exc:
+        handler.load_interpolation('linear')
+    assert exc.value.detail == {'interpolation': ['Not a valid choice.']}
+
+
+class TestBatchLoader(object):
+    def test_load_pairs(self):
+        lats, lngs = handler.BatchLoader(10).load([[1, 10.5], [-2.5, 20]])
+        assert lats.tolist() == [1.0, -2.5]
+        assert lngs.tolist() == [10.5, 20.0]
+
+    def test_load_parallel_arrays(self):
+        data = {'lats': [1, -2.5], 'lngs': [10.5, 20]}
+        lats, lngs = handler.BatchLoader(10).load(data)
+        assert lats.tolist() == [1.0, -2.5]
+        assert lngs.tolist() == [10.5, 20.0]
+
+    @pytest.mark.parametrize("data", [[], {'lats': [], 'lngs': []}])
+    def test_load_empty(self, data):
+        lats, lngs = handler.BatchLoader(10).load(data)
+        assert len(lats) == 0
+        assert len(lngs) == 0
+
+    @pytest.mark.parametrize("data,errors", [
+        ([[1, 2], [3]], {'points': ['Must be an array of [lat, lng] '
+                                    'pairs.']}),
+        ([[1, 2, 3]], {'points': ['Must be an array of [lat, lng] '
+                                  'pairs.']}),
+        ([[1, 'a']], {'points': ['Must be an array of [lat, lng] pairs.']}),
+        ([[1, None]], {'points': ['Must be an array of [lat, lng] pairs.']}),
+        ([1, 2], {'points': ['Must be an array of [lat, lng] pairs.']}),
+        ('1,2', {'points': ['Must be an array of [lat, lng] pairs or an '
+                            'object with lats and lngs arrays.']}),
+        ({}, {'lats': ['Missing data for required field.'],
+              'lngs': ['Missing data for required field.']}),
+        ({'lats': [1], 'lngs': 'a'}, {'lngs': ['Must be an array of '
+                                               'numbers.']}),
+        ({'lats': [[1]], 'lngs': [1]}, {'lats': ['Must be an array of '
+                                                 'numbers.']}),
+        ({'lats': [1, 2], 'lngs': [1]}, {'lngs': ['Must have the same '
+                                                  'length as lats.']}),
+        ([[91, 0], [0, 181]], {'lats': ['Latitudes must be between -90 '
+                                        'and 90.'],
+                               'lngs': ['Longitudes must be between -180 '
+                                        'and 180.']}),
+        ([[float('nan'), 0]], {'lats': ['Latitudes must be between -90 '
+                                        'and 90.']}),
+    ])
+    def test_load_invalid(self, data, errors):
+        with pytest.raises(webob.exc.HTTPBadRequest) as exc:
+            handler.BatchLoader(10).load(data)
+        assert exc.value.detail == errors
+
+    def test_load_too_many_points(self):
+        with pytest.raises(webob.exc.HTTPRequestEntityTooLarge):
+            handler.BatchLoader(1).load([[1, 2], [3, 4]])
+
+
+class TestProfileLoader(object):
+    @pytest.mark.parametrize("path", ['1,2|1,3', 'enc:_ibE_seK?_ibE',
+                                      [[1, 2], [1, 3]]])
+    def test_load_path(self, path):
+        lats, lngs, distances = handler.ProfileLoader(10).load(
+            {'path': path, 'samples': '3'}
+        )
+        numpy.testing.assert_allclose(lats, [1, 1])
+        numpy.testing.assert_allclose(lngs, [2, 3])
+        numpy.testing.assert_allclose(distances, [0, 55589.07, 111178.14])
+
+    def test_load_default_samples(self):
+        loader = handler.ProfileLoader(1000)
+        _, _, distances = loader.load({'path': '1,2|1,3'})
+        assert len(distances) == loader.DEFAULT_SAMPLES
+
+    def test_load_spacing(self):
+        _, _, distances = handler.ProfileLoader(10).load(
+            {'path': '1,2|1,3', 'spacing': 50000}
+        )
+        numpy.testing.assert_allclose(distances, [0, 50000, 100000,
+                                                  111178.14])
+
+    @pytest.mark.parametrize("params,errors", [
+        ({}, {'path': ['Missing data for required field.']}),
+        ({'path': '1,2'}, {'path': ['Must contain at least 2 positions.']}),
+        ({'path': '1,2|3'}, {'path': ['Must be lat,lng positions separated '
+                                      'by |.']}),
+        ({'path': '1,a|1,2'}, {'path': ['Must be lat,lng positions '
+                                        'separated by |.']}),
+        ({'path': '91,2|1,2'}, {'path': ['Latitudes must be between -90 and '
+                                         '90.']}),
+        ({'path': 'enc:@@@'}, {'path': ['Not a valid encoded polyline.']}),
+        ({'path': [[1, 2], [1]]}, {'path': ['Must be an array of [lat, lng] '
+                                            'pairs.']}),
+        ({'path': 12}, {'path': ['Not a valid path.']}),
+        ({'path': '1,2|1,3', 'samples': 'a'}, {'samples': ['Not a valid '
+                                                           'number.']}),
+        ({'path': '1,2|1,3', 'samples': 1}, {'samples': ['Must be greater '
+                                                         'than or equal to '
+                                                         '2.']}),
+        ({'path': '1,2|1,3', 'spacing': '0'}, {'spacing': ['Must be greater '
+                                                           'than 0.']}),
+        ({'path': '1,2|1,3', 'spacing': 1, 'samples': 2},
+         {'spacing': ['Use either samples or spacing.']}),
+    ])
+    def test_load_invalid(self, params, errors):
+        with pytest.raises(webob.exc.HTTPBadRequest) as exc:
+            handler.ProfileLoader(10).load(params)
+        assert exc.value.detail == errors
+
+    def test_load_invalid_body(self):
+        with pytest.raises(webob.exc.HTTPBadRequest) as exc:
+            handler.ProfileLoader(10).load([])
+        assert exc.value.detail == {'body': ['Must be an object.']}
+
+    @pytest.mark.parametrize("params", [{'samples': 11}, {'spacing': 10000},
+                                        {'spacing': 1e-320},
+                                        {'spacing': '1e-300'}])
+    def test_load_too_many_samples(self, params):
+        params['path'] = '1,2|1,3'
+        with pytest.raises(webob.exc.HTTPRequestEntityTooLarge):
+            handler.ProfileLoader(10).load(params)
+
+
+class TestStreamLoader(object):
+    def blocks(self, body, fmt='ndjson', block_size=2):
+        loader = handler.StreamLoader(block_size)
+        return [(lats.tolist(), lngs.tolist()) for lats, lngs in
+                loader.blocks(io.BytesIO(body.encode('utf-8')), fmt)]
+
+    def test_blocks_ndjson(self):
+        body = '[1, 2]\n{"lng": 4, "lat": 3}\n\n  [5.5, -6]  \n'
+        assert self.blocks(body) == [([1, 3], [2, 4]), ([5.5], [-6])]
+        # block decoded at once
+        assert self.blocks('[1, 2]\n[3, 4]') == [([1, 3], [2, 4])]
+
+    def test_blocks_csv(self):
+        body = 'lat, lng\n1,2\r\n3, 4\n\n5.5,-6\n'
+        assert self.blocks(body, 'csv') == [([1, 3], [2, 4]), ([5.5], [-6])]
+        assert self.blocks('1,2\n', 'csv', 10) == [([1], [2])]
+
+    def test_blocks_empty(self):
+        assert self.blocks('') == []
+        assert self.blocks('\n\n', 'csv') == []
+
+    @pytest.mark.parametrize("body,fmt,line,message", [
+        ('[1, 2]\n[3, 4]\n[5]', 'ndjson', 3, 'Must be a [lat, lng] array'),
+        ('[1, 2]\n\n1, 2', 'ndjson', 3, 'Must be a [lat, lng] array'),
+        ('{"lat": 1}', 'ndjson', 1, 'Must be a [lat, lng] array'),
+        ('[1, "2"]', 'ndjson', 1, 'Must be a [lat, lng] array'),
+        ('[1, 2]\n[3, 4}', 'ndjson', 2, 'Must be a [lat, lng] array'),
+        ('1,2\n1;2', 'csv', 2, 'Must be a lat,lng position.'),
+        ('1,2\nlat,lng', 'csv', 2, 'Must be a lat,lng position.'),
+        ('1,2,3', 'csv', 1, 'Must be a lat,lng position.'),
+        ('[1, 2]\n[91, 2]', 'ndjson', 2, 'Latitude must be between'),
+        ('1,2\n1,nan', 'csv', 2, 'Longitude must be between'),
+        ('[1, 2]\n' + 'x' * 2000, 'ndjson', 2, 'Line too long.'),
+    ])
+    def test_blocks_invalid(self, body, fmt, line, message):
+        with pytest.raises(handler.StreamError) as e:
+            self.blocks(body, fmt)
+        assert e.value.line == line
+        assert e.value.message.startswith(message)
+
+    def test_blocks_invalid_utf8(self):
+        loader = handler.StreamLoader(2)
+        with pytest.raises(handler.StreamError) as e:
+            list(loader.blocks(io.BytesIO(b'[1, 2]\n\xff\n'), 'ndjson'))
+        assert e.value.line == 2
+
+
+@pytest.mark.parametrize("fmt,expected", [
+    ('ndjson', b'[1.5, 2.0, 57.0]\n[-3.25, 4.0, null]\n'),
+    ('csv', b'1.5,2.0,57.0\n-3.25,4.0,\n')
+])
+def test_format_stream_block(fmt, expected):
+    assert handler.format_stream_block(numpy.array([1.5, -3.25]),
+                                       numpy.array([2.0, 4.0]),
+                                       numpy.array([57.0, numpy.nan]),
+                                       fmt) == expected
 
 
 class TestWSGIHandler(object):
@@ -50,6 +281,448 @@ class TestWSGIHandler(object):
                        ('Content-Type', 'application/json')]
         assert mock_response.response_headers == res_headers
 
+    @pytest.mark.parametrize("query,position", [
+        ('lat=1.001&lng=10.001', (1.001, 10.001)),
+        ('lng=-10&lat=-90', (-90, -10)),
+        ('lat=1e-3&lng=180', (0.001, 180)),
+        ('lat=1.001', None),
+        ('lat=1.001&lng=10.001&interpolation=bilinear', None),
+        ('lat=1.001&lat=10.001', None),
+        ('lat=91&lng=10', None),
+        ('lat=nan&lng=10', None),
+        ('lat=&lng=10', None),
+        ('lat=a&lng=10', None),
+        ('lat=%2B1&lng=10', None),
+    ])
+    def test__read_fast_path(self, query, position):
+        env = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/altitude',
+               'QUERY_STRING': query}
+        assert handler.WSGIHandler._read_fast_path(env) == position
+
+    @pytest.mark.parametrize("method,path", [('POST', '/altitude'),
+                                             ('GET', '/profile')])
+    def test__read_fast_path_other_route(self, method, path):
+        env = {'REQUEST_METHOD': method, 'PATH_INFO': path,
+               'QUERY_STRING': 'lat=1&lng=1'}
+        assert handler.WSGIHandler._read_fast_path(env) is None
+
+    @pytest.mark.parametrize("query", ['lat=1.001&lng=10.001',
+                                       'lat=1.001', 'lat=91&lng=10',
+                                       'lat=a&lng=10'])
+    def test__call__fast_path_same_as_full_stack(self, mock_handler, query):
+        env = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/altitude',
+               'QUERY_STRING': query}
+        responses = []
+        for fast_path in (True, False):
+            response = MockResponse()
+            wsgi_app = handler.WSGIHandler(mock_handler, fast_path=fast_path)
+            responses.append((list(wsgi_app(dict(env), response)),
+                              response.status, response.response_headers))
+        assert responses[0] == responses[1]
+
+    def test__call__fast_path_exception(self, mock_response):
+        class FailingHandler(object):
+            def get_altitude(self, lat, lng):
+                raise Exception('error message')
+
+        env = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/altitude',
+               'QUERY_STRING': 'lat=1.001&lng=10.001'}
+        result = handler.WSGIHandler(FailingHandler())(env, mock_response)
+
+        assert json.loads(result[0].decode('utf-8')) == {
+            'message': 'An error occured. check the log file on the server.',
+            'code': 500, 'title': 'Internal Server Error'
+        }
+        assert mock_response.status == '500 Internal Server Error'
+
+    @pytest.mark.parametrize("fast_path", [True, False])
+    def test__call__cache_headers(self, mock_handler, mock_response,
+                                  fast_path):
+        env = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/altitude',
+               'QUERY_STRING': 'lat=1.001&lng=10.001'}
+        wsgi_app = handler.WSGIHandler(mock_handler, fast_path=fast_path,
+                                       dataset_version='srtm1-v3',
+                                       cache_max_age=3600)
+
+        result = wsgi_app(env, mock_response)
+
+        assert result == ['{"alt": 57}'.encode('utf-8')]
+        assert mock_response.status == '200 OK'
+        assert mock_response.response_headers == [
+            ('Content-Length', '11'), ('Content-Type', 'application/json'),
+            ('ETag', wsgi_app._cache_headers(1.001, 10.001)[0][1]),
+            ('Cache-Control', 'public, max-age=3600')
+        ]
+
+    @pytest.mark.parametrize("fast_path", [True, False])
+    @pytest.mark.parametrize("if_none_match", [
+        '{etag}', 'W/{etag}', '"other", {etag}', '*'
+    ])
+    def test__call__not_modified(self, mock_response, fast_path,
+                                 if_none_match):
+        class FailingHandler(object):
+            def get_altitude(self, lat, lng):
+                raise AssertionError('the handler must not be called')
+
+        wsgi_app = handler.WSGIHandler(FailingHandler(), fast_path=fast_path,
+                                       dataset_version='srtm1-v3')
+        etag = wsgi_app._cache_headers(1.001, 10.001)[0][1]
+        env = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/altitude',
+               'QUERY_STRING': 'lat=1.001&lng=10.001',
+               'HTTP_IF_NONE_MATCH': if_none_match.format(etag=etag)}
+
+        result = wsgi_app(env, mock_response)
+
+        assert b''.join(result) == b''
+        assert mock_response.status == '304 Not Modified'
+        assert mock_response.response_headers == [
+            ('ETag', etag), ('Cache-Control', 'public, max-age=86400')
+        ]
+
+    def test__call__modified(self, mock_handler, mock_response):
+        env = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/altitude',
+               'QUERY_STRING': 'lat=1.001&lng=10.001',
+               'HTTP_IF_NONE_MATCH': '"other"'}
+        wsgi_app = handler.WSGIHandler(mock_handler, dataset_version='v1')
+
+        wsgi_app(env, mock_response)
+
+        assert mock_response.status == '200 OK'
+        assert mock_handler.lat == 1.001
+
+    @pytest.mark.parametrize("env", [
+        {'REQUEST_METHOD': 'GET', 'QUERY_STRING': 'lat=a&lng=10.001'},
+        {'REQUEST_METHOD': 'POST', 'QUERY_STRING': 'lat=1.001&lng=10.001'}
+    ])
+    def test__call__no_cache_headers(self, mock_handler, mock_response, env):
+        env = dict(env, PATH_INFO='/altitude', HTTP_IF_NONE_MATCH='*')
+        wsgi_app = handler.WSGIHandler(mock_handler, dataset_version='v1')
+
+        wsgi_app(env, mock_response)
+
+        assert mock_response.status != '304 Not Modified'
+        assert 'ETag' not in dict(mock_response.response_headers)
+
+    def test__cache_headers(self, mock_handler):
+        wsgi_app = handler.WSGIHandler(mock_handler, dataset_version='v1')
+        etag = wsgi_app._cache_headers(1.0, 10.0)[0][1]
+        assert etag.startswith('"') and etag.endswith('"')
+        # positions resolving to the same sample share the ETag
+        assert wsgi_app._cache_headers(1.0001, 10.0001)[0][1] == etag
+        assert wsgi_app._cache_headers(1.0, 10.0, 'nearest')[0][1] == etag
+        assert wsgi_app._cache_headers(1.0003, 10.0)[0][1] != etag
+        # same quantization as the tiles near a half-sample boundary
+        assert wsgi_app._cache_headers(45.0, 6.5)[0][1] != \
+            wsgi_app._cache_headers(45.00013888888889, 6.5)[0][1]
+        # interpolated values change within a sample
+        bilinear = wsgi_app._cache_headers(1.0, 10.0, 'bilinear')[0][1]
+        assert bilinear != etag
+        assert wsgi_app._cache_headers(1.0001, 10.0, 'bilinear')[0][1] != \
+            bilinear
+        # a new dataset changes all the ETags
+        wsgi_app.dataset_version = 'v2'
+        assert wsgi_app._cache_headers(1.0, 10.0)[0][1] != etag
+
+        assert handler.WSGIHandler(mock_handler)._cache_headers(1, 10) is None
+
+    @pytest.mark.parametrize("body,content_type,expected", [
+        ('[1, 2]\n[-3, 4]\n[5, 6]\n', 'application/x-ndjson',
+         b'[1.0, 2.0, 1.0]\n[-3.0, 4.0, null]\n[5.0, 6.0, 5.0]\n'),
+        ('lat,lng\n1,2\n-3,4\n5,6\n', 'text/csv',
+         b'lat,lng,alt\n1.0,2.0,1.0\n-3.0,4.0,\n5.0,6.0,5.0\n'),
+        ('', 'application/x-ndjson', b''),
+    ])
+    def test__call__stream_altitude(self, mock_response, body, content_type,
+                                    expected):
+        wsgi_app = handler.WSGIHandler(LatHandler(), stream_block_size=2)
+
+        result = wsgi_app(stream_env(body, content_type), mock_response)
+
+        assert mock_response.status == '200 OK'
+        assert mock_response.response_headers == [('Content-Type',
+                                                   content_type)]
+        assert b''.join(result) == expected
+
+    def test__call__stream_altitude_interpolation(self, mock_response):
+        alt_handler = InterpolationHandler()
+        wsgi_app = handler.WSGIHandler(alt_handler)
+        env = stream_env('[1, 2]\n')
+        env['QUERY_STRING'] = 'interpolation=bicubic'
+
+        assert b''.join(wsgi_app(env, mock_response)) == \
+            b'[1.0, 2.0, 57.0]\n'
+        assert alt_handler.kwargs == {'interpolation': 'bicubic'}
+
+    @pytest.mark.parametrize("body,content_type,status,error", [
+        ('[1, 2]\n[3]\n', 'application/x-ndjson', '400 Bad Request',
+         {'body': ['Line 2: Must be a [lat, lng] array or a '
+                   '{"lat": .., "lng": ..} object.']}),
+        ('[[1, 2]]', 'application/json', '415 Unsupported Media Type',
+         {'message': 'The body must be NDJSON (application/x-ndjson) or '
+                     'CSV (text/csv).',
+          'code': 415, 'title': 'Unsupported Media Type'}),
+    ])
+    def test__call__stream_altitude_invalid(self, mock_handler,
+                                            mock_response, body,
+                                            content_type, status, error):
+        wsgi_app = handler.WSGIHandler(mock_handler, stream_block_size=2)
+
+        result = wsgi_app(stream_env(body, content_type), mock_response)
+
+        assert mock_response.status == status
+        assert json.loads(result[0].decode('utf-8')) == error
+
+    @pytest.mark.parametrize("body,content_type,expected", [
+        ('[1, 2]\n[3, 4]\n[5, 6]\n[91, 1]\n', 'application/x-ndjson',
+         b'[1.0, 2.0, 1.0]\n[3.0, 4.0, 3.0]\n'
+         b'{"error": "Line 4: Latitude must be between -90 and 90."}\n'),
+        ('1,2\n3,4\n5,6\n"7",8\n', 'text/csv',
+         b'lat,lng,alt\n1.0,2.0,1.0\n3.0,4.0,3.0\n'
+         b'error,"Line 4: Must be a lat,lng position."\n'),
+    ])
+    def test__call__stream_altitude_invalid_block(self, mock_response, body,
+                                                  content_type, expected):
+        wsgi_app = handler.WSGIHandler(LatHandler(), stream_block_size=2)
+
+        result = wsgi_app(stream_env(body, content_type), mock_response)
+
+        assert mock_response.status == '200 OK'
+        assert b''.join(result) == expected
+
+    def test__call__stream_altitude_exception(self, mock_response):
+        class FailingHandler(LatHandler):
+            def get_altitudes(self, lats, lngs):
+                if lats[0] > 2:
+                    raise Exception('error message')
+                return lats
+
+        wsgi_app = handler.WSGIHandler(FailingHandler(), stream_block_size=2)
+
+        result = wsgi_app(stream_env('[1, 2]\n[2, 2]\n[3, 2]\n'),
+                          mock_response)
+
+        assert b''.join(result).decode('utf-8').splitlines() == [
+            '[1.0, 2.0, 1.0]', '[2.0, 2.0, 2.0]',
+            '{"error": "An error occured. check the log file on the '
+            'server."}'
+        ]
+
+    def test__call__stream_altitude_chunked(self):
+        """ The values of a block are sent before the end of a chunked
+        body """
+        wsgi_app = handler.WSGIHandler(LatHandler(), stream_block_size=2)
+        server = gevent.pywsgi.WSGIServer(('127.0.0.1', 0), wsgi_app,
+                                          log=None)
+        server.start()
+        sock = gevent.socket.create_connection(server.address)
+        try:
+            sock.sendall(b'POST /altitude/stream HTTP/1.1\r\n'
+                         b'Host: localhost\r\n'
+                         b'Content-Type: text/csv\r\n'
+                         b'Transfer-Encoding: chunked\r\n\r\n'
+                         b'8\r\n1,2\n3,4\n\r\n')
+            response = b''
+            with gevent.Timeout(5):
+                while b'3.0,4.0,3.0' not in response:
+                    response += sock.recv(4096)
+            assert response.startswith(b'HTTP/1.1 200 OK')
+
+            sock.sendall(b'4\r\n5,6\n\r\n0\r\n\r\n')
+            with gevent.Timeout(5):
+                while not response.endswith(b'0\r\n\r\n'):
+                    response += sock.recv(4096)
+            assert b'5.0,6.0,5.0' in response
+        finally:
+            sock.close()
+            server.stop()
+
+    def test__call__post_altitude_batch(self, mock_handler, mock_response):
+        wsgi_app = handler.WSGIHandler(mock_handler)
+
+        result = wsgi_app(json_env('[[1.5, 10.5], [2.5, 20.5]]'),
+                          mock_response)
+
+        assert json.loads(result[0].decode('utf-8')) == {'alt': [57, 57]}
+        assert mock_handler.lat == 2.5
+        assert mock_handler.lng == 20.5
+        assert mock_response.status == '200 OK'
+
+    def test__call__post_altitude_batch_handler(self, mock_handler,
+                                                mock_response):
+        def get_altitudes(lats, lngs):
+            return numpy.array([lats[0], numpy.nan])
+
+        mock_handler.get_altitudes = get_altitudes
+        wsgi_app = handler.WSGIHandler(mock_handler)
+
+        result = wsgi_app(json_env('{"lats": [1.5, 2.5], "lngs": [1, 2]}'),
+                          mock_response)
+
+        assert json.loads(result[0].decode('utf-8')) == {'alt': [1.5, None]}
+        assert mock_handler.lat is None
+        assert mock_response.status == '200 OK'
+
+    def test__call__post_altitude_batch_invalid_json(self, mock_handler,
+                                                     mock_response):
+        wsgi_app = handler.WSGIHandler(mock_handler)
+
+        result = wsgi_app(json_env('[[1.5, 10.5'), mock_response)
+
+        assert result == ['{"body": ["Invalid JSON."]}'.encode('utf-8')]
+        assert mock_response.status == '400 Bad Request'
+
+    def test__call__post_altitude_batch_too_large(self, mock_handler,
+                                                  mock_response):
+        wsgi_app = handler.WSGIHandler(mock_handler, batch_max_points=1)
+
+        result = wsgi_app(json_env('[[1.5, 10.5], [2.5, 20.5]]'),
+                          mock_response)
+
+        body = json.loads(result[0].decode('utf-8'))
+        assert body['code'] == 413
+        assert body['message'] == 'A request is limited to 1 positions.'
+        assert mock_handler.lat is None
+        assert mock_response.status == '413 Request Entity Too Large'
+
+    def test__call__post_altitude_body_too_large(self, mock_handler,
+                                                 mock_response):
+        class UnreadInput(object):
+            def read(self, *args):
+                raise AssertionError('the body is read')
+
+        wsgi_app = handler.WSGIHandler(mock_handler, batch_max_points=1)
+        assert wsgi_app.max_body_size == 128 + 65536
+
+        for path in ('/altitude', '/profile'):
+            env = json_env('', path=path)
+            env.update({'CONTENT_LENGTH': str(wsgi_app.max_body_size + 1),
+                        'wsgi.input': UnreadInput()})
+            result = wsgi_app(env, mock_response)
+
+            body = json.loads(result[0].decode('utf-8'))
+            assert body['message'] == \
+                'A request body is limited to 65664 bytes.'
+            assert mock_response.status == '413 Request Entity Too Large'
+
+    def test__call__post_altitude_chunked_too_large(self, mock_handler,
+                                                    mock_response):
+        wsgi_app = handler.WSGIHandler(mock_handler, batch_max_points=1)
+        body = '[' + ' ' * wsgi_app.max_body_size + '[1.5, 10.5]]'
+        env = json_env(body)
+        del env['CONTENT_LENGTH']
+        env['wsgi.input_terminated'] = True
+
+        result = wsgi_app(env, mock_response)
+
+        assert json.loads(result[0].decode('utf-8'))['code'] == 413
+        # only the allowed size and a byte are read
+        assert env['wsgi.input'].tell() == wsgi_app.max_body_size + 1
+        assert mock_handler.lat is None
+
+        env = json_env('[[1.5, 10.5]]')
+        del env['CONTENT_LENGTH']
+        env['wsgi.input_terminated'] = True
+        result = wsgi_app(env, mock_response)
+        assert json.loads(result[0].decode('utf-8')) == {'alt': [57]}
+
+    def test__call__post_altitude_form(self, mock_handler, mock_response):
+        wsgi_app = handler.WSGIHandler(mock_handler)
+
+        env = json_env('lat=1.5&lng=10.5',
+                       content_type='application/x-www-form-urlencoded')
+        result = wsgi_app(env, mock_response)
+
+        assert result == ['{"alt": 57}'.encode('utf-8')]
+        assert mock_handler.lat == 1.5
+        assert mock_handler.lng == 10.5
+
+    def test__call__get_profile(self, mock_response):
+        class ProfileHandler(object):
+            def get_altitudes(self, lats, lngs):
+                return numpy.array([10, numpy.nan, 30, 20, 25])
+
+        env = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/profile',
+               'QUERY_STRING': 'path=0,0|0,1&samples=5'}
+        wsgi_app = handler.WSGIHandler(ProfileHandler())
+
+        result = wsgi_app(env, mock_response)
+
+        body = json.loads(result[0].decode('utf-8'))
+        assert mock_response.status == '200 OK'
+        numpy.testing.assert_allclose(body['lat'], [0] * 5, atol=1e-9)
+        numpy.testing.assert_allclose(body['lng'], [0, 0.25, 0.5, 0.75, 1])
+        numpy.testing.assert_allclose(body['distance'],
+                                      [0, 27798.77, 55597.54, 83396.31,
+                                       111195.08])
+        assert body['alt'] == [10, None, 30, 20, 25]
+        assert body['ascent'] == 25
+        assert body['descent'] == 10
+
+    def test__call__post_profile(self, mock_handler, mock_response):
+        wsgi_app = handler.WSGIHandler(mock_handler)
+        env = json_env('{"path": [[0, 0], [0, 1]], "samples": 2}')
+        env['PATH_INFO'] = '/profile'
+
+        result = wsgi_app(env, mock_response)
+
+        body = json.loads(result[0].decode('utf-8'))
+        assert mock_response.status == '200 OK'
+        assert body['alt'] == [57, 57]
+        assert body['ascent'] == 0
+        assert body['descent'] == 0
+
+    def test__call__post_profile_invalid_json(self, mock_handler,
+                                              mock_response):
+        wsgi_app = handler.WSGIHandler(mock_handler)
+        env = json_env('{"path"')
+        env['PATH_INFO'] = '/profile'
+
+        result = wsgi_app(env, mock_response)
+
+        assert result == ['{"body": ["Invalid JSON."]}'.encode('utf-8')]
+        assert mock_response.status == '400 Bad Request'
+
+    @pytest.mark.parametrize("env,kwargs", [
+        ({'REQUEST_METHOD': 'GET', 'PATH_INFO': '/altitude',
+          'QUERY_STRING': 'lat=1&lng=1&interpolation=bicubic'},
+         {'interpolation': 'bicubic'}),
+        ({'REQUEST_METHOD': 'GET', 'PATH_INFO': '/altitude',
+          'QUERY_STRING': 'lat=1&lng=1'}, {}),
+        (dict(json_env('[[1, 1]]'), QUERY_STRING='interpolation=bilinear'),
+         {'interpolation': 'bilinear'}),
+        (json_env('{"lats": [1], "lngs": [1], "interpolation": "bilinear"}'),
+         {'interpolation': 'bilinear'}),
+        ({'REQUEST_METHOD': 'GET', 'PATH_INFO': '/profile',
+          'QUERY_STRING': 'path=1,1|1,2&interpolation=bicubic'},
+         {'interpolation': 'bicubic'}),
+    ])
+    def test__call__interpolation(self, mock_response, env, kwargs):
+        alt_handler = InterpolationHandler()
+        wsgi_app = handler.WSGIHandler(alt_handler)
+
+        wsgi_app(env, mock_response)
+
+        assert mock_response.status == '200 OK'
+        assert alt_handler.kwargs == kwargs
+
+    @pytest.mark.parametrize("env", [
+        {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/altitude',
+         'QUERY_STRING': 'lat=1&lng=1&interpolation=linear'},
+        dict(json_env('[[1, 1]]'), QUERY_STRING='interpolation=linear'),
+        {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/profile',
+         'QUERY_STRING': 'path=1,1|1,2&interpolation=linear'},
+    ])
+    def test__call__interpolation_invalid(self, mock_response, env):
+        alt_handler = InterpolationHandler()
+        wsgi_app = handler.WSGIHandler(alt_handler)
+
+        result = wsgi_app(env, mock_response)
+
+        assert mock_response.status == '400 Bad Request'
+        assert result == ['{"interpolation": ["Not a valid choice."]}'
+                          .encode('utf-8')]
+        assert alt_handler.kwargs is None
+
     def test__call__options_altitude(self, mock_handler, mock_response):
         env = {'REQUEST_METHOD': 'OPTIONS', 'PATH_INFO': '/altitude',
                'QUERY_STRING': 'lat=1.001&lng=10.001'}
@@ -181,7 +854,7 @@ class TestWSGIHandler(object):
 
         env = {'REQUEST_METHOD': method, 'PATH_INFO': '/altitude',
                'QUERY_STRING': 'lat=1.001&lng=10.001'}
-        wsgi_app = handler.WSGIHandler(mock_handler)
+        wsgi_app = handler.WSGIHandler(mock_handler, fast_path=False)
 
         result = wsgi_app(env, mock_response)
 
@@ -216,7 +889,7 @@ class TestWSGIHandler(object):
 
         env = {'REQUEST_METHOD': method, 'PATH_INFO': '/altitude',
                'QUERY_STRING': 'lat=1.001&lng=10.001'}
-        wsgi_app = handler.WSGIHandler(mock_handler)
+        wsgi_app = handler.WSGIHandler(mock_handler, fast_path=False)
 
         result = wsgi_app(env, mock_response)
 
@@ -247,13 +920,61 @@ class TestWSGIHandler(object):
                        ('Content-Type', 'application/json')]
         assert mock_response.response_headers == res_headers
 
+    def test__call__metrics(self, mock_response):
+        wsgi_app = handler.WSGIHandler(InterpolationHandler())
+        wsgi_app({'REQUEST_METHOD': 'GET', 'PATH_INFO': '/altitude',
+                  'QUERY_STRING': 'lat=1&lng=2'}, mock_response)
+        wsgi_app({'REQUEST_METHOD': 'GET', 'PATH_INFO': '/altitude',
+                  'QUERY_STRING': 'lat=a&lng=2'}, mock_response)
+        wsgi_app({'REQUEST_METHOD': 'GET', 'PATH_INFO': '/elevation',
+                  'QUERY_STRING': ''}, mock_response)
+        wsgi_app(json_env('[[1, 2]]'), mock_response)
+        b''.join(wsgi_app(stream_env('[1, 2]\n[3, 4]'), mock_response))
+
+        result = wsgi_app({'REQUEST_METHOD': 'GET', 'PATH_INFO': '/metrics',
+                           'QUERY_STRING': ''}, mock_response)
+
+        assert mock_response.status == '200 OK'
+        assert ('Content-Type', 'text/plain; version=0.0.4; charset=utf-8') \
+            in mock_response.response_headers
+        lines = b''.join(result).decode('utf-8').splitlines()
+        for line in [
+            'gmalt_requests_total{route="/altitude",code="200"} 2',
+            'gmalt_requests_total{route="/altitude",code="400"} 1',
+            'gmalt_requests_total{route="/altitude/stream",code="200"} 1',
+            'gmalt_requests_total{route="other",code="404"} 1',
+            'gmalt_requests_in_flight 1',
+            'gmalt_request_duration_seconds_count{route="/altitude"} 3',
+            # 3 lookups and 1 streamed block, 2 failed requests
+            'gmalt_stage_duration_seconds_count{stage="parse"} 6',
+            'gmalt_stage_duration_seconds_count{stage="lookup"} 3',
+            'gmalt_stage_duration_seconds_count{stage="serialize"} 3'
+        ]:
+            assert line in lines
+        assert wsgi_app.metrics.in_flight == 0
+        assert wsgi_app.metrics.requests[('/metrics', 200)] == 1
+
+    def test__call__metrics_handler(self, filled_file_folder, mock_response):
+        wsgi_app = handler.build_wsgi_handler(
+            'file', {'folder': str(filled_file_folder)},
+            response_cache_size=10
+        )
+        result = wsgi_app({'REQUEST_METHOD': 'GET', 'PATH_INFO': '/metrics',
+                           'QUERY_STRING': ''}, mock_response)
+        body = b''.join(result).decode('utf-8')
+        assert 'gmalt_tile_cache_tiles 0' in body
+        assert 'gmalt_response_cache_entries 0' in body
+
 
 class TestHandlerLoader(object):
     def test__init__load_available_handlers(self):
         loader = handler.handler_loader
-        assert len(loader.HANDLERS) == 2
+        assert len(loader.HANDLERS) == 5
         assert 'celery' in loader.HANDLERS
         assert 'file' in loader.HANDLERS
+        assert 'packed' in loader.HANDLERS
+        assert 'postgres' in loader.HANDLERS
+        assert 'postgis' in loader.HANDLERS
 
     def test_load_unknown_handler(self):
         with pytest.raises(ValueError) as exc:
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2017 Jonathan Bouzekri
+#
+# This file is part of the gmalt application
+#
+# MIT License :
+# https://raw.githubusercontent.com/gmalt/api/master/LICENSE.txt
+
+""" Unit test of :mod:`gmaltapi.handlers.celery` """
+
+import numpy
+import pytest
+from celery.contrib.testing.worker import start_worker
+
+from .. import write_hgt
+from gmaltapi.handlers.celery import Handler
+
+
+@pytest.fixture()
+def celery_handler(empty_file_folder):
+    write_hgt(empty_file_folder, 'N10E048.hgt', 11)
+    write_hgt(empty_file_folder, 'N10E049.hgt', 11, lambda line, col: col)
+    celery_handler = Handler('memory://', 'cache+memory://', chunk_size=3,
+                             folder=str(empty_file_folder),
+                             cache_max_tiles=4)
+    celery_handler.celery.conf.broker_transport_options = {
+        'polling_interval': 0.01
+    }
+    return celery_handler
+
+
+class TestHandler(object):
+    def test__init__(self, celery_handler, empty_file_folder):
+        assert celery_handler.chunk_size == 3
+        assert celery_handler.celery.worker_conf == {
+            'folder': str(empty_file_folder), 'cache_max_tiles': 4
+        }
+
+    def test_chunks(self, celery_handler):
+        lats = numpy.array([10.5, 10.5, 10.5, 10.5, 10.5, numpy.nan, 10.5])
+        lngs = numpy.array([48.5, 49.5, 48.5, 48.5, 48.5, 48.5, 49.5])
+        chunks = [idx.tolist() for idx in celery_handler._chunks(lats, lngs)]
+        # the 4 positions of the first cell are split, the others are kept
+        # together
+        assert chunks == [[0, 2, 3], [4, 1, 6]]
+
+    def test_get_altitudes(self, celery_handler):
+        with start_worker(celery_handler.celery, pool='solo',
+                          perform_ping_check=False):
+            alts = celery_handler.get_altitudes(
+                [10.5, 10.5, 0, 10.6, 10.5], [48.5, 49.5, 0, 48.5, 48.6]
+            )
+            assert celery_handler.get_altitude(10.5, 48.5) == 60
+            assert celery_handler.get_altitude(0, 0) is None
+            worker_handler = celery_handler.celery.alt_handler
+        numpy.testing.assert_array_equal(alts, [60, 5, numpy.nan, 49, 61])
+        # the worker keeps its HGT files mapped between the tasks
+        assert worker_handler.stats()['hits'] >= 1
+
+    def test_get_altitudes_empty(self, celery_handler):
+        alts = celery_handler.get_altitudes([], [])
+        assert alts.shape == (0,)
@@ -10,11 +10,17 @@
 """ Unit test of :mod:`gmaltapi.handlers.file` """
 
 import os
+import time
 
-import gmalthgtparser
+import gevent
+import numpy
 import pytest
 
+from .. import write_hgt
+from .test_tiles import compress_hgt
+import gmaltapi.handlers.file
 from gmaltapi.handlers.file import Handler
+from gmaltapi.metrics import handler_metrics
 
 
 class TestHandler(object):
@@ -54,65 +60,438 @@ class TestHandler(object):
         except Exception:
             pytest.fail("_validate_folder should not have raised exception")
 
-    def test_get_altitude_hgt_file_exist(self, filled_file_folder,
-                                         monkeypatch):
-        hgt_parser_storage = []
+    def test_get_altitude_hgt_file_exist(self, filled_file_folder):
+        write_hgt(filled_file_folder, 'N10E048.hgt', 11)
 
-        def mockreturn(path):
-            # store in outer scope a reference to the mocked parser
-            hgt_parser_storage.append(MockHgtParser(path))
-            return hgt_parser_storage[0]
+        file_handler = Handler(str(filled_file_folder))
+        # bottom left corner
+        assert file_handler.get_altitude(10.0, 48.0) == 110
+        # top left corner
+        assert file_handler.get_altitude(10.99, 48.0) == 0
+        # nearest sample of (line 4, col 3)
+        assert file_handler.get_altitude(10.62, 48.31) == 47
 
-        monkeypatch.setattr(gmalthgtparser, 'HgtParser', mockreturn)
-        monkeypatch.setattr(os.path, 'isfile', lambda path: True)  # found
+    def test_get_altitude_void_value(self, filled_file_folder):
+        write_hgt(filled_file_folder, 'N10E048.hgt', 11,
+                  lambda line, col: -32768)
 
         file_handler = Handler(str(filled_file_folder))
-        alt = file_handler.get_altitude(10.0, 48.1)
-
-        hgt_parser = hgt_parser_storage[0]
-        assert hgt_parser.file == filled_file_folder.join('N10E048.hgt')
-        assert hgt_parser.pos == (10.0, 48.1)
-        assert hgt_parser.enter_called is True
-        assert hgt_parser.exit_called is True
-        assert alt == 57
+        assert file_handler.get_altitude(10.5, 48.5) is None
 
     def test_get_altitude_hgt_file_not_found(self, filled_file_folder,
                                              monkeypatch):
-        def mockreturn():
+        def mockreturn(*args):
             mockreturn.has_been_called = True
-            pass
 
         mockreturn.has_been_called = False
 
-        monkeypatch.setattr(gmalthgtparser, 'HgtParser', mockreturn)
-        monkeypatch.setattr(os.path, 'isfile', lambda path: False)  # not found
+        monkeypatch.setattr(gmaltapi.handlers.file, 'Tile', mockreturn)
 
         file_handler = Handler(str(filled_file_folder))
+
+        # answered from the index without touching the filesystem
+        monkeypatch.setattr(os.path, 'isfile', mockreturn)
         alt = file_handler.get_altitude(10.0, 48.1)
 
         assert mockreturn.has_been_called is False
         assert alt is None
 
+    def test__init__index_folder(self, filled_file_folder):
+        write_hgt(filled_file_folder, 'N10E048.hgt', 11)
+        write_hgt(filled_file_folder, 'S01W002.hgt', 11)
+
+        file_handler = Handler(str(filled_file_folder))
+        assert len(file_handler.index) == 2
+        assert (10, 48) in file_handler.index
+        assert (-1, -2) in file_handler.index
+        assert file_handler.index.ignored == \
+            [str(filled_file_folder.join('file.hgt'))]
+
+    def test_get_altitude_keeps_tile_mapped(self, filled_file_folder):
+        write_hgt(filled_file_folder, 'N10E048.hgt', 11)
+
+        file_handler = Handler(str(filled_file_folder))
+        assert file_handler.get_altitude(10.5, 48.5) == 60
+        assert file_handler.get_altitude(10.5, 48.5) == 60
+        assert file_handler.stats() == {'hits': 1, 'misses': 1,
+                                        'evictions': 0, 'rejections': 0,
+                                        'tiles': 1, 'bytes': 242}
+
+    def test_is_warm(self, filled_file_folder):
+        write_hgt(filled_file_folder, 'N10E048.hgt', 11)
+        write_hgt(filled_file_folder, 'N10E049.hgt', 11)
+
+        file_handler = Handler(str(filled_file_folder))
+        # no file for this cell, nothing to read
+        assert file_handler.is_warm([20.5], [20.5])
+        assert not file_handler.is_warm([10.5, 20.5], [48.5, 20.5])
+        file_handler.get_altitude(10.5, 48.5)
+        assert file_handler.is_warm([10.5, 20.5, numpy.nan],
+                                    [48.5, 20.5, 49.5])
+        assert not file_handler.is_warm([10.5, 10.5], [48.5, 49.5])
+
+    def test_get_altitude_evicts_tiles(self, filled_file_folder):
+        write_hgt(filled_file_folder, 'N10E048.hgt', 11)
+        write_hgt(filled_file_folder, 'N10E049.hgt', 11)
+
+        file_handler = Handler(str(filled_file_folder), cache_max_tiles=1)
+        assert file_handler.get_altitude(10.5, 48.5) == 60
+        assert file_handler.get_altitude(10.5, 49.5) == 60
+        assert file_handler.stats()['evictions'] == 1
+        assert file_handler.stats()['tiles'] == 1
+
+    def test_get_altitudes(self, filled_file_folder):
+        write_hgt(filled_file_folder, 'N10E048.hgt', 11)
+        write_hgt(filled_file_folder, 'S01W002.hgt', 11,
+                  lambda line, col: -32768 if line == 0 else 1000 + col)
+
+        file_handler = Handler(str(filled_file_folder))
+        alts = file_handler.get_altitudes(
+            [10.62, -0.5, 50.0, 10.0, -0.01, numpy.nan],
+            [48.31, -1.3, 50.0, 48.0, -1.5, 48.0]
+        )
+
+        numpy.testing.assert_array_equal(
+            alts, [47, 1007, numpy.nan, 110, numpy.nan, numpy.nan]
+        )
+        assert file_handler.stats()['misses'] == 2
+
+    def test_get_altitudes_same_as_get_altitude(self, filled_file_folder):
+        write_hgt(filled_file_folder, 'N10E048.hgt', 11)
+        lats = numpy.random.RandomState(0).uniform(10, 11, 100)
+        lngs = numpy.random.RandomState(1).uniform(48, 49, 100)
+
+        file_handler = Handler(str(filled_file_folder))
+        alts = file_handler.get_altitudes(lats, lngs)
+
+        assert alts.tolist() == [file_handler.get_altitude(lat, lng)
+                                 for lat, lng in zip(lats, lngs)]
+
+    @pytest.mark.parametrize("order", [[0, 1, 2], [2, 1, 0]])
+    def test_get_altitudes_antimeridian(self, filled_file_folder, order):
+        write_hgt(filled_file_folder, 'N11W180.hgt', 11)
+        write_hgt(filled_file_folder, 'N10E179.hgt', 11)
+        lats = numpy.array([11.5, 10.5, 10.0])[order]
+        lngs = numpy.array([-179.5, 180.0, 180.0])[order]
+
+        file_handler = Handler(str(filled_file_folder))
+        alts = file_handler.get_altitudes(lats, lngs)
+
+        numpy.testing.assert_array_equal(alts,
+                                         numpy.array([60, 65, 120])[order])
+        assert alts.tolist() == [file_handler.get_altitude(lat, lng)
+                                 for lat, lng in zip(lats, lngs)]
+
+    def test_get_altitudes_empty(self, filled_file_folder):
+        file_handler = Handler(str(filled_file_folder))
+        alts = file_handler.get_altitudes([], [])
+        assert alts.shape == (0,)
+
+    @pytest.mark.parametrize("interpolation", ['bilinear', 'bicubic'])
+    def test_get_altitude_interpolation(self, filled_file_folder,
+                                        interpolation):
+        write_hgt(filled_file_folder, 'N10E048.hgt', 11)
+
+        file_handler = Handler(str(filled_file_folder),
+                               interpolation=interpolation)
+        # values are line * 11 + col so it varies linearly
+        assert file_handler.get_altitude(10.53, 48.32) == \
+            pytest.approx(4.7 * 11 + 3.2)
+        assert file_handler.get_altitude(10.53, 48.32, 'nearest') == 58
+        assert file_handler.get_altitude(50.0, 50.0) is None
+
+    def test_get_altitudes_interpolation_across_tiles(self,
+                                                      filled_file_folder):
+        write_hgt(filled_file_folder, 'N10E048.hgt', 11,
+                  lambda line, col: 10 * col)
+        write_hgt(filled_file_folder, 'N10E049.hgt', 11,
+                  lambda line, col: 100 + 10 * col)
+
+        file_handler = Handler(str(filled_file_folder))
+        alts = file_handler.get_altitudes([10.5, 10.5], [48.95, 49.05],
+                                          interpolation='bicubic')
+        numpy.testing.assert_allclose(alts, [95, 105])
+
+    def test_get_altitudes_interpolation_evicted(self, filled_file_folder):
+        for lat in (9, 10):
+            write_hgt(filled_file_folder, 'N{:02d}E048.hgt'.format(lat), 11,
+                      lambda line, col, lat=lat:
+                      3 * (lat * 10 + 10 - line) + 2 * col)
+
+        # loading the neighbour evicts the tile of the positions
+        file_handler = Handler(str(filled_file_folder), cache_max_tiles=1)
+        alts = file_handler.get_altitudes([10.05, 10.0], [48.5, 48.5],
+                                          interpolation='bicubic')
+        numpy.testing.assert_allclose(alts, [311.5, 310])
+        assert file_handler.stats()['evictions'] == 1
+
+    def test_preload_tiles(self, filled_file_folder):
+        for name in ('N10E048.hgt', 'N10E049.hgt', 'N11E048.hgt'):
+            write_hgt(filled_file_folder, name, 11)
+
+        file_handler = Handler(str(filled_file_folder), cache_max_tiles=1,
+                               preload_tiles='N10E049, n10e048.hgt,N50E001')
+        assert file_handler.preload_cells == [(10, 49), (10, 48)]
+        progress = []
+        assert file_handler.preload(lambda *args: progress.append(args)) \
+            == (2, 484)
+        assert progress == [(1, 2), (2, 2)]
+        # the pinned tiles are not evicted by the other tiles
+        assert file_handler.get_altitude(11.5, 48.5) == 60
+        assert file_handler.is_warm([10.5, 10.5], [48.5, 49.5])
+        assert file_handler.stats()['evictions'] == 0
+
+    def test_preload_not_pinned(self, filled_file_folder):
+        write_hgt(filled_file_folder, 'N10E048.hgt', 11)
+        write_hgt(filled_file_folder, 'N10E049.hgt', 11)
+
+        file_handler = Handler(str(filled_file_folder), cache_max_tiles=1,
+                               preload_tiles='N10E048,N10E049',
+                               preload_pin=False)
+        assert file_handler.preload() == (2, 484)
+        assert file_handler.stats()['evictions'] == 1
+
+    @pytest.mark.parametrize("bbox,cells", [
+        ('10.5, 48.5, 11.5, 49.5', [(10, 48), (10, 49), (11, 48)]),
+        ('10.2,48.2,10.2,48.2', [(10, 48)]),
+        ('-5, 0, 0, 48', [])
+    ])
+    def test_preload_bbox(self, filled_file_folder, bbox, cells):
+        for name in ('N10E048.hgt', 'N10E049.hgt', 'N11E048.hgt'):
+            write_hgt(filled_file_folder, name, 11)
+
+        file_handler = Handler(str(filled_file_folder), preload_bbox=bbox)
+        assert file_handler.preload_cells == cells
+
+    def test_preload_max_bytes(self, filled_file_folder):
+        for name in ('N11E048.hgt', 'N10E049.hgt', 'N10E048.hgt'):
+            write_hgt(filled_file_folder, name, 11)
+
+        file_handler = Handler(str(filled_file_folder),
+                               preload_max_bytes=500)
+        assert file_handler.preload_cells == [(10, 48), (10, 49)]
+        file_handler = Handler(str(filled_file_folder),
+                               preload_tiles='N11E048',
+                               preload_bbox='10, 48, 11, 50',
+                               preload_max_bytes=500)
+        assert file_handler.preload_cells == [(11, 48), (10, 48)]
+        assert Handler(str(filled_file_folder)).preload() == (0, 0)
+
+    @pytest.mark.parametrize("kwargs,message", [
+        ({'preload_tiles': 'N10E048,X10'}, 'invalid HGT file name X10'),
+        ({'preload_bbox': '10, 48'}, 'expected "south, west, north, east"')
+    ])
+    def test_preload_invalid(self, filled_file_folder, kwargs, message):
+        with pytest.raises(ValueError) as e:
+            Handler(str(filled_file_folder), **kwargs)
+        assert message in str(e.value)
+
+    def test_preload_workers(self, empty_file_folder):
+        write_hgt(empty_file_folder, 'N10E048.hgt', 11)
+        compress_hgt(empty_file_folder, 'N10E049.hgt', 11, 'zip')
+
+        file_handler = Handler(str(empty_file_folder), preload_workers=2,
+                               preload_bbox='10, 48, 11, 50')
+        assert file_handler.preload() == (2, 484)
+        assert file_handler.is_warm([10.5, 10.5], [48.5, 49.5])
+        assert file_handler.get_altitude(10.5, 49.5) == 60
+
+    def test_hot_tiles(self, filled_file_folder, tmpdir):
+        for name in ('N10E048.hgt', 'N10E049.hgt', 'N11E048.hgt'):
+            write_hgt(filled_file_folder, name, 11)
+        hot_file = str(tmpdir.join('hot.json'))
+
+        file_handler = Handler(str(filled_file_folder), cache_max_tiles=2,
+                               hot_tiles_file=hot_file)
+        for lat, lng in [(10.5, 49.5)] * 3 + [(11.5, 48.5)] * 2 + \
+                [(10.5, 48.5)]:
+            file_handler.get_altitude(lat, lng)
+        file_handler.frequency.save()
+
+        restarted = Handler(str(filled_file_folder), cache_max_tiles=2,
+                            hot_tiles_file=hot_file,
+                            preload_tiles='N10E048')
+        assert restarted.hot_cells == [(10, 49), (11, 48)]
+        assert restarted.preload() == (3, 726)
+        assert restarted.is_warm([10.5, 11.5, 10.5], [49.5, 48.5, 48.5])
+        # the restored counters protect the hot tiles from a rare tile
+        assert restarted.frequency.get((10, 49)) == 4
+        assert restarted.get_altitude(10.5, 49.5) == 60
+        assert restarted.get_altitude(11.5, 49.5) is None
+        write_hgt(filled_file_folder, 'N11E049.hgt', 11)
+        restarted.index = Handler._validate_folder(str(filled_file_folder))
+        assert restarted.get_altitude(11.5, 49.5) == 60
+        assert restarted.stats()['rejections'] == 1
+        assert restarted.is_warm([10.5, 11.5], [49.5, 48.5])
+
+    def test_cache_admission(self, filled_file_folder):
+        for name in ('N10E048.hgt', 'N10E049.hgt', 'N11E048.hgt'):
+            write_hgt(filled_file_folder, name, 11)
+
+        file_handler = Handler(str(filled_file_folder), cache_max_tiles=1)
+        file_handler.get_altitude(10.5, 48.5)
+        file_handler.get_altitude(10.5, 48.5)
+        assert file_handler.get_altitude(10.5, 49.5) == 60
+        assert file_handler.is_warm([10.5], [48.5])
+        assert file_handler.stats()['rejections'] == 1
+
+        file_handler = Handler(str(filled_file_folder), cache_max_tiles=1,
+                               cache_admission='lru')
+        file_handler.get_altitude(10.5, 48.5)
+        file_handler.get_altitude(10.5, 48.5)
+        file_handler.get_altitude(10.5, 49.5)
+        assert file_handler.is_warm([10.5], [49.5])
+
+    def test_cache_admission_new_hot_tile(self, filled_file_folder,
+                                          monkeypatch):
+        for name in ('N10E048.hgt', 'N11E048.hgt'):
+            write_hgt(filled_file_folder, name, 11)
+        file_handler = Handler(str(filled_file_folder), cache_max_tiles=1)
+        loads = []
+        load_tile = file_handler._load_tile
+        monkeypatch.setattr(file_handler, '_load_tile',
+                            lambda info: loads.append(info) or load_tile(info))
+
+        for _ in range(5000):
+            file_handler.get_altitude(10.5, 48.5)
+        # a tile becoming hot is loaded once and soon replaces the old one
+        for _ in range(100):
+            file_handler.get_altitude(11.5, 48.5)
+        assert len(loads) == 2
+        assert list(file_handler.cache._tiles) == [(11, 48)]
+        assert file_handler.stats()['rejections'] == 1
+
+    def test_read_threads(self, filled_file_folder, monkeypatch):
+        write_hgt(filled_file_folder, 'N10E048.hgt', 11)
+        file_handler = Handler(str(filled_file_folder), read_threads=2)
+        load_tile = file_handler._load_tile
+
+        def slow_load_tile(info):
+            time.sleep(0.05)  # a slow disk, not a greenlet switch
+            return load_tile(info)
+        monkeypatch.setattr(file_handler, '_load_tile', slow_load_tile)
+
+        ticks = []
+        ticker = gevent.spawn(lambda: [ticks.append(gevent.sleep(0.005))
+                                       for _ in range(5)])
+        lookups = [gevent.spawn(file_handler.get_altitude, 10.5, 48.5)
+                   for _ in range(3)]
+        gevent.joinall(lookups + [ticker], raise_error=True)
+        assert [lookup.value for lookup in lookups] == [60, 60, 60]
+        # the other greenlets ran during the read
+        assert len(ticks) == 5
+        # a single read for the greenlets waiting for the same file
+        stats = file_handler.load_stats()
+        assert stats['thread'].count == 1
+        assert stats['blocking'].count == 0
+        assert stats['threads'] == 2
+        # the warm lookups do not use the threads
+        assert file_handler.get_altitude(10.5, 48.5) == 60
+        assert stats['thread'].count == 1
+
+    def test_read_threads_error(self, filled_file_folder, monkeypatch):
+        write_hgt(filled_file_folder, 'N10E048.hgt', 11)
+        file_handler = Handler(str(filled_file_folder), read_threads=1)
+
+        def broken_load_tile(info):
+            time.sleep(0.01)
+            raise IOError('disk error')
+        monkeypatch.setattr(file_handler, '_load_tile', broken_load_tile)
+
+        lookups = [gevent.spawn(file_handler.get_altitude, 10.5, 48.5)
+                   for _ in range(2)]
+        gevent.joinall(lookups)
+        assert [str(lookup.exception) for lookup in lookups] == \
+            ['disk error', 'disk error']
+        assert file_handler._loading == {}
+
+    @pytest.mark.parametrize("cache_admission", ['lru', 'frequency'])
+    def test_read_threads_evicted(self, filled_file_folder, monkeypatch,
+                                  cache_admission):
+        write_hgt(filled_file_folder, 'N10E048.hgt', 11)
+        write_hgt(filled_file_folder, 'N11E048.hgt', 11)
+        file_handler = Handler(str(filled_file_folder), read_threads=2,
+                               cache_max_tiles=1,
+                               cache_admission=cache_admission)
+        load_tile = file_handler._load_tile
+
+        def slow_load_tile(info):
+            time.sleep(0.02)
+            return load_tile(info)
+        monkeypatch.setattr(file_handler, '_load_tile', slow_load_tile)
+
+        # the tile got by the waiting lookup is evicted by the other load
+        # before the waiting lookup runs
+        lookups = [gevent.spawn(file_handler.get_altitude, lat, 48.5)
+                   for lat in (10.5, 11.5, 10.5)]
+        gevent.joinall(lookups, raise_error=True)
+        assert [lookup.value for lookup in lookups] == [60, 60, 60]
+
+    def test_read_threads_killed(self, filled_file_folder, monkeypatch):
+        write_hgt(filled_file_folder, 'N10E048.hgt', 11)
+        file_handler = Handler(str(filled_file_folder), read_threads=1)
+        load_tile = file_handler._load_tile
+
+        def slow_load_tile(info):
+            time.sleep(0.02)
+            return load_tile(info)
+        monkeypatch.setattr(file_handler, '_load_tile', slow_load_tile)
+
+        loading, waiting = [gevent.spawn(file_handler.get_altitude, 10.5,
+                                         48.5) for _ in range(2)]
+        gevent.sleep(0)
+        loading.kill()
+        waiting.join()
+        assert isinstance(waiting.exception, RuntimeError)
+        assert file_handler._loading == {}
+        assert file_handler.get_altitude(10.5, 48.5) == 60
+
+    def test_load_metrics(self, filled_file_folder):
+        write_hgt(filled_file_folder, 'N10E048.hgt', 11)
+        file_handler = Handler(str(filled_file_folder))
+        file_handler.get_altitude(10.5, 48.5)
+
+        values = dict((name, value) for name, _, _, value
+                      in handler_metrics(file_handler))
+        assert values['gmalt_tile_load_blocking_seconds'].count == 1
+        assert values['gmalt_tile_load_thread_seconds'].count == 0
+        assert 'gmalt_tile_read_threads' not in values
+
+    @pytest.mark.parametrize("compression", ['zip', 'gz'])
+    def test_get_altitude_compressed(self, empty_file_folder, compression):
+        compress_hgt(empty_file_folder, 'N10E048.hgt', 11, compression)
 
-class MockHgtParser(object):
-    def __init__(self, file_):
-        self.file = file_
-        self.pos = None
-        self.enter_called = False
-        self.exit_called = False
+        file_handler = Handler(str(empty_file_folder))
+        assert file_handler.get_altitude(10.5, 48.5) == 60
+        assert file_handler.get_altitudes([10.5], [48.6])[0] == 61
+        assert file_handler.stats()['misses'] == 1
 
-    def __enter__(self):
-        self.enter_called = True
-        return self
+    def test_get_altitude_decompress_folder(self, empty_file_folder, tmpdir):
+        compress_hgt(empty_file_folder, 'N10E048.hgt', 11, 'zip')
+        spill = tmpdir.mkdir('spill')
 
-    def get_elevation(self, pos):
-        self.pos = pos
-        return 1, 2, 57
+        file_handler = Handler(str(empty_file_folder),
+                               decompress_folder=str(spill))
+        assert file_handler.get_altitude(10.5, 48.5) == 60
+        assert spill.join('10_48.hgt').size() == 242
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        self.exit_called = True
+        # the lookups in the cached tile mark the file as used for the
+        # other processes
+        path = str(spill.join('10_48.hgt'))
+        os.utime(path, (1, 1))
+        file_handler.decompress_folder._touched.clear()
+        assert file_handler.get_altitude(10.5, 48.5) == 60
+        assert os.path.getmtime(path) > 1
 
-    def __repr__(self):
-        return 'MockHgtParser(file={file}, pos={pos}, ' \
-               'enter_called={enter_called}, ' \
-               'exit_called={exit_called})'.format(**self.__dict__)
+    def test_get_altitude_decompress_folder_removed(self, empty_file_folder,
+                                                    tmpdir, monkeypatch):
+        compress_hgt(empty_file_folder, 'N10E048.hgt', 11, 'zip')
+        spill = tmpdir.mkdir('spill')
+        file_handler = Handler(str(empty_file_folder),
+                               decompress_folder=str(spill))
+        get = file_handler.decompress_folder.get
+        paths = iter([str(spill.join('removed.hgt'))])
+        # the first file is removed by another process before being mapped
+        monkeypatch.setattr(file_handler.decompress_folder, 'get',
+                            lambda info: next(paths, None) or get(info))
+        assert file_handler.get_altitude(10.5, 48.5) == 60
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2017 Jonathan Bouzekri
+#
+# This file is part of the gmalt application
+#
+# MIT License :
+# https://raw.githubusercontent.com/gmalt/api/master/LICENSE.txt
+
+""" Unit test of :mod:`gmaltapi.handlers.packed` """
+
+import numpy
+import pytest
+
+from .. import write_hgt
+from gmaltapi.handlers.file import Handler as FileHandler
+from gmaltapi.handlers.packed import Handler
+from gmaltapi.pack import pack_folder
+
+
+@pytest.fixture()
+def archive(empty_file_folder, tmpdir):
+    write_hgt(empty_file_folder, 'N10E048.hgt', 11)
+    write_hgt(empty_file_folder, 'N10E049.hgt', 11,
+              lambda line, col: -32768 if line == 0 else 1000 + col)
+    path = str(tmpdir.join('tiles.gpak'))
+    pack_folder(str(empty_file_folder), path)
+    return path
+
+
+class TestHandler(object):
+    def test__init__unknown_archive(self, tmpdir):
+        with pytest.raises(Exception) as e:
+            Handler(str(tmpdir.join('missing.gpak')))
+        assert 'does not exists or is not a file' in str(e.value)
+
+    def test_get_altitude(self, archive):
+        packed_handler = Handler(archive)
+        assert packed_handler.get_altitude(10.5, 48.5) == 60
+        assert packed_handler.get_altitude(10.5, 49.5) == 1005
+        assert packed_handler.get_altitude(10.99, 49.5) is None
+        assert packed_handler.get_altitude(0.5, 0.5) is None
+
+    def test_is_warm(self, archive):
+        # the archive is mapped on startup
+        assert Handler(archive).is_warm([10.5, 0.5], [48.5, 0.5])
+
+    def test_get_altitudes_same_as_file(self, archive, empty_file_folder):
+        packed_handler = Handler(archive, interpolation='bilinear')
+        file_handler = FileHandler(str(empty_file_folder),
+                                   interpolation='bilinear')
+        lats = numpy.array([10.5, 10.53, 10.2, 10.99, 0.5])
+        lngs = numpy.array([48.5, 48.97, 49.31, 49.5, 0.5])
+        numpy.testing.assert_array_equal(
+            packed_handler.get_altitudes(lats, lngs),
+            file_handler.get_altitudes(lats, lngs)
+        )
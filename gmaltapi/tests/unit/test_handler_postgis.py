@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2017 Jonathan Bouzekri
+#
+# This file is part of the gmalt application
+#
+# MIT License :
+# https://raw.githubusercontent.com/gmalt/api/master/LICENSE.txt
+
+""" Unit test of :mod:`gmaltapi.handlers.postgis` """
+
+import numpy
+import pytest
+
+pytest.importorskip('psycopg2')
+
+from .test_db import mock_connect  # noqa
+from gmaltapi.handlers.postgis import Handler
+
+
+class TestHandler(object):
+    def test_get_altitudes(self, mock_connect):  # noqa
+        pg_handler = Handler('gmalt', table='srtm3')
+        conn = pg_handler.pool.get()
+        pg_handler.pool.put(conn)
+        conn.rows = [(57,), (None,)]
+        alts = pg_handler.get_altitudes([10.5, 10.6], [48.5, 0])
+        numpy.testing.assert_array_equal(alts, [57, numpy.nan])
+
+        prepare, params = conn.queries[0]
+        assert 'ST_Value(r.rast, 1, p.geom)::smallint' in prepare
+        assert 'FROM   "srtm3" r' in prepare
+        assert conn.queries[1] == ('EXECUTE gmalt_altitudes(%s, %s)',
+                                   ([10.5, 10.6], [48.5, 0]))
+
+    def test_get_altitude(self, mock_connect):  # noqa
+        pg_handler = Handler('gmalt')
+        conn = pg_handler.pool.get()
+        pg_handler.pool.put(conn)
+        conn.rows = [(None,)]
+        assert pg_handler.get_altitude(10.5, 48.5) is None
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2017 Jonathan Bouzekri
+#
+# This file is part of the gmalt application
+#
+# MIT License :
+# https://raw.githubusercontent.com/gmalt/api/master/LICENSE.txt
+
+""" Unit test of :mod:`gmaltapi.handlers.postgres` """
+
+import numpy
+import pytest
+
+pytest.importorskip('psycopg2')
+
+from .test_db import mock_connect  # noqa
+from gmaltapi.handlers.postgres import Handler
+
+
+class TestHandler(object):
+    def test__init__(self, mock_connect):  # noqa
+        pg_handler = Handler('gmalt', user='gmalt', password='secret',
+                             pool_size=4)
+        assert pg_handler.pool.size == 4
+        assert pg_handler.pool.db_info == {
+            'dbname': 'gmalt', 'user': 'gmalt', 'password': 'secret',
+            'host': 'localhost', 'port': 5432
+        }
+        assert mock_connect == []  # connections are opened on demand
+        assert Handler('gmalt').pool.size == Handler.DEFAULT_POOL_SIZE
+
+    def test_get_altitude(self, mock_connect):  # noqa
+        pg_handler = Handler('gmalt', table='my"table')
+        conn = pg_handler.pool.get()
+        pg_handler.pool.put(conn)
+        conn.rows = [(57,)]
+        assert pg_handler.get_altitude(10.5, 48.5) == 57
+        conn.rows = [(None,)]
+        assert pg_handler.get_altitude(10.5, 48.5) is None
+
+        prepare, params = conn.queries[0]
+        assert prepare.startswith('PREPARE gmalt_altitudes(double precision[]'
+                                  ', double precision[]) AS SELECT')
+        assert 'FROM   "my""table"' in prepare
+        assert conn.queries[1] == ('EXECUTE gmalt_altitudes(%s, %s)',
+                                   ([10.5], [48.5]))
+        assert len(conn.queries) == 3  # prepared once
+
+    def test_quote(self):
+        assert Handler._quote('elevation') == '"elevation"'
+        assert Handler._quote('gis.elev"ation') == '"gis"."elev""ation"'
+
+    def test_get_altitudes(self, mock_connect):  # noqa
+        pg_handler = Handler('gmalt')
+        conn = pg_handler.pool.get()
+        pg_handler.pool.put(conn)
+        conn.rows = [(57,), (None,), (-3,)]
+        alts = pg_handler.get_altitudes([10.5, 10.6, 10.7], [48.5, 0, 48.7])
+        numpy.testing.assert_array_equal(alts, [57, numpy.nan, -3])
+        assert conn.queries[-1] == ('EXECUTE gmalt_altitudes(%s, %s)',
+                                    ([10.5, 10.6, 10.7], [48.5, 0, 48.7]))
+
+    def test_get_altitudes_empty(self, mock_connect):  # noqa
+        alts = Handler('gmalt').get_altitudes([], [])
+        assert alts.shape == (0,)
+        assert mock_connect == []
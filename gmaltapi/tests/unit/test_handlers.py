@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2017 Jonathan Bouzekri
+#
+# This file is part of the gmalt application
+#
+# MIT License :
+# https://raw.githubusercontent.com/gmalt/api/master/LICENSE.txt
+
+""" Unit test of :mod:`gmaltapi.handlers` """
+
+import numpy
+import pytest
+
+import gmaltapi.handlers as handlers
+
+
+class CellHandler(handlers.BaseHandler):
+    def get_altitude(self, lat, lng):
+        return None if lat < 0 else int(lat) * 100 + int(lng)
+
+
+def test_get_altitudes(mock_handler):
+    alts = handlers.get_altitudes(mock_handler, [1.5, 2.5], [10.5, 20.5])
+    numpy.testing.assert_array_equal(alts, [57, 57])
+    assert mock_handler.lat == 2.5
+    assert mock_handler.lng == 20.5
+
+
+class TestBaseHandler(object):
+    def test_get_altitude(self):
+        with pytest.raises(NotImplementedError):
+            handlers.BaseHandler().get_altitude(1, 1)
+
+    def test_get_altitudes(self):
+        alts = CellHandler().get_altitudes([1.5, -1.5, 2.5], [10.5, 1, 20.5])
+        numpy.testing.assert_array_equal(alts, [110, numpy.nan, 220])
+        assert alts.dtype == numpy.float64
+
+    def test_is_warm(self):
+        assert not handlers.BaseHandler().is_warm([1.5], [10.5])
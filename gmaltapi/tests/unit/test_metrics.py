@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2017 Jonathan Bouzekri
+#
+# This file is part of the gmalt application
+#
+# MIT License :
+# https://raw.githubusercontent.com/gmalt/api/master/LICENSE.txt
+
+""" Unit test of :mod:`gmaltapi.metrics` """
+
+import pytest
+
+import gmaltapi.metrics as metrics
+from gmaltapi.cache import CachedHandler
+from gmaltapi.coalesce import CoalescingHandler
+
+
+class StatsHandler(object):
+    def get_altitude(self, lat, lng):
+        return 57
+
+    def stats(self):
+        return {'hits': 3, 'misses': 2, 'evictions': 1, 'tiles': 1,
+                'bytes': 2884802}
+
+
+class TestHistogram(object):
+    @pytest.mark.parametrize("value,bucket", [
+        (0.0, 0), (0.1, 0), (0.11, 1), (0.2, 1), (10, 2)
+    ])
+    def test_observe(self, value, bucket):
+        histogram = metrics.Histogram((0.1, 0.2))
+        histogram.observe(value)
+        expected = [0, 0, 0]
+        expected[bucket] = 1
+        assert histogram.counts == expected
+        assert histogram.count == 1
+        assert histogram.sum == value
+
+    def test_render(self):
+        histogram = metrics.Histogram((0.1, 0.2))
+        for value in (0.05, 0.15, 0.15, 1):
+            histogram.observe(value)
+
+        assert histogram.render('latency', 'stage="parse"') == [
+            'latency_bucket{stage="parse",le="0.1"} 1',
+            'latency_bucket{stage="parse",le="0.2"} 3',
+            'latency_bucket{stage="parse",le="+Inf"} 4',
+            'latency_sum{stage="parse"} 1.35',
+            'latency_count{stage="parse"} 4'
+        ]
+        assert histogram.render('latency')[0] == 'latency_bucket{le="0.1"} 1'
+        assert histogram.render('latency')[-1] == 'latency_count 4'
+
+
+class TestRequestTimer(object):
+    def test_mark(self, monkeypatch):
+        now = iter([1.0, 1.5, 2.0, 2.25])
+        monkeypatch.setattr(metrics, 'clock', lambda: next(now))
+        timer = metrics.RequestTimer()
+
+        timer.mark('parse')
+        timer.mark('lookup')
+        assert timer.finish() == 1.25
+        assert timer.durations == {'parse': 0.5, 'lookup': 0.5,
+                                   'serialize': 0.25}
+
+    def test_finish_without_lookup(self, monkeypatch):
+        now = iter([1.0, 1.5])
+        monkeypatch.setattr(metrics, 'clock', lambda: next(now))
+        timer = metrics.RequestTimer()
+
+        assert timer.finish() == 0.5
+        assert timer.durations == {'parse': 0.5}
+
+
+class TestMetrics(object):
+    def test_request_finished(self):
+        registry = metrics.Metrics()
+        for code in (200, 200, 400):
+            timer = metrics.RequestTimer()
+            timer.mark('parse')
+            timer.mark('lookup')
+            registry.request_finished('/altitude', code, timer)
+
+        assert registry.requests == {('/altitude', 200): 2,
+                                     ('/altitude', 400): 1}
+        assert registry.durations['/altitude'].count == 3
+        assert dict((stage, histogram.count) for stage, histogram
+                    in registry.stages.items()) == \
+            {'parse': 3, 'lookup': 3, 'serialize': 3}
+
+    def test_render(self):
+        registry = metrics.Metrics()
+        registry.in_flight = 2
+        registry.request_finished('/profile', 404, metrics.RequestTimer())
+        registry.add_collector(lambda: [('gmalt_test', 'gauge', 'A test.',
+                                         5)])
+
+        lines = registry.render().splitlines()
+
+        assert 'gmalt_requests_total{route="/profile",code="404"} 1' in lines
+        assert 'gmalt_requests_in_flight 2' in lines
+        assert 'gmalt_request_duration_seconds_count{route="/profile"} 1' \
+            in lines
+        assert 'gmalt_stage_duration_seconds_count{stage="parse"} 1' in lines
+        assert 'gmalt_stage_duration_seconds_count{stage="lookup"} 0' \
+            in lines
+        assert lines[-3:] == ['# HELP gmalt_test A test.',
+                              '# TYPE gmalt_test gauge', 'gmalt_test 5']
+        # each metric is declared once
+        types = [line for line in lines if line.startswith('# TYPE')]
+        assert len(types) == len(set(types)) == 5
+
+
+def test_handler_metrics_coalesce():
+    alt_handler = CoalescingHandler(StatsHandler(), 0)
+    alt_handler.get_altitude(1, 2)
+
+    values = dict((name, value) for name, _, _, value
+                  in metrics.handler_metrics(alt_handler))
+    assert values['gmalt_coalesce_batches_total'] == 1
+    assert values['gmalt_coalesce_lookups_total'] == 1
+    assert values['gmalt_coalesce_deduplicated_total'] == 0
+    assert values['gmalt_coalesce_delay_seconds'].count == 1
+    assert 'gmalt_tile_cache_tiles' in values
+
+    registry = metrics.Metrics()
+    registry.add_collector(lambda: metrics.handler_metrics(alt_handler))
+    assert 'gmalt_coalesce_delay_seconds_count 1' in \
+        registry.render().splitlines()
+
+
+def test_handler_metrics():
+    assert metrics.handler_metrics(object()) == []
+
+    alt_handler = CachedHandler(StatsHandler(), 10)
+    alt_handler.get_altitude(1, 2)
+    alt_handler.get_altitude(1, 2)
+
+    values = dict((name, value) for name, _, _, value
+                  in metrics.handler_metrics(alt_handler))
+    assert values == {
+        'gmalt_tile_cache_hits_total': 3,
+        'gmalt_tile_cache_misses_total': 2,
+        'gmalt_tile_cache_evictions_total': 1,
+        'gmalt_tile_cache_tiles': 1,
+        'gmalt_tile_cache_bytes': 2884802,
+        'gmalt_response_cache_hits_total': 1,
+        'gmalt_response_cache_misses_total': 1,
+        'gmalt_response_cache_bypasses_total': 0,
+        'gmalt_response_cache_evictions_total': 0,
+        'gmalt_response_cache_entries': 1
+    }
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2017 Jonathan Bouzekri
+#
+# This file is part of the gmalt application
+#
+# MIT License :
+# https://raw.githubusercontent.com/gmalt/api/master/LICENSE.txt
+
+""" Unit test of :mod:`gmaltapi.pack` """
+
+import os
+
+import numpy
+import pytest
+
+from .. import write_hgt
+from .test_tiles import compress_hgt
+import gmaltapi.pack as pack
+
+
+def test_pack_folder(empty_file_folder, tmpdir):
+    write_hgt(empty_file_folder, 'N10E048.hgt', 11)
+    compress_hgt(empty_file_folder, 'S01W002.hgt', 21, 'zip')
+    empty_file_folder.join('unknown.hgt').write('bad name')
+    path = str(tmpdir.join('tiles.gpak'))
+
+    assert pack.pack_folder(str(empty_file_folder), path) == 2
+    assert not os.path.exists(path + '.tmp')
+    # header + index in the first page then one page per tile
+    assert os.path.getsize(path) == 3 * pack.ALIGNMENT
+
+
+def test_pack_folder_empty(empty_file_folder, tmpdir):
+    with pytest.raises(Exception) as e:
+        pack.pack_folder(str(empty_file_folder), str(tmpdir.join('a.gpak')))
+    assert 'does not contain any HGT file' in str(e.value)
+
+
+class TestPackedArchive(object):
+    def test_get(self, empty_file_folder, tmpdir):
+        write_hgt(empty_file_folder, 'N10E048.hgt', 11)
+        compress_hgt(empty_file_folder, 'S01W002.hgt', 21, 'gz')
+        path = str(tmpdir.join('tiles.gpak'))
+        pack.pack_folder(str(empty_file_folder), path)
+
+        archive = pack.PackedArchive(path)
+        assert len(archive) == 2
+        assert list(archive) == [(-1, -2), (10, 48)]
+        assert (10, 48) in archive
+        assert archive.get((0, 0)) is None
+
+        tile = archive.get((10, 48))
+        assert archive.get((10, 48)) is tile
+        assert (tile.lat, tile.lng, tile.samples) == (10, 48, 11)
+        assert tile.get_elevation(10.5, 48.5) == 60
+        numpy.testing.assert_array_equal(
+            archive.get((-1, -2)).values[0], numpy.arange(21)
+        )
+
+    def test_close(self, empty_file_folder, tmpdir):
+        write_hgt(empty_file_folder, 'N10E048.hgt', 11)
+        path = str(tmpdir.join('tiles.gpak'))
+        pack.pack_folder(str(empty_file_folder), path)
+
+        archive = pack.PackedArchive(path)
+        tile = archive.get((10, 48))
+        archive.close()
+        assert tile.values is None
+
+    def test__init__not_an_archive(self, tmpdir):
+        path = tmpdir.join('tiles.gpak')
+        path.write('not an archive')
+        with pytest.raises(ValueError) as e:
+            pack.PackedArchive(str(path))
+        assert str(e.value) == '{} is not a HGT archive'.format(path)
+
+    def test__init__truncated(self, empty_file_folder, tmpdir):
+        write_hgt(empty_file_folder, 'N10E048.hgt', 11)
+        path = tmpdir.join('tiles.gpak')
+        pack.pack_folder(str(empty_file_folder), str(path))
+        path.write_binary(path.read_binary()[:pack.ALIGNMENT + 100])
+        with pytest.raises(ValueError) as e:
+            pack.PackedArchive(str(path))
+        assert str(e.value) == '{} : truncated archive'.format(path)
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2017 Jonathan Bouzekri
+#
+# This file is part of the gmalt application
+#
+# MIT License :
+# https://raw.githubusercontent.com/gmalt/api/master/LICENSE.txt
+
+""" Unit test of :mod:`gmaltapi.server` """
+
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+import gevent
+import pytest
+import requests
+
+from gmaltapi.handler import WSGIHandler
+from gmaltapi.server import GmaltServer
+
+
+def pid_app(environ, start_response):
+    """ Answer with the pid of the process and of its parent """
+    body = json.dumps([os.getpid(), os.getppid()]).encode('utf-8')
+    start_response('200 OK', [('Content-Type', 'application/json'),
+                              ('Connection', 'close')])
+    return [body]
+
+
+def free_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+def wait_for(predicate, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        result = predicate()
+        if result:
+            return result
+        time.sleep(0.05)
+    raise AssertionError('timeout')
+
+
+@pytest.fixture
+def prefork_server():
+    port = free_port()
+
+    def serve():
+        # the process is forked from a process which may already run a hub
+        gevent.reinit()
+        GmaltServer(pid_app, '127.0.0.1', port, workers=2,
+                    log=None).serve_forever(stop_timeout=1)
+
+    process = multiprocessing.Process(target=serve)
+    process.start()
+
+    def get_pids():
+        try:
+            return requests.get('http://127.0.0.1:{}/'.format(port),
+                                timeout=1).json()
+        except requests.ConnectionError:
+            return None
+
+    yield process, get_pids
+    if process.is_alive():
+        os.kill(process.pid, signal.SIGKILL)
+    process.join()
+
+
+def test_init_workers_default():
+    server = GmaltServer(pid_app, '127.0.0.1', 0, pool_size=None)
+    assert server.workers == 1
+    assert 'workers' in GmaltServer.spec
+
+
+@pytest.mark.parametrize("pool_size,expected", [
+    (None, {'gmalt_server_connections': 0}),
+    (10, {'gmalt_server_connections': 0, 'gmalt_server_pool_size': 10})
+])
+def test_pool_metrics(pool_size, expected):
+    wsgi_app = WSGIHandler(object())
+    server = GmaltServer(wsgi_app, '127.0.0.1', 0, pool_size=pool_size)
+
+    values = dict((name, value) for name, _, _, value
+                  in server._pool_metrics())
+    assert values == expected
+    assert 'gmalt_server_connections 0' in wsgi_app.metrics.render()
+
+
+def test_serve_forever_workers(prefork_server):
+    process, get_pids = prefork_server
+
+    worker, master = wait_for(get_pids)
+    assert master == process.pid
+
+    # a worker killed is restarted
+    os.kill(worker, signal.SIGKILL)
+    wait_for(lambda: not is_alive(worker) or None)
+    pids = set()
+    for _ in range(20):
+        worker_pid, master_pid = wait_for(get_pids)
+        assert master_pid == process.pid
+        pids.add(worker_pid)
+    assert worker not in pids
+
+    # SIGTERM stops the master and the workers
+    os.kill(process.pid, signal.SIGTERM)
+    process.join(10)
+    assert process.exitcode == 0
+    assert not any(is_alive(pid) for pid in pids)
+
+
+def test_admission():
+    wsgi_app = WSGIHandler(object())
+    server = GmaltServer(wsgi_app, '127.0.0.1', 0, pool_size=10,
+                         max_queued=20, max_wait=0.5, batch_pool_size=5)
+
+    # the connections are not bounded, the requests are
+    assert server.pool is None
+    assert server.admission.pool_size == 10
+    assert server.admission.max_queued == 20
+    assert server.admission.batch_pool_size == 5
+    assert server.application is server.admission
+    assert 'gmalt_admission_queued 0' in wsgi_app.metrics.render()
+
+    server = GmaltServer(wsgi_app, '127.0.0.1', 0, pool_size=10,
+                         max_queued=None, max_wait=1.0)
+    assert server.admission is None
+    assert server.pool.size == 10
+
+
+def test_admission_without_pool_size():
+    with pytest.raises(ValueError):
+        GmaltServer(pid_app, '127.0.0.1', 0, max_queued=10)
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2017 Jonathan Bouzekri
+#
+# This file is part of the gmalt application
+#
+# MIT License :
+# https://raw.githubusercontent.com/gmalt/api/master/LICENSE.txt
+
+""" Unit test of :mod:`gmaltapi.task` """
+
+from .. import write_hgt
+from gmaltapi.handlers.file import Handler
+from gmaltapi.task import GmaltCelery
+
+
+class TestGmaltCelery(object):
+    def test_alt_handler(self, empty_file_folder):
+        write_hgt(empty_file_folder, 'N10E048.hgt', 11)
+        app = GmaltCelery('gmalt', 'memory://', 'cache+memory://',
+                          worker_conf={'folder': str(empty_file_folder)})
+        assert isinstance(app.alt_handler, Handler)
+        assert app.alt_handler is app.alt_handler
+
+    def test_altitudes(self, empty_file_folder):
+        write_hgt(empty_file_folder, 'N10E048.hgt', 11)
+        app = GmaltCelery('gmalt', 'memory://', 'cache+memory://',
+                          worker_conf={'folder': str(empty_file_folder)})
+        alts = app.altitudes.run([10.5, 0, 10.53], [48.5, 0, 48.32],
+                                 'bilinear')
+        assert alts[:2] == [60, None]
+        assert abs(alts[2] - (4.7 * 11 + 3.2)) < 1e-9
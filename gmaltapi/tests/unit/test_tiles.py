@@ -0,0 +1,567 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2017 Jonathan Bouzekri
+#
+# This file is part of the gmalt application
+#
+# MIT License :
+# https://raw.githubusercontent.com/gmalt/api/master/LICENSE.txt
+
+""" Unit test of :mod:`gmaltapi.tiles` """
+
+import gzip
+import os
+import zipfile
+
+import numpy
+import pytest
+
+from .. import write_hgt
+import gmaltapi.tiles
+from gmaltapi.tiles import DecompressFolder, Tile, TileCache, \
+    TileFrequency, TileIndex, TileInfo, group_by_cell, gather_around, \
+    interpolate, read_ahead, read_compressed, sample_key, sample_keys
+
+
+def compress_hgt(folder, name, samples, compression):
+    """ Write a HGT file and compress it to `name.zip` or `name.gz` """
+    hgt_file = write_hgt(folder, name, samples)
+    path = '{}.{}'.format(hgt_file, compression)
+    if compression == 'zip':
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.write(str(hgt_file), name)
+    else:
+        with gzip.open(path, 'wb') as gz_file:
+            gz_file.write(hgt_file.read_binary())
+    hgt_file.remove()
+    return path
+
+
+def linear_tile(folder, lat, lng, samples=11):
+    """ Write and map a tile whose values are a linear function of the
+    global position of the samples """
+    step = samples - 1
+
+    def value(line, col):
+        return 3 * (lat * step + step - line) + 2 * (lng * step + col)
+
+    name = '{}{:02d}{}{:03d}.hgt'.format('N' if lat >= 0 else 'S', abs(lat),
+                                         'E' if lng >= 0 else 'W', abs(lng))
+    return Tile(str(write_hgt(folder, name, samples, value)), lat, lng)
+
+
+def test_group_by_cell():
+    lats = numpy.array([10.5, -0.5, 10.1, numpy.nan, -0.9, 10.0])
+    lngs = numpy.array([48.5, -1.5, 48.9, 48.5, -1.1, 49.0])
+    groups = [(cell, idx.tolist()) for cell, idx in group_by_cell(lats, lngs)]
+    assert groups == [((-1, -2), [1, 4]), ((10, 48), [0, 2]),
+                      ((10, 49), [5])]
+
+
+def test_group_by_cell_antimeridian():
+    # (11, -180) and (10, 180) used to share the same group
+    lats = numpy.array([11.5, 10.5, 90.0])
+    lngs = numpy.array([-179.5, 180.0, 180.0])
+    groups = [(cell, idx.tolist()) for cell, idx in group_by_cell(lats, lngs)]
+    assert groups == [((10, 179), [1]), ((11, -180), [0]), ((89, 179), [2])]
+
+
+def test_sample_key():
+    lats = numpy.array([45.0, 45.00013888888889, -0.5, 90.0])
+    lngs = numpy.array([6.5, 6.5, -1.0001, 180.0])
+    keys = [(45, 0, 6, 1800), (45, 1, 6, 1800), (-1, 1800, -2, 3600),
+            (89, 3600, 179, 3600)]
+    assert [sample_key(lat, lng) for lat, lng in zip(lats, lngs)] == keys
+    assert sample_keys(lats, lngs) == keys
+    assert sample_key(45.0004, 6.5, 1200) == (45, 0, 6, 600)
+
+
+def test_group_by_cell_empty():
+    empty = numpy.array([])
+    assert list(group_by_cell(empty, empty)) == []
+
+
+class MockTile(object):
+    def __init__(self, size):
+        self.size = size
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class TestTileIndex(object):
+    def test_cell_from_filename(self):
+        assert TileIndex.cell_from_filename('N00E000.hgt') == (0, 0)
+        assert TileIndex.cell_from_filename('S01W001.hgt') == (-1, -1)
+        assert TileIndex.cell_from_filename('n45e128.HGT') == (45, 128)
+        assert TileIndex.cell_from_filename('file.hgt') is None
+        assert TileIndex.cell_from_filename('N45E128.hgt.zip') == (45, 128)
+        assert TileIndex.cell_from_filename('N45E128.SRTMGL1.hgt.zip') == \
+            (45, 128)
+        assert TileIndex.cell_from_filename('N45E128.hgt.tar') is None
+
+    def test_compression_from_filename(self):
+        assert TileIndex.compression_from_filename('N45E128.hgt') is None
+        assert TileIndex.compression_from_filename('N45E128.hgt.ZIP') == 'zip'
+        assert TileIndex.compression_from_filename('N45E128.hgt.gz') == 'gz'
+
+    def test__init__(self, empty_file_folder):
+        srtm3 = write_hgt(empty_file_folder, 'N10E048.hgt', 11)
+        write_hgt(empty_file_folder, 'N10E049.txt', 11)
+        empty_file_folder.join('N10E050.hgt').write('wrong size')
+        empty_file_folder.join('unknown.hgt').write('bad name')
+
+        index = TileIndex(str(empty_file_folder))
+        assert len(index) == 1
+        assert index.get((10, 48)) == TileInfo(str(srtm3), 10, 48, 11, 242,
+                                               None)
+        assert index.get((10, 49)) is None
+        assert (10, 50) not in index
+        assert index.ignored == [str(empty_file_folder.join('N10E050.hgt')),
+                                 str(empty_file_folder.join('unknown.hgt'))]
+        assert list(index) == [index.get((10, 48))]
+
+    @pytest.mark.parametrize("compression", ['zip', 'gz'])
+    def test__init__compressed(self, empty_file_folder, compression):
+        path = compress_hgt(empty_file_folder, 'N10E048.hgt', 11, compression)
+        empty_file_folder.join('N10E049.hgt.' + compression).write('corrupted')
+
+        index = TileIndex(str(empty_file_folder))
+        assert index.get((10, 48)) == TileInfo(path, 10, 48, 11, 242,
+                                               compression)
+        assert index.ignored == [
+            str(empty_file_folder.join('N10E049.hgt.' + compression))
+        ]
+
+    def test__init__prefer_raw(self, empty_file_folder):
+        compress_hgt(empty_file_folder, 'N10E048.hgt', 11, 'zip')
+        compress_hgt(empty_file_folder, 'N10E048.hgt', 11, 'gz')
+        raw = write_hgt(empty_file_folder, 'N10E048.hgt', 11)
+
+        index = TileIndex(str(empty_file_folder))
+        assert index.get((10, 48)).path == str(raw)
+        assert index.get((10, 48)).compression is None
+
+
+class TestTile(object):
+    def test__init__(self, empty_file_folder):
+        hgt_file = write_hgt(empty_file_folder, 'S01W002.hgt', 11)
+        tile = Tile(str(hgt_file), -1, -2)
+        assert tile.samples == 11
+        assert tile.size == 242
+        assert tile.lat == -1
+        assert tile.lng == -2
+
+    def test_get_elevation(self, empty_file_folder):
+        hgt_file = write_hgt(empty_file_folder, 'S01W002.hgt', 11)
+        tile = Tile(str(hgt_file), -1, -2)
+        assert tile.get_elevation(-1.0, -2.0) == 110
+        assert tile.get_elevation(-0.01, -1.01) == 10
+        assert tile.get_elevation(-0.38, -1.69) == 47
+
+    def test_get_elevations(self, empty_file_folder):
+        hgt_file = write_hgt(empty_file_folder, 'S01W002.hgt', 11,
+                             lambda line, col: -32768 if col == 0 else col)
+        tile = Tile(str(hgt_file), -1, -2)
+        elevations = tile.get_elevations(numpy.array([-1.0, -0.38, -0.5]),
+                                         numpy.array([-2.0, -1.69, -1.5]))
+        numpy.testing.assert_array_equal(elevations, [numpy.nan, 3, 5])
+
+    def test_close(self, empty_file_folder):
+        hgt_file = write_hgt(empty_file_folder, 'N00E000.hgt', 11)
+        tile = Tile(str(hgt_file), 0, 0)
+        tile.close()
+        assert tile.values is None
+        with pytest.raises(ValueError):
+            tile.get_elevation(0.5, 0.5)
+
+    def test_close_values_in_use(self, empty_file_folder):
+        hgt_file = write_hgt(empty_file_folder, 'N00E000.hgt', 11)
+        tile = Tile(str(hgt_file), 0, 0)
+        values = tile.values
+        tile.close()  # released when values is garbage collected
+        assert values[0, 1] == 1
+
+    def test_in_memory(self, empty_file_folder):
+        path = compress_hgt(empty_file_folder, 'S01W002.hgt', 11, 'gz')
+        info = TileIndex(str(empty_file_folder)).get((-1, -2))
+        tile = Tile(path, -1, -2, read_compressed(info))
+        assert tile.size == 242
+        assert tile.get_elevation(-0.38, -1.69) == 47
+        tile.close()
+        assert tile.values is None
+
+
+class TestDecompressFolder(object):
+    def test_get(self, empty_file_folder, tmpdir):
+        compress_hgt(empty_file_folder, 'N10E048.hgt', 11, 'zip')
+        info = TileIndex(str(empty_file_folder)).get((10, 48))
+        spill = tmpdir.mkdir('spill')
+        folder = DecompressFolder(str(spill))
+        path = folder.get(info)
+        assert path == str(spill.join('10_48.hgt'))
+        assert Tile(path, 10, 48).get_elevation(10.5, 48.5) == 60
+        assert folder.get(info) == path  # already decompressed
+        assert folder.bytes == 242
+        assert spill.listdir() == [spill.join('10_48.hgt')]
+
+    def test_get_corrupted(self, empty_file_folder, tmpdir):
+        path = empty_file_folder.join('N10E048.hgt.gz')
+        path.write_binary(b'not gzip')
+        info = TileInfo(str(path), 10, 48, 11, 242, 'gz')
+        spill = tmpdir.mkdir('spill')
+        folder = DecompressFolder(str(spill))
+        with pytest.raises(IOError):
+            folder.get(info)
+        assert spill.listdir() == []
+
+    def test_evict(self, empty_file_folder, tmpdir):
+        compress_hgt(empty_file_folder, 'N10E048.hgt', 11, 'gz')
+        compress_hgt(empty_file_folder, 'N10E049.hgt', 11, 'gz')
+        index = TileIndex(str(empty_file_folder))
+        folder = DecompressFolder(str(tmpdir.mkdir('spill')), max_bytes=300)
+        first = folder.get(index.get((10, 48)))
+        tile = Tile(first, 10, 48)
+        second = folder.get(index.get((10, 49)))
+        assert not os.path.exists(first)
+        assert os.path.exists(second)
+        assert folder.bytes == 242
+        assert tile.get_elevation(10.5, 48.5) == 60  # mapping still valid
+
+    def test_shared(self, empty_file_folder, tmpdir, monkeypatch):
+        for lng in (48, 49, 50):
+            compress_hgt(empty_file_folder, 'N10E{:03d}.hgt'.format(lng), 11,
+                         'gz')
+        index = TileIndex(str(empty_file_folder))
+        spill = tmpdir.mkdir('spill')
+        # two processes sharing the folder
+        first = DecompressFolder(str(spill), max_bytes=500)
+        second = DecompressFolder(str(spill), max_bytes=500)
+        path = first.get(index.get((10, 48)))
+        os.utime(path, (1, 1))
+        second.get(index.get((10, 49)))
+        os.utime(str(spill.join('10_49.hgt')), (2, 2))
+
+        def decompress(info):
+            raise AssertionError('already decompressed')
+        monkeypatch.setattr(gmaltapi.tiles, 'read_compressed', decompress)
+        assert second.get(index.get((10, 48))) == path
+        monkeypatch.undo()
+
+        # the least recently used file of the folder is removed
+        first.get(index.get((10, 50)))
+        assert sorted(spill.listdir()) == [spill.join('10_48.hgt'),
+                                           spill.join('10_50.hgt')]
+        assert first.bytes == 484
+
+    def test_touch(self, tmpdir, monkeypatch):
+        spill = tmpdir.mkdir('spill')
+        path = spill.join('10_48.hgt')
+        path.write('x' * 242)
+        folder = DecompressFolder(str(spill))
+        now = [1000.0]
+        monkeypatch.setattr(gmaltapi.tiles.time, 'time', lambda: now[0])
+
+        path.setmtime(1)
+        folder.touch(str(path))
+        assert path.mtime() > 1
+        path.setmtime(1)
+        now[0] += 0.5
+        folder.touch(str(path))  # at most every TOUCH_INTERVAL seconds
+        assert path.mtime() == 1
+        now[0] += 0.5
+        folder.touch(str(path))
+        assert path.mtime() > 1
+        path.remove()
+        now[0] += 1
+        folder.touch(str(path))  # removed by another process
+
+    def test_remove_dead_process_files(self, tmpdir, monkeypatch):
+        spill = tmpdir.mkdir('spill')
+        spill.join('12345.abc.tmp').write('partial')
+        spill.join('{}.abc.tmp'.format(os.getpid())).write('partial')
+        spill.join('10_48.hgt').write('x' * 242)
+        monkeypatch.setattr(gmaltapi.tiles, '_is_alive',
+                            lambda pid: pid == os.getpid())
+        folder = DecompressFolder(str(spill))
+        assert sorted(spill.listdir()) == sorted([
+            spill.join('10_48.hgt'),
+            spill.join('{}.abc.tmp'.format(os.getpid()))
+        ])
+        assert folder.bytes == 242
+
+    def test__init__not_a_folder(self, tmpdir):
+        with pytest.raises(Exception) as e:
+            DecompressFolder(str(tmpdir.join('missing')))
+        assert 'does not exists' in str(e.value)
+
+
+def test_read_ahead(empty_file_folder):
+    hgt_file = write_hgt(empty_file_folder, 'N10E048.hgt', 11)
+    assert read_ahead(str(hgt_file), chunk_size=100) == 242
+
+
+class TestTileFrequency(object):
+    def test_record(self, monkeypatch):
+        frequency = TileFrequency(half_life=10)
+        monkeypatch.setattr(frequency, 'CHECK_EVERY', 3)
+        ticks = []
+        monkeypatch.setattr(frequency, 'tick', lambda: ticks.append(1))
+        for key in ['a', 'b', 'a', 'a']:
+            frequency.record(key)
+        assert frequency.get('a') == 3
+        assert frequency.get('c') == 0
+        assert ticks == [1]
+
+    def test_tick_decay(self):
+        frequency = TileFrequency(half_life=10)
+        frequency.counts = {'a': 8, 'b': 0.1}
+        start = frequency._decayed
+        frequency.tick(start + 5)
+        assert frequency.counts == {'a': 8, 'b': 0.1}
+        frequency.tick(start + 20)
+        assert frequency.counts == {'a': 2}
+
+    def test_hottest(self):
+        frequency = TileFrequency(count=2)
+        frequency.counts = {(1, 1): 2, (0, 0): 5, (2, 2): 2}
+        assert frequency.hottest() == [(0, 0), (1, 1)]
+        assert frequency.hottest(5) == [(0, 0), (1, 1), (2, 2)]
+
+    def test_save_and_load(self, tmpdir):
+        path = str(tmpdir.join('hot.json'))
+        frequency = TileFrequency(path=path, interval=60, count=2)
+        frequency.counts = {(10, 48): 2, (-1, -2): 5.5, (0, 0): 1}
+        frequency.tick(frequency._saved + 30)
+        assert not os.path.exists(path)
+        frequency.tick(frequency._saved + 60)
+        assert tmpdir.listdir() == [tmpdir.join('hot.json')]
+
+        # the counters are scaled down
+        restored = TileFrequency(path=path)
+        assert restored.load() == [(-1, -2), (10, 48)]
+        assert restored.counts == {(-1, -2): 4, (10, 48): 4 * 2 / 5.5}
+
+    def test_save_and_load_workers(self, tmpdir, monkeypatch):
+        path = str(tmpdir.join('hot.json'))
+        frequency = TileFrequency(path=path)
+        frequency.counts = {(0, 0): 1, (1, 1): 4}
+        frequency.save()
+        for pid, counts in ((1001, {(0, 0): 5}), (1002, {(0, 0): 2})):
+            monkeypatch.setattr(os, 'getpid', lambda: pid)
+            frequency.counts = counts
+            frequency.save()
+        monkeypatch.undo()
+        assert sorted(tmpdir.listdir()) == [tmpdir.join('hot.json'),
+                                            tmpdir.join('hot.json.1001'),
+                                            tmpdir.join('hot.json.1002')]
+
+        # the counters of the workers are summed and merged into the file
+        restored = TileFrequency(path=path)
+        assert restored.load() == [(0, 0), (1, 1)]
+        assert restored.counts == {(0, 0): 4, (1, 1): 2}
+        assert tmpdir.listdir() == [tmpdir.join('hot.json')]
+        assert TileFrequency(path=path).load() == [(0, 0), (1, 1)]
+
+    def test_sample_size(self):
+        frequency = TileFrequency(sample_size=4)
+        for key in ['a', 'a', 'a', 'b']:
+            frequency.record(key)
+        assert frequency.counts == {'a': 1.5, 'b': 0.5}
+        for key in ['b', 'b', 'b', 'b']:
+            frequency.record(key)
+        assert frequency.get('b') > frequency.get('a')
+
+    def test_load_invalid(self, tmpdir):
+        assert TileFrequency().load() == []
+        path = tmpdir.join('hot.json')
+        assert TileFrequency(path=str(path)).load() == []
+        path.write('{"tiles": [[1]]}')
+        assert TileFrequency(path=str(path)).load() == []
+
+    def test_save_error(self, tmpdir):
+        path = str(tmpdir.join('missing', 'hot.json'))
+        frequency = TileFrequency(path=path)
+        frequency.counts = {(0, 0): 1}
+        frequency.save()  # logged
+        assert not os.path.exists(path)
+
+
+class TestTileCache(object):
+    def test_get_and_add(self):
+        cache = TileCache()
+        tile = MockTile(10)
+        assert cache.get('a') is None
+        assert cache.add('a', tile) is tile
+        assert cache.get('a') is tile
+        assert 'a' in cache
+        assert cache.stats() == {'hits': 1, 'misses': 1, 'evictions': 0,
+                                 'rejections': 0, 'tiles': 1, 'bytes': 10}
+
+    def test_add_replace(self):
+        cache = TileCache()
+        previous = MockTile(10)
+        cache.add('a', previous)
+        cache.add('a', MockTile(20))
+        assert previous.closed is True
+        assert cache.bytes == 20
+        assert len(cache) == 1
+
+    def test_evict_max_tiles(self):
+        cache = TileCache(max_tiles=2)
+        tiles = [MockTile(10) for _ in range(3)]
+        cache.add('a', tiles[0])
+        cache.add('b', tiles[1])
+        cache.get('a')  # 'b' is now the least recently used
+        cache.add('c', tiles[2])
+        assert 'a' in cache
+        assert 'b' not in cache
+        assert 'c' in cache
+        assert tiles[1].closed is True
+        assert cache.evictions == 1
+        assert cache.bytes == 20
+
+    def test_evict_max_bytes(self):
+        cache = TileCache(max_bytes=25)
+        cache.add('a', MockTile(10))
+        cache.add('b', MockTile(10))
+        cache.add('c', MockTile(10))
+        assert 'a' not in cache
+        assert len(cache) == 2
+
+    def test_evict_keeps_most_recent(self):
+        cache = TileCache(max_bytes=5)
+        cache.add('a', MockTile(10))
+        assert 'a' in cache
+        assert cache.evictions == 0
+
+    def test_clear(self):
+        cache = TileCache()
+        tile = MockTile(10)
+        cache.add('a', tile)
+        cache.clear()
+        assert len(cache) == 0
+        assert cache.bytes == 0
+        assert tile.closed is True
+
+    def test_pin(self):
+        cache = TileCache(max_tiles=1, max_bytes=15)
+        pinned = MockTile(10)
+        cache.add('a', pinned, pin=True)
+        cache.add('b', MockTile(10))
+        cache.add('c', MockTile(10))
+        # the pinned tile is kept and does not count in the limits
+        assert cache.get('a') is pinned
+        assert 'b' not in cache
+        assert 'c' in cache
+        assert cache.stats() == {'hits': 1, 'misses': 0, 'evictions': 1,
+                                 'rejections': 0, 'tiles': 2, 'bytes': 20}
+        cache.clear()
+        assert pinned.closed is True
+        assert cache.bytes == 0
+
+    def test_pin_replace(self):
+        cache = TileCache(max_tiles=1)
+        previous = MockTile(10)
+        cache.add('a', previous)
+        cache.add('a', MockTile(20), pin=True)
+        cache.add('b', MockTile(10))
+        cache.add('c', MockTile(10))
+        assert previous.closed is True
+        assert 'a' in cache
+        assert cache.bytes == 30
+
+    def test_admission(self):
+        cache = TileCache(max_tiles=2, frequency=TileFrequency())
+        for key in ('a', 'b', 'a', 'b', 'a'):
+            cache.get(key) or cache.add(key, MockTile(10))
+        # a scan of tiles accessed once does not evict the used ones
+        for key in ('c', 'd', 'e'):
+            rejected = MockTile(10)
+            assert cache.get(key) is None
+            assert cache.add(key, rejected) is rejected
+        assert 'a' in cache and 'b' in cache
+        assert cache.stats()['rejections'] == 3
+        assert cache.evictions == 0
+        # until it is used as often as the least recently used tile
+        cache.get('c')
+        cache.add('c', MockTile(10))
+        assert 'c' in cache and 'b' not in cache
+
+    def test_admission_candidate(self):
+        cache = TileCache(max_tiles=1, frequency=TileFrequency())
+        for _ in range(3):
+            cache.get('a')
+        cache.add('a', MockTile(10))
+        cache.get('b')
+        rejected = cache.add('b', MockTile(10))
+        # the rejected tile is kept apart until it is used as often
+        assert 'b' in cache and cache.get('b') is rejected
+        assert cache.stats()['tiles'] == 2
+        assert cache.stats()['bytes'] == 20
+        assert list(cache._tiles) == ['a']
+        assert cache.get('b') is rejected
+        assert list(cache._tiles) == ['b']
+        assert cache.stats()['tiles'] == 1
+        assert cache.evictions == 1 and cache.bytes == 10
+        assert not rejected.closed
+
+        # it is closed when another tile is rejected
+        cache.get('c')
+        candidate = cache.add('c', MockTile(10))
+        cache.get('d')
+        cache.add('d', MockTile(10))
+        assert candidate.closed and 'c' not in cache
+        cache.clear()
+        assert cache._candidate is None
+
+    def test_admission_disabled(self):
+        cache = TileCache(max_tiles=1, frequency=TileFrequency(),
+                          admission=False)
+        cache.get('a')
+        cache.get('a')
+        cache.add('a', MockTile(10))
+        cache.get('b')
+        cache.add('b', MockTile(10))
+        assert 'b' in cache
+        assert cache.frequency.get('a') == 2
+
+
+class TestInterpolate(object):
+    def test_gather_around(self, empty_file_folder):
+        tiles = dict(((lat, lng), linear_tile(empty_file_folder, lat, lng))
+                     for lat in (0, 1) for lng in (0, 1))
+        tiles[(1, 0)] = linear_tile(empty_file_folder, 1, 0, samples=21)
+        values = gather_around(tiles[(0, 0)],
+                               numpy.array([0, 10, 5, 11, -1, 11]),
+                               numpy.array([0, 10, 11, 11, 0, 0]),
+                               tiles.get)
+        # missing tile (-1, 0) and different resolution for tile (1, 0)
+        numpy.testing.assert_array_equal(
+            values, [0, 50, 37, 55, numpy.nan, numpy.nan]
+        )
+
+    @pytest.mark.parametrize("interpolation", ['bilinear', 'bicubic'])
+    def test_interpolate_linear(self, empty_file_folder, interpolation):
+        tiles = dict(((lat, lng), linear_tile(empty_file_folder, lat, lng))
+                     for lat in (-1, 0, 1) for lng in (-1, 0, 1))
+        lats = numpy.array([0.53, 0.01, 0.99, 0.0, 0.5])
+        lngs = numpy.array([0.27, 0.99, 0.01, 0.0, 0.95])
+        elevations = interpolate(tiles[(0, 0)], lats, lngs, interpolation,
+                                 tiles.get)
+        numpy.testing.assert_allclose(elevations, 30 * lats + 20 * lngs)
+
+    def test_interpolate_nearest(self, empty_file_folder):
+        tile = linear_tile(empty_file_folder, 0, 0)
+        elevations = interpolate(tile, numpy.array([0.53]),
+                                 numpy.array([0.27]), 'nearest', None)
+        numpy.testing.assert_array_equal(elevations, [21])
+
+    def test_interpolate_fallback_nearest(self, empty_file_folder):
+        tile = linear_tile(empty_file_folder, 0, 0)
+        # bicubic needs the tile on the left which is missing
+        elevations = interpolate(tile, numpy.array([0.53, 0.53]),
+                                 numpy.array([0.04, 0.5]), 'bicubic',
+                                 lambda cell: None)
+        numpy.testing.assert_allclose(elevations, [15, 25.9])
@@ -0,0 +1,1022 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2017 Jonathan Bouzekri
+#
+# This file is part of the gmalt application
+#
+# MIT License :
+# https://raw.githubusercontent.com/gmalt/api/master/LICENSE.txt
+
+""" Tools to index HGT tiles, read elevation values from memory-mapped
+tiles and keep the most recently used ones open """
+
+import collections
+import errno
+import gzip
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+import tempfile
+import time
+import zipfile
+
+import numpy
+
+
+#: description of an indexed HGT file. `size` is the size of the
+#: uncompressed data and `compression` is None, `zip` or `gz`
+TileInfo = collections.namedtuple('TileInfo', ['path', 'lat', 'lng',
+                                               'samples', 'size',
+                                               'compression'])
+
+
+def read_compressed(info):
+    """ Decompress the data of a compressed HGT file
+
+    :param info: the description of the HGT file
+    :type info: :class:`TileInfo`
+    :return: the uncompressed HGT data
+    :rtype: bytes
+    """
+    if info.compression == 'zip':
+        with zipfile.ZipFile(info.path) as archive:
+            return archive.read(_zip_member(archive))
+    with gzip.open(info.path, 'rb') as gz_file:
+        return gz_file.read()
+
+
+def read_ahead(path, chunk_size=1 << 20):
+    """ Read a file by chunks so that it is in the page cache when it is
+    mapped. The chunks are read without holding the GIL, several files can
+    be read in parallel by threads
+
+    :param str path: path to the file
+    :param int chunk_size: size in bytes of the chunks
+    :return: the size of the file in bytes
+    :rtype: int
+    """
+    size = 0
+    buf = bytearray(chunk_size)
+    with open(path, 'rb', buffering=0) as read_file:
+        read = read_file.readinto(buf)
+        while read:
+            size += read
+            read = read_file.readinto(buf)
+    return size
+
+
+def _zip_member(archive):
+    """ Get the HGT file in a zip archive
+
+    :param archive: the zip archive
+    :type archive: :class:`zipfile.ZipFile`
+    :rtype: :class:`zipfile.ZipInfo`
+    :raises ValueError: if there is no HGT file in the archive
+    """
+    for member in archive.infolist():
+        if member.filename.lower().endswith('.hgt'):
+            return member
+    raise ValueError('no HGT file in {}'.format(archive.filename))
+
+
+def cells_of(lats, lngs):
+    """ Get the 1x1 degree cells of positions. The positions on the north
+    pole or on the antimeridian (`lat = 90` or `lng = 180`) belong to the
+    cell whose north or east edge they are on
+
+    :param lats: the latitudes of the positions
+    :type lats: :class:`numpy.ndarray` of float
+    :param lngs: the longitudes of the positions
+    :type lngs: :class:`numpy.ndarray` of float
+    :return: the latitudes and the longitudes of the bottom left corners
+    :rtype: tuple(:class:`numpy.ndarray` of int, :class:`numpy.ndarray` of
+        int)
+    """
+    return (numpy.minimum(numpy.floor(lats), 89).astype(numpy.int64),
+            numpy.minimum(numpy.floor(lngs), 179).astype(numpy.int64))
+
+
+def sample_key(lat, lng, scale=3600.0):
+    """ Quantize a position to the nearest sample of a grid of `scale`
+    samples per degree, relative to its cell and rounded like
+    :func:`Tile.get_elevation`, so that the positions with the same key
+    resolve to the same sample of the tiles with this resolution (3600 for
+    SRTM1, 1200 for SRTM3)
+
+    :param float lat: the latitude of the position
+    :param float lng: the longitude of the position
+    :param float scale: the number of samples per degree
+    :return: tuple (lat of the cell, line from the bottom, lng of the cell,
+        column from the left)
+    :rtype: tuple(int, int, int, int)
+    """
+    cell_lat = min(int(math.floor(lat)), 89)
+    cell_lng = min(int(math.floor(lng)), 179)
+    return (cell_lat, int(round((lat - cell_lat) * scale)),
+            cell_lng, int(round((lng - cell_lng) * scale)))
+
+
+def sample_keys(lats, lngs, scale=3600.0):
+    """ Quantize finite positions like :func:`sample_key`
+
+    :param lats: the latitudes of the positions
+    :type lats: :class:`numpy.ndarray` of float
+    :param lngs: the longitudes of the positions
+    :type lngs: :class:`numpy.ndarray` of float
+    :param float scale: the number of samples per degree
+    :return: the keys of the positions
+    :rtype: list of tuple(int, int, int, int)
+    """
+    cell_lats, cell_lngs = cells_of(lats, lngs)
+    lines = numpy.rint((lats - cell_lats) * scale).astype(numpy.int64)
+    cols = numpy.rint((lngs - cell_lngs) * scale).astype(numpy.int64)
+    return list(zip(cell_lats.tolist(), lines.tolist(),
+                    cell_lngs.tolist(), cols.tolist()))
+
+
+def group_by_cell(lats, lngs):
+    """ Group positions by the 1x1 degree cell they belong to
+
+    :param lats: the latitudes of the positions
+    :type lats: :class:`numpy.ndarray` of float
+    :param lngs: the longitudes of the positions
+    :type lngs: :class:`numpy.ndarray` of float
+    :return: iterator of tuple ((lat, lng) of the bottom left corner of the
+        cell, indices of the positions in this cell). Positions with a non
+        finite coordinate are skipped
+
+    .. seealso:: :func:`cells_of`
+    :rtype: iterator of tuple(tuple(int, int), :class:`numpy.ndarray`)
+    """
+    valid = numpy.flatnonzero(numpy.isfinite(lats) & numpy.isfinite(lngs))
+    cell_lats, cell_lngs = cells_of(lats[valid], lngs[valid])
+    cell_ids = (cell_lats + 90) * 361 + (cell_lngs + 180)
+
+    order = numpy.argsort(cell_ids, kind='mergesort')
+    bounds = numpy.flatnonzero(numpy.diff(cell_ids[order])) + 1
+    for group in numpy.split(order, bounds):
+        if len(group):
+            cell = (int(cell_lats[group[0]]), int(cell_lngs[group[0]]))
+            yield cell, valid[group]
+
+
+class TileIndex(object):
+    """ An in-memory index of the HGT files available in a folder, keyed by
+    the (lat, lng) integer coordinates of the bottom left corner of the
+    cell they cover.
+
+    The folder is scanned once, knowing if there is a tile for a position
+    is then a dict lookup.
+
+    Compressed HGT files (`.hgt.zip` as distributed by the SRTM mirrors and
+    `.hgt.gz`) are indexed as well. If a cell has both a raw and a
+    compressed file, the raw one is used.
+
+    :param str folder: the folder containing the HGT files
+    """
+    FILENAME_REGEX = re.compile(r'^([NS])(\d{2})([EW])(\d{3})(?:\.\w+)?'
+                                r'\.hgt(?:\.(zip|gz))?$', re.IGNORECASE)
+
+    EXTENSIONS = ('.hgt', '.hgt.zip', '.hgt.gz')
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.ignored = []
+        self._tiles = {}
+        for filename in sorted(os.listdir(folder)):
+            if filename.lower().endswith(self.EXTENSIONS):
+                self._add(filename)
+
+    def __len__(self):
+        return len(self._tiles)
+
+    def __contains__(self, cell):
+        return cell in self._tiles
+
+    def __iter__(self):
+        return iter(self._tiles.values())
+
+    def get(self, cell):
+        """ Get the tile covering a cell
+
+        :param cell: the (lat, lng) of the bottom left corner of the cell
+        :type cell: tuple(int, int)
+        :return: the tile description or None if there is no tile
+        :rtype: :class:`TileInfo` or None
+        """
+        return self._tiles.get(cell)
+
+    def _add(self, filename):
+        """ Index a HGT file. Files with an unexpected name or size are
+        ignored
+
+        :param str filename: name of the HGT file in the folder
+        """
+        path = os.path.join(self.folder, filename)
+        cell = self.cell_from_filename(filename)
+        compression = self.compression_from_filename(filename)
+        samples, size = self._samples_from_file(path, compression)
+        if cell is None or samples is None:
+            logging.warning('HGT file %s ignored : unexpected name '
+                            'or size', path)
+            self.ignored.append(path)
+            return
+
+        previous = self._tiles.get(cell)
+        if previous is not None and previous.compression is None:
+            return  # the raw file is already indexed
+        self._tiles[cell] = TileInfo(path, cell[0], cell[1], samples, size,
+                                     compression)
+
+    @classmethod
+    def cell_from_filename(cls, filename):
+        """ Get the cell covered by a HGT file from its name
+
+        :param str filename: name of the HGT file (ex: `N10E048.hgt`)
+        :return: the (lat, lng) of the bottom left corner of the cell or
+            None if the name does not match the HGT pattern
+        :rtype: tuple(int, int) or None
+        """
+        result = cls.FILENAME_REGEX.match(filename)
+        if not result:
+            return None
+        lat_symbol, lat, lng_symbol, lng, _ = result.groups()
+        lat = int(lat) if lat_symbol.upper() == 'N' else -int(lat)
+        lng = int(lng) if lng_symbol.upper() == 'E' else -int(lng)
+        return lat, lng
+
+    @classmethod
+    def compression_from_filename(cls, filename):
+        """ Get the compression of a HGT file from its name
+
+        :param str filename: name of the HGT file (ex: `N10E048.hgt.zip`)
+        :return: `zip`, `gz` or None if not compressed
+        :rtype: str or None
+        """
+        result = cls.FILENAME_REGEX.match(filename)
+        if not result or not result.group(5):
+            return None
+        return result.group(5).lower()
+
+    @staticmethod
+    def _samples_from_file(path, compression=None):
+        """ Detect the resolution of a HGT file (3601 values per line for
+        SRTM1, 1201 for SRTM3) from its uncompressed size
+
+        :param str path: path to the HGT file
+        :param str compression: `zip`, `gz` or None if not compressed
+        :return: tuple (number of values per line, size in bytes). The
+            number of values is None if the file is not a squared grid
+            of 16 bits values
+        :rtype: tuple(int or None, int)
+        """
+        try:
+            if compression == 'zip':
+                with zipfile.ZipFile(path) as archive:
+                    size = _zip_member(archive).file_size
+            elif compression == 'gz':
+                # the gzip trailer ends with the uncompressed size modulo 2^32
+                with open(path, 'rb') as gz_file:
+                    gz_file.seek(-4, os.SEEK_END)
+                    size, = struct.unpack('<I', gz_file.read(4))
+            else:
+                size = os.path.getsize(path)
+        except (IOError, ValueError, zipfile.BadZipfile):
+            return None, 0
+        samples = int(round(math.sqrt(size // 2)))
+        if samples < 2 or samples * samples * 2 != size:
+            return None, size
+        return samples, size
+
+
+class Tile(object):
+    """ A memory-mapped HGT file covering the 1x1 degree cell whose bottom
+    left corner is (`lat`, `lng`)
+
+    .. note:: once mapped, reading a value is a plain memory access, no
+        syscall is needed to look up an elevation. The values are also
+        exposed as a :class:`numpy.ndarray` view on the mapping for batch
+        lookups
+
+    :param str path: path to the HGT file
+    :param int lat: latitude of the bottom left corner of the tile
+    :param int lng: longitude of the bottom left corner of the tile
+    :param bytes data: the already decompressed HGT data, if provided the
+        file is not mapped
+    """
+    VOID_VALUE = -32768
+
+    def __init__(self, path, lat, lng, data=None):
+        self._mmap = None
+        if data is None:
+            with open(path, 'rb') as hgt_file:
+                self._mmap = mmap.mmap(hgt_file.fileno(), 0,
+                                       access=mmap.ACCESS_READ)
+            data = self._mmap
+        self._data = data
+        self.path = path
+        self.lat = lat
+        self.lng = lng
+        self.size = len(data)
+        self.samples = int(math.sqrt(self.size // 2))
+        self.values = numpy.frombuffer(data, dtype='>i2') \
+            .reshape(self.samples, self.samples)
+
+    def get_elevation(self, lat, lng):
+        """ Get the elevation of the sample nearest to the position
+
+        :param float lat: the latitude of the position
+        :param float lng: the longitude of the position
+        :return: the elevation value or None if void
+        :rtype: int or None
+        """
+        step = self.samples - 1
+        line = step - int(round((lat - self.lat) * step))
+        col = int(round((lng - self.lng) * step))
+        value, = struct.unpack_from('>h', self._data,
+                                    2 * (line * self.samples + col))
+        return value if value != self.VOID_VALUE else None
+
+    def get_elevations(self, lats, lngs):
+        """ Get the elevations of the samples nearest to the positions
+
+        :param lats: the latitudes of the positions
+        :type lats: :class:`numpy.ndarray` of float
+        :param lngs: the longitudes of the positions
+        :type lngs: :class:`numpy.ndarray` of float
+        :return: the elevation values with NaN for void values
+        :rtype: :class:`numpy.ndarray` of float
+        """
+        step = self.samples - 1
+        lines = step - numpy.rint((lats - self.lat) * step).astype(numpy.intp)
+        cols = numpy.rint((lngs - self.lng) * step).astype(numpy.intp)
+        return self.gather(lines, cols)
+
+    def gather(self, lines, cols):
+        """ Get the elevation values at lines and columns of the tile
+
+        :param lines: the zero based line numbers (from the top)
+        :type lines: :class:`numpy.ndarray` of int
+        :param cols: the zero based column numbers (from the left)
+        :type cols: :class:`numpy.ndarray` of int
+        :return: the elevation values with NaN for void values
+        :rtype: :class:`numpy.ndarray` of float
+        """
+        values = self.values[lines, cols]
+        elevations = values.astype(numpy.float64)
+        elevations[values == self.VOID_VALUE] = numpy.nan
+        return elevations
+
+    def close(self):
+        """ Unmap the HGT file or release the decompressed data
+
+        .. note:: if an array built from :attr:`values` is still in use,
+            the mapping is released when this array is garbage collected
+        """
+        self.values = None
+        if self._mmap is None:
+            self._data = None
+            return
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+
+
+class DecompressFolder(object):
+    """ A folder (ideally on a tmpfs) where compressed HGT files are
+    decompressed once so that they can be memory-mapped like raw files,
+    by this process and by any other process sharing the folder.
+
+    The folder is shared by the processes without any coordination other
+    than the file system : the name of a decompressed file is its cell, a
+    file is written to a temporary file then renamed, and a file is marked
+    as used by updating its modification time. When the cumulated size of
+    the decompressed files of the folder, whichever process wrote them,
+    exceeds `max_bytes`, the least recently used ones are removed. A
+    removed file stays readable by the processes which mapped it, a process
+    which did not map it yet gets it again with :func:`get`.
+
+    The temporary files left by a process which died while decompressing
+    are removed on startup and by the next eviction.
+
+    The processes keep using the files they mapped without calling
+    :func:`get`, they mark them as used with :func:`touch` (at most every
+    `TOUCH_INTERVAL` seconds per file) so that the files in use are not
+    the least recently used ones.
+
+    :param str folder: the folder to decompress the HGT files to
+    :param int max_bytes: maximum cumulated size of the decompressed files
+        (None for no limit)
+    """
+    TOUCH_INTERVAL = 1
+
+    def __init__(self, folder, max_bytes=None):
+        if not os.path.isdir(folder):
+            raise Exception('folder {} does not exists '
+                            'or is not a directory'.format(folder))
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._touched = {}
+        self._scan()
+
+    def get(self, info):
+        """ Get the path of the decompressed HGT file, decompressing it if
+        it is not available yet
+
+        :param info: the description of the compressed HGT file
+        :type info: :class:`TileInfo`
+        :return: path to the decompressed HGT file
+        :rtype: str
+        """
+        path = os.path.join(self.folder, '{}_{}.hgt'.format(info.lat,
+                                                            info.lng))
+        try:
+            if os.path.getsize(path) == info.size:
+                os.utime(path, None)
+                self._touched[path] = time.time()
+                return path
+        except OSError:
+            pass  # not decompressed yet or removed by another process
+
+        # write then rename so that others never map a partial file
+        handle, tmp_path = tempfile.mkstemp(
+            dir=self.folder, prefix='{}.'.format(os.getpid()), suffix='.tmp'
+        )
+        try:
+            with os.fdopen(handle, 'wb') as tmp_file:
+                tmp_file.write(read_compressed(info))
+            os.rename(tmp_path, path)
+        except BaseException:
+            _remove(tmp_path)  # a corrupted archive, a full disk, ...
+            raise
+        self._touched[path] = time.time()
+        self._evict(path)
+        return path
+
+    def touch(self, path):
+        """ Mark a decompressed file as used, if it was not marked for
+        `TOUCH_INTERVAL` seconds
+
+        :param str path: path to the decompressed HGT file
+        """
+        now = time.time()
+        if now - self._touched.get(path, 0) < self.TOUCH_INTERVAL:
+            return
+        self._touched[path] = now
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass  # removed by another process
+
+    def _scan(self):
+        """ List the decompressed files of the folder and remove the
+        temporary files of the dead processes
+
+        :return: list of tuples (modification time, path, size) of the
+            decompressed files, the least recently used first
+        :rtype: list
+        """
+        files = []
+        for filename in os.listdir(self.folder):
+            path = os.path.join(self.folder, filename)
+            if filename.endswith('.tmp'):
+                pid = filename.split('.', 1)[0]
+                if pid.isdigit() and not _is_alive(int(pid)):
+                    _remove(path)
+                continue
+            if not filename.endswith('.hgt'):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue  # removed by another process
+            files.append((stat.st_mtime, path, stat.st_size))
+        files.sort()
+        self.bytes = sum(size for _, _, size in files)
+        return files
+
+    def _evict(self, keep):
+        """ Remove the least recently used files of the folder until its
+        size is below `max_bytes`
+
+        :param str keep: path of the file which must not be removed
+        """
+        files = self._scan()
+        if self.max_bytes is None or self.bytes <= self.max_bytes:
+            return
+        for _, path, size in files:
+            if self.bytes <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            if _remove(path):  # existing mappings stay valid
+                self.bytes -= size
+
+
+def _is_alive(pid):
+    """ Check if a process is running
+
+    :param int pid: the id of the process
+    :rtype: bool
+    """
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno != errno.ESRCH
+    return True
+
+
+def _remove(path):
+    """ Remove a file, ignoring a file already removed
+
+    :param str path: path to the file
+    :return: True if the file was removed by this call
+    :rtype: bool
+    """
+    try:
+        os.remove(path)
+    except OSError:
+        return False
+    return True
+
+
+def _bilinear_weights(fractions):
+    return numpy.stack([1 - fractions, fractions], axis=-1)
+
+
+def _bicubic_weights(fractions):
+    """ Catmull-Rom weights of the samples at offset -1, 0, 1 and 2 """
+    t = fractions
+    t2, t3 = t * t, t * t * t
+    return numpy.stack([-t3 + 2 * t2 - t,
+                        3 * t3 - 5 * t2 + 2,
+                        -3 * t3 + 4 * t2 + t,
+                        t3 - t2], axis=-1) / 2
+
+
+#: offsets of the neighbour samples and weights function per interpolation
+INTERPOLATIONS = {
+    'bilinear': (numpy.arange(0, 2), _bilinear_weights),
+    'bicubic': (numpy.arange(-1, 3), _bicubic_weights)
+}
+
+
+#: offsets (dlat, dlng) of the tile and of its neighbours, the tile first
+NEIGHBOURS = [(0, 0)] + [(dlat, dlng) for dlat in (-1, 0, 1)
+                         for dlng in (-1, 0, 1) if dlat or dlng]
+
+
+def gather_around(tile, ys, xs, get_tile):
+    """ Get the elevation values at grid positions relative to a tile,
+    reading the neighbour tiles for the positions beyond its edges
+
+    :param tile: the tile the positions are relative to
+    :type tile: :class:`Tile`
+    :param ys: the zero based line numbers from the bottom of the tile
+        (between -1 and `samples` included)
+    :type ys: :class:`numpy.ndarray` of int
+    :param xs: the zero based column numbers from the left of the tile
+        (between -1 and `samples` included)
+    :type xs: :class:`numpy.ndarray` of int
+    :param get_tile: function returning the tile covering a (lat, lng) cell
+        or None
+    :return: the elevation values with NaN for void values and positions in
+        a missing neighbour or in a neighbour of a different resolution
+    :rtype: :class:`numpy.ndarray` of float
+
+    .. note:: getting a neighbour may evict and close `tile` from the cache
+        of the handler, so the values of `tile` are gathered first and each
+        neighbour is gathered as soon as it is got
+    """
+    step = tile.samples - 1
+    # the edges are shared with the neighbours, prefer the current tile
+    dlats = (ys > step).astype(numpy.intp) - (ys < 0)
+    dlngs = (xs > step).astype(numpy.intp) - (xs < 0)
+    values = numpy.full(ys.shape, numpy.nan)
+    for dlat, dlng in NEIGHBOURS:
+        mask = (dlats == dlat) & (dlngs == dlng)
+        if not mask.any():
+            continue
+        if dlat or dlng:
+            neighbour = get_tile((tile.lat + dlat, tile.lng + dlng))
+        else:
+            neighbour = tile
+        if neighbour is None or neighbour.samples != tile.samples:
+            continue
+        values[mask] = neighbour.gather(step - (ys[mask] - dlat * step),
+                                        xs[mask] - dlng * step)
+    return values
+
+
+def interpolate(tile, lats, lngs, interpolation, get_tile):
+    """ Interpolate the elevation of positions from the neighbour samples.
+    All the neighbours of all the positions are gathered at once, then
+    weighted and summed with a single array operation.
+
+    When a neighbour is void or missing, the elevation of the nearest
+    sample is returned instead.
+
+    :param tile: the tile containing the positions
+    :type tile: :class:`Tile`
+    :param lats: the latitudes of the positions
+    :type lats: :class:`numpy.ndarray` of float
+    :param lngs: the longitudes of the positions
+    :type lngs: :class:`numpy.ndarray` of float
+    :param str interpolation: `nearest`, `bilinear` or `bicubic`
+    :param get_tile: function returning the tile covering a (lat, lng) cell
+        or None, used for the neighbours beyond the edges of the tile
+    :return: the elevation values with NaN for void values
+    :rtype: :class:`numpy.ndarray` of float
+    """
+    if interpolation == 'nearest':
+        return tile.get_elevations(lats, lngs)
+
+    offsets, weights_func = INTERPOLATIONS[interpolation]
+    step = tile.samples - 1
+    ys = (lats - tile.lat) * step
+    xs = (lngs - tile.lng) * step
+    y0s, x0s = numpy.floor(ys), numpy.floor(xs)
+
+    neighbour_ys, neighbour_xs = numpy.broadcast_arrays(
+        y0s.astype(numpy.intp)[:, None, None] + offsets[None, :, None],
+        x0s.astype(numpy.intp)[:, None, None] + offsets[None, None, :]
+    )
+    neighbours = gather_around(tile, neighbour_ys, neighbour_xs, get_tile)
+    weights = weights_func(ys - y0s)[:, :, None] * \
+        weights_func(xs - x0s)[:, None, :]
+    elevations = (neighbours * weights).sum(axis=(1, 2))
+
+    # the nearest sample is one of the neighbours, it is always in the tile
+    missing = numpy.flatnonzero(numpy.isnan(elevations))
+    if len(missing):
+        elevations[missing] = neighbours[
+            missing,
+            (numpy.rint(ys[missing]) - y0s[missing]).astype(numpy.intp)
+            - offsets[0],
+            (numpy.rint(xs[missing]) - x0s[missing]).astype(numpy.intp)
+            - offsets[0]
+        ]
+    return elevations
+
+
+class TileFrequency(object):
+    """ Access counters of the tiles, halved every `half_life` seconds and
+    every `sample_size` accesses so that they follow the changes of the
+    traffic : a tile which is not used anymore is quickly caught up by a
+    newly used one.
+
+    The clock is only read every `CHECK_EVERY` accesses, an access is a dict
+    update. When `path` is set, the `count` most accessed tiles are saved to
+    this file every `interval` seconds (checked on access) to be loaded
+    first by the next start of the server. A forked worker process saves
+    its own counters to `<path>.<pid>`, the files of the workers are merged
+    into `path` by :func:`load`.
+
+    :param int half_life: time in seconds after which the counters are
+        halved
+    :param str path: path to the state file of the most accessed tiles
+    :param int interval: minimum time in seconds between two saves
+    :param int count: number of tiles saved
+    :param int sample_size: number of accesses after which the counters are
+        halved (None for no limit)
+    """
+    CHECK_EVERY = 1024
+
+    #: the counters below this value are removed when decayed
+    MIN_COUNT = 0.0625
+
+    #: counter of the most accessed tile restored by :func:`load`, the other
+    #: ones are scaled accordingly
+    RESTORED_COUNT = 4
+
+    def __init__(self, half_life=3600, path=None, interval=300, count=128,
+                 sample_size=None):
+        self.half_life = half_life
+        self.path = path
+        self.interval = interval
+        self.count = count
+        self.sample_size = sample_size
+        self.counts = {}
+        self._records = 0
+        self._samples = 0
+        self._decayed = self._saved = time.time()
+        self._pid = os.getpid()
+
+    def get(self, key):
+        """ Get the decayed number of accesses of a tile
+
+        :param key: the (lat, lng) of the tile
+        :rtype: float
+        """
+        return self.counts.get(key, 0)
+
+    def record(self, key):
+        """ Count an access to a tile
+
+        :param key: the (lat, lng) of the tile
+        """
+        self.counts[key] = self.counts.get(key, 0) + 1
+        self._samples += 1
+        if self.sample_size is not None \
+                and self._samples >= self.sample_size:
+            self._samples = 0
+            self.decay(0.5)
+        self._records += 1
+        if self._records >= self.CHECK_EVERY:
+            self._records = 0
+            self.tick()
+
+    def tick(self, now=None):
+        """ Decay the counters and save the state file when they are due
+
+        :param float now: the current timestamp, default to `time.time()`
+        """
+        now = time.time() if now is None else now
+        if now - self._decayed >= self.half_life:
+            self.decay(0.5 ** ((now - self._decayed) / self.half_life))
+            self._decayed = now
+        if self.path is not None and now - self._saved >= self.interval:
+            self._saved = now
+            self.save()
+
+    def decay(self, factor):
+        """ Multiply the counters by a factor and remove the negligible ones
+
+        :param float factor: the factor between 0 and 1
+        """
+        self.counts = dict((key, count * factor)
+                           for key, count in self.counts.items()
+                           if count * factor >= self.MIN_COUNT)
+
+    def hottest(self, count=None):
+        """ Get the most accessed tiles
+
+        :param int count: maximum number of tiles, default to `count`
+        :return: the (lat, lng) of the tiles, the most accessed first
+        :rtype: list of tuple(int, int)
+        """
+        keys = sorted(self.counts, key=lambda key: (-self.counts[key], key))
+        return keys[:self.count if count is None else count]
+
+    def save(self):
+        """ Write the most accessed tiles and their counters to the state
+        file, `<path>.<pid>` in a forked worker. The file is written then
+        renamed so that a partial file is never read. An error is logged
+        and ignored
+
+        :return: True if the file is written
+        :rtype: bool
+        """
+        path = self.path
+        if os.getpid() != self._pid:
+            path = '{}.{}'.format(self.path, os.getpid())
+        tiles = [[key[0], key[1], round(self.counts[key], 3)]
+                 for key in self.hottest()]
+        try:
+            handle, tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp'
+            )
+            with os.fdopen(handle, 'w') as tmp_file:
+                json.dump({'tiles': tiles}, tmp_file)
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as e:
+            logging.warning('the hot tiles are not saved to %s : %s',
+                            path, e)
+            return False
+        return True
+
+    def load(self):
+        """ Read the state file and the ones of the workers and restore the
+        counters of their tiles. The counters of the workers are summed and
+        they are scaled so that the most accessed tile gets
+        `RESTORED_COUNT` : they protect the saved tiles from the first
+        rarely used tiles without delaying for long a tile becoming more
+        used. The files of the workers are then merged into `path`. A
+        missing or invalid file is ignored (logged if invalid)
+
+        :return: the (lat, lng) of the saved tiles, the most accessed first
+        :rtype: list of tuple(int, int)
+        """
+        if self.path is None:
+            return []
+        worker_regex = re.compile(re.escape(os.path.basename(self.path)) +
+                                  r'\.\d+$')
+        folder = os.path.dirname(os.path.abspath(self.path))
+        worker_paths = [os.path.join(folder, filename)
+                        for filename in sorted(os.listdir(folder))
+                        if worker_regex.match(filename)] \
+            if os.path.isdir(folder) else []
+
+        counts = {}
+        for path in [self.path] + worker_paths:
+            for lat, lng, count in self._read(path):
+                counts[(lat, lng)] = counts.get((lat, lng), 0) + count
+        if not counts:
+            return []
+        scale = float(self.RESTORED_COUNT) / max(counts.values())
+        for key, count in counts.items():
+            self.counts[key] = count * scale
+        hottest = sorted(counts, key=lambda key: (-counts[key], key))
+
+        if worker_paths and self.save():
+            for path in worker_paths:
+                _remove(path)
+        return hottest
+
+    @staticmethod
+    def _read(path):
+        """ Read the tiles and the counters of a state file
+
+        :return: list of tuple (lat, lng, count), empty if the file is
+            missing or invalid
+        :rtype: list
+        """
+        if not os.path.isfile(path):
+            return []
+        try:
+            with open(path) as state_file:
+                return [(int(lat), int(lng), float(count))
+                        for lat, lng, count in json.load(state_file)['tiles']]
+        except (IOError, ValueError, KeyError, TypeError) as e:
+            logging.warning('the hot tiles file %s is ignored : %s', path, e)
+            return []
+
+
+class TileCache(object):
+    """ A bounded LRU cache of open :class:`Tile`
+
+    When one of the limits is exceeded, the least recently used tiles are
+    evicted and closed. The most recent tile is always kept even if it
+    alone exceeds `max_bytes`.
+
+    The pinned tiles (see :func:`add`) are never evicted and do not count
+    in the limits.
+
+    With `frequency`, the accesses are counted. With `admission` too, a
+    tile is only added to a full cache if it was accessed at least as often
+    as the least recently used tile, so that a scan of rarely used tiles
+    does not evict the frequently used ones. The last rejected tile is kept
+    apart, out of the limits, and it enters the cache once it is used as
+    often as the least recently used tile : a tile becoming frequently used
+    is not loaded again at each access meanwhile. The previous rejected
+    tile is closed.
+
+    :param int max_tiles: maximum number of tiles kept open (None for no
+        limit)
+    :param int max_bytes: maximum cumulated size in bytes of the tiles kept
+        open (None for no limit)
+    :param frequency: the access counters of the tiles
+    :type frequency: :class:`TileFrequency`
+    :param bool admission: if True, the tiles less frequently used than the
+        tile they would evict are not added
+    """
+    def __init__(self, max_tiles=None, max_bytes=None, frequency=None,
+                 admission=True):
+        self.max_tiles = max_tiles
+        self.max_bytes = max_bytes
+        self.frequency = frequency
+        self.admission = admission and frequency is not None
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejections = 0
+        self._tiles = collections.OrderedDict()
+        self._pinned = {}
+        self._pinned_bytes = 0
+        self._candidate = None
+
+    def __len__(self):
+        return len(self._tiles) + len(self._pinned) + \
+            (self._candidate is not None)
+
+    def __contains__(self, key):
+        return key in self._pinned or key in self._tiles or \
+            self._candidate is not None and self._candidate[0] == key
+
+    def get(self, key):
+        """ Get a cached tile and mark it as the most recently used
+
+        :param key: the key of the tile
+        :return: the tile or None if not cached
+        :rtype: :class:`Tile` or None
+        """
+        if self.frequency is not None:
+            self.frequency.record(key)
+        tile = self._pinned.get(key)
+        if tile is not None:
+            self.hits += 1
+            return tile
+        tile = self._tiles.pop(key, None)
+        if tile is None:
+            if self._candidate is None or self._candidate[0] != key:
+                self.misses += 1
+                return None
+            tile = self._candidate[1]
+            if self._is_rejected(key, tile):
+                self.hits += 1
+                return tile
+            self._candidate = None
+            self.bytes += tile.size
+            self._tiles[key] = tile
+            self._evict()
+            self.hits += 1
+            return tile
+        self._tiles[key] = tile
+        self.hits += 1
+        return tile
+
+    def add(self, key, tile, pin=False):
+        """ Add a tile to the cache and evict the least recently used
+        tiles if a limit is exceeded
+
+        :param key: the key of the tile
+        :param tile: the tile to cache
+        :type tile: :class:`Tile`
+        :param bool pin: if True, the tile is kept until :func:`clear`
+        :return: the added tile
+        :rtype: :class:`Tile`
+        """
+        if self._candidate is not None and (
+                self._candidate[0] == key or not pin and
+                self._is_rejected(key, tile)):
+            if self._candidate[1] is not tile:
+                self._candidate[1].close()
+            self._candidate = None
+        if not pin and self._is_rejected(key, tile):
+            self.rejections += 1
+            self._candidate = (key, tile)
+            return tile
+        previous = self._pinned.pop(key, None)
+        if previous is not None:
+            self._pinned_bytes -= previous.size
+        else:
+            previous = self._tiles.pop(key, None)
+        if previous is not None:
+            self.bytes -= previous.size
+            previous.close()
+        self.bytes += tile.size
+        if pin:
+            self._pinned[key] = tile
+            self._pinned_bytes += tile.size
+            return tile
+        self._tiles[key] = tile
+        self._evict()
+        return tile
+
+    def clear(self):
+        """ Close and remove all the cached tiles """
+        while self._tiles:
+            self._tiles.popitem(last=False)[1].close()
+        while self._pinned:
+            self._pinned.popitem()[1].close()
+        if self._candidate is not None:
+            self._candidate[1].close()
+            self._candidate = None
+        self.bytes = 0
+        self._pinned_bytes = 0
+
+    def stats(self):
+        """ Get the cache counters
+
+        :return: a dict with the `hits`, `misses`, `evictions`,
+            `rejections`, `tiles` and `bytes` values
+        :rtype: dict
+        """
+        candidate_bytes = self._candidate[1].size \
+            if self._candidate is not None else 0
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'rejections': self.rejections,
+                'tiles': len(self), 'bytes': self.bytes + candidate_bytes}
+
+    def _is_rejected(self, key, tile):
+        """ Check if a new tile would evict a more frequently used one """
+        if not self.admission or not self._tiles \
+                or key in self._tiles or key in self._pinned:
+            return False
+        full = self.max_tiles is not None \
+            and len(self._tiles) >= self.max_tiles
+        full = full or self.max_bytes is not None and \
+            self.bytes - self._pinned_bytes + tile.size > self.max_bytes
+        victim = next(iter(self._tiles))
+        return full and \
+            self.frequency.get(key) < self.frequency.get(victim)
+
+    def _is_full(self):
+        if self.max_tiles is not None and len(self._tiles) > self.max_tiles:
+            return True
+        return self.max_bytes is not None \
+            and self.bytes - self._pinned_bytes > self.max_bytes
+
+    def _evict(self):
+        while len(self._tiles) > 1 and self._is_full():
+            _, tile = self._tiles.popitem(last=False)
+            self.bytes -= tile.size
+            self.evictions += 1
+            tile.close()
@@ -28,10 +28,11 @@ setup(
     long_description=read('README.rst'),
     install_requires=[
         'celery', 'redis', 'webob', 'gevent', 'configobj',
-        'gmalthgtparser', 'routr', 'marshmallow', 'wsgicors'
+        'routr', 'marshmallow', 'wsgicors', 'numpy'
     ],
     extras_require={
-        'test': ['flake8', 'requests', 'pytest']
+        'test': ['flake8', 'requests', 'pytest'],
+        'postgres': ['psycopg2']
     },
     classifiers=[
         "Development Status :: 2 - Pre-Alpha",
@@ -46,6 +47,7 @@ setup(
         [console_scripts]
         gmalt-server = gmaltapi.admin:run_server
         gmalt-worker = gmaltapi.admin:run_worker
+        gmalt-pack = gmaltapi.admin:run_pack
 
         [services]
         celery = gmaltapi.task:GmaltCelery